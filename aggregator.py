@@ -0,0 +1,133 @@
+import logging
+import time
+
+from typing import *
+
+from models import *
+from candle_store import CandleStore
+from clock import Clock, SYSTEM_CLOCK
+from latency import TickTimes, TICK_CANDLE
+
+if TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+
+class CandleSeries: #candles of one contract / timeframe, built from the trades stream
+    def __init__(self, exchange: str, contract: Contract, timeframe: str, clock: Clock = SYSTEM_CLOCK):
+        self.exchange = exchange
+        self.clock = clock
+        self.contract = contract
+        self.tf = timeframe
+        self.tf_equiv = TF_EQUIV[timeframe] * 1000 #convert to milliseconds
+
+        self.candles = CandleStore()
+
+        self.strategies: Tuple["Strategy", ...] = () #replaced, never mutated, so the websocket thread can loop over it safely
+
+    def parse_trade(self, price: float, size: float, timestamp: int) -> str:
+        #3 cases: update same current candle, new candle, or new candle + missing candles
+
+        timestamp_diff = self.clock.now() - timestamp
+        if timestamp_diff >= 2000:
+            logger.warning("%s %s: %s milliseconds of difference between the current time and the trade time",
+                    self.exchange, self.contract.symbol, timestamp_diff)
+
+        last_candle = self.candles[-1]
+        last_ts = last_candle.timestamp
+
+        if timestamp < last_ts + self.tf_equiv: #same candle
+            self.candles.update_last(price, size) #new price will be close/last price of the candle
+
+            return "same_candle"
+
+        elif timestamp >= last_ts + 2 * self.tf_equiv: #missing candles
+
+            missing_candles = int((timestamp - last_ts) / self.tf_equiv) - 1 #how many we are missing
+
+            logger.info("%s missing %s candles for %s %s (%s %s)", self.exchange, missing_candles, self.contract.symbol, self.tf, timestamp, last_ts)
+
+            last_close = last_candle.close
+
+            for missing in range(missing_candles):
+                last_ts += self.tf_equiv
+                self.candles.append(last_ts, last_close, last_close, last_close, last_close, 0)
+
+            self.candles.append(last_ts + self.tf_equiv, price, price, price, price, size)
+
+            return "new_candle"
+
+
+        elif timestamp >= last_ts + self.tf_equiv: #new candle
+            self.candles.append(last_ts + self.tf_equiv, price, price, price, price, size)
+
+            logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
+
+            return "new_candle"
+
+
+class CandleAggregator: #one per exchange client, builds each (exchange, symbol, timeframe) series once for all its strategies
+    def __init__(self, client):
+        self._client = client
+
+        self._series: Dict[Tuple[str, str, str], CandleSeries] = {}
+        self._symbol_series: Dict[str, Tuple[CandleSeries, ...]] = {} #symbol -> series of all the timeframes, for on_trade()
+
+    def _index_symbol(self, symbol: str):
+        series = tuple(s for s in self._series.values() if s.contract.symbol == symbol)
+
+        if len(series) > 0:
+            self._symbol_series[symbol] = series
+        else:
+            self._symbol_series.pop(symbol, None)
+
+    def subscribe(self, strategy: "Strategy") -> bool:
+        #attaches the strategy to the shared series, the historical candles are only requested for a new series
+
+        key = (strategy.exchange, strategy.contract.symbol, strategy.tf)
+
+        series = self._series.get(key)
+
+        if series is None:
+            series = CandleSeries(strategy.exchange, strategy.contract, strategy.tf, strategy.clock)
+            series.candles.extend(self._client.get_historical_candles(strategy.contract, strategy.tf))
+
+            if len(series.candles) == 0:
+                return False
+
+            self._series[key] = series
+            self._index_symbol(strategy.contract.symbol)
+
+        strategy.series = series
+        strategy.candles = series.candles
+
+        series.strategies = series.strategies + (strategy,)
+
+        return True
+
+    def unsubscribe(self, strategy: "Strategy"):
+
+        key = (strategy.exchange, strategy.contract.symbol, strategy.tf)
+
+        series = self._series.get(key)
+        if series is None:
+            return
+
+        series.strategies = tuple(s for s in series.strategies if s is not strategy)
+
+        if len(series.strategies) == 0: #nobody uses the candles anymore
+            del self._series[key]
+            self._index_symbol(strategy.contract.symbol)
+
+    def on_trade(self, symbol: str, price: float, size: float, timestamp: int, tick: Optional[TickTimes] = None):
+        #tick: times of the message, see LatencyMonitor
+
+        for series in self._symbol_series.get(symbol, ()):
+            tick_type = series.parse_trade(price, size, timestamp)
+
+            if tick is not None:
+                tick[TICK_CANDLE] = time.time_ns()
+
+            for strat in series.strategies:
+                strat.on_candle_update(tick_type)
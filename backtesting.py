@@ -0,0 +1,163 @@
+import numpy as np
+
+from typing import *
+
+from candle_store import TS, OPEN, HIGH, LOW, CLOSE, VOLUME
+from indicators import rsi_series, macd_series
+
+
+class BacktestResult:
+    def __init__(self, trades: List[Dict], equity: np.ndarray):
+        self.trades = trades #closed trades, plus the last one if it is still open at the end of the data
+        self.equity = equity #balance after each closed trade, starting at 1
+
+        closed = [t for t in trades if t['status'] == "closed"]
+
+        self.trades_number = len(closed)
+        self.pnl = (equity[-1] - 1) * 100 #% of the initial balance
+        self.max_drawdown = float(np.max(1 - equity / np.maximum.accumulate(equity))) * 100
+        self.win_rate = (sum(1 for t in closed if t['pnl'] > 0) / len(closed) * 100) if len(closed) > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.trades_number} trades | PnL = {self.pnl:.2f}% | Max drawdown = {self.max_drawdown:.2f}% "
+                f"| Win rate = {self.win_rate:.1f}%")
+
+
+def _technical_signals(candles: np.ndarray, other_params: Dict) -> np.ndarray:
+    #same rules as TechnicalStrategy._check_signal(), computed for every closed candle at once
+
+    rsi = rsi_series(candles[CLOSE], other_params['rsi_length'])
+    macd_line, macd_signal = macd_series(candles[CLOSE], other_params['ema_fast'], other_params['ema_slow'],
+                                         other_params['ema_signal'])
+
+    signals = np.zeros(candles.shape[1], dtype=np.int8)
+    signals[(rsi < 30) & (macd_line > macd_signal)] = 1 #oversold
+    signals[(rsi > 70) & (macd_line < macd_signal)] = -1 #overbought
+
+    return signals
+
+
+def _breakout_signals(candles: np.ndarray, other_params: Dict) -> np.ndarray:
+    #BreakoutStrategy._check_signal() runs on every trade: the position is opened as soon as the price crosses the high
+    #(low) of the previous candle, not at the close. a candle whose high (low) went past is a signal
+    #the volume of the whole candle is compared to min_volume, the candles don't tell how much was traded before the
+    #crossing. when both sides are crossed the order is unknown, the long signal is kept like in _check_signal()
+
+    volume_ok = candles[VOLUME, 1:] > other_params['min_volume']
+
+    signals = np.zeros(candles.shape[1], dtype=np.int8)
+    signals[1:][(candles[LOW, 1:] < candles[LOW, :-1]) & volume_ok] = -1
+    signals[1:][(candles[HIGH, 1:] > candles[HIGH, :-1]) & volume_ok] = 1
+
+    return signals
+
+
+def _find_exit(candles: np.ndarray, start: int, side: int, tp_price: float, sl_price: float) -> Tuple[int, float, str]:
+    #first candle from start that touches the take profit or the stop loss
+    #the window grows so short trades only scan a few candles and long trades don't rescan from the beginning
+
+    n = candles.shape[1]
+    window = 256
+
+    while start < n:
+        end = min(start + window, n)
+
+        highs = candles[HIGH, start:end]
+        lows = candles[LOW, start:end]
+
+        if side == 1:
+            sl_hit = lows <= sl_price
+            tp_hit = highs >= tp_price
+        else:
+            sl_hit = highs >= sl_price
+            tp_hit = lows <= tp_price
+
+        hit = np.flatnonzero(sl_hit | tp_hit)
+
+        if len(hit) > 0:
+            i = hit[0]
+            idx = start + i
+            open_price = candles[OPEN, idx]
+
+            if sl_hit[i]: #if both are touched in the same candle we can't know the order, assume the worst
+                gapped = open_price <= sl_price if side == 1 else open_price >= sl_price
+                return idx, open_price if gapped else sl_price, "stop_loss"
+
+            gapped = open_price >= tp_price if side == 1 else open_price <= tp_price
+            return idx, open_price if gapped else tp_price, "take_profit"
+
+        start = end
+        window *= 4
+
+    return -1, candles[CLOSE, -1], "end"
+
+
+def run_backtest(strategy_type: str, candles: np.ndarray, take_profit: Optional[float], stop_loss: Optional[float],
+                 other_params: Dict, balance_pct: float = 100, fee_pct: float = 0, allow_short: bool = True) -> BacktestResult:
+    #candles is a (6, n) array ordered like CANDLE_COLUMNS, for example CandleStore.array or candles_to_array()
+    #Technical signals are checked when a candle closes and filled at the open of the next one (like check_trade() on
+    #"new_candle"), Breakout signals are filled at the previous high/low when the price crosses it during the candle,
+    #or at the open if the candle opened past it. the exits are looked for from the next candle
+
+    if candles.shape[1] < 2:
+        return BacktestResult([], np.ones(1))
+
+    if strategy_type == "Technical":
+        signals = _technical_signals(candles, other_params)
+    elif strategy_type == "Breakout":
+        signals = _breakout_signals(candles, other_params)
+    else:
+        raise ValueError(f"Unknown strategy type {strategy_type}")
+
+    if not allow_short: #binance spot can't open short positions
+        signals[signals == -1] = 0
+
+    signals[-1] = 0 #the last candle has no next candle to trade on
+    signal_idx = np.flatnonzero(signals)
+
+    trades = []
+    returns = []
+
+    next_allowed = 0 #only one position at a time, like Strategy.ongoing_position
+
+    while True:
+        k = np.searchsorted(signal_idx, next_allowed)
+        if k >= len(signal_idx):
+            break
+
+        i = signal_idx[k]
+        side = int(signals[i])
+
+        if strategy_type == "Technical":
+            entry_price = candles[OPEN, i + 1]
+        elif side == 1:
+            entry_price = max(candles[OPEN, i], candles[HIGH, i - 1])
+        else:
+            entry_price = min(candles[OPEN, i], candles[LOW, i - 1])
+
+        if side == 1:
+            tp_price = entry_price * (1 + take_profit / 100) if take_profit is not None else np.inf
+            sl_price = entry_price * (1 - stop_loss / 100) if stop_loss is not None else -np.inf
+        else:
+            tp_price = entry_price * (1 - take_profit / 100) if take_profit is not None else -np.inf
+            sl_price = entry_price * (1 + stop_loss / 100) if stop_loss is not None else np.inf
+
+        exit_idx, exit_price, reason = _find_exit(candles, i + 1, side, tp_price, sl_price)
+
+        trade_return = (exit_price / entry_price - 1) * side - 2 * fee_pct / 100
+
+        trade = {"entry_time": int(candles[TS, i + 1] if strategy_type == "Technical" else candles[TS, i]),
+                 "exit_time": int(candles[TS, exit_idx]), "side": "long" if side == 1 else "short",
+                 "entry_price": float(entry_price), "exit_price": float(exit_price), "exit_reason": reason,
+                 "pnl": float(trade_return * 100), "status": "open" if exit_idx == -1 else "closed"}
+        trades.append(trade)
+
+        if exit_idx == -1: #still open at the end of the data
+            break
+
+        returns.append(trade_return)
+        next_allowed = exit_idx #the strategy can look for a new signal once the position is closed
+
+    equity = np.cumprod(np.concatenate(([1.0], 1 + np.array(returns) * balance_pct / 100)))
+
+    return BacktestResult(trades, equity)
@@ -0,0 +1,510 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from types import SimpleNamespace
+from typing import *
+
+from connectors import decoding
+from connectors.binance import BinanceClient
+from connectors.bitmex import BitmexClient
+from connectors.balance_cache import BalanceCache
+from models import Balance, Candle, Contract
+from order_book import OrderBook, BookSide
+from clock import SimulatedClock
+from strategies import TechnicalStrategy
+from indicators import MACD, RSI
+from benchmarks.ingest import _offline_client
+
+#hot paths of the bot timed offline on synthetic fixtures, ops/second and latency percentiles of each operation
+#python -m benchmarks.hot_paths --output before.json
+#python -m benchmarks.hot_paths --compare before.json    (after a change, the regressions are flagged)
+
+RESULTS_DIRECTORY = os.path.join("benchmarks", "results")
+REGRESSION_THRESHOLD = 0.10 #slower by more than 10% of the ops/second
+
+TIMESTAMP = 1685622896000 #2023-06-01T12:34:56Z
+BITMEX_TIMESTAMP = "2023-06-01T12:34:56.789Z"
+
+#an operation factory gets the number of operations of the run and returns the operation, called without arguments.
+#the state is built again for every run, the operations that move the state forward (sequence ids, candles) can't
+#be replayed twice
+OperationFactory = Callable[[int], Callable[[], Any]]
+
+
+class _BenchClient: #what a strategy needs from its client to build candles, no orders are placed by these benchmarks
+    def __init__(self):
+        self.platform = "binance_futures"
+        self.futures = True
+        self.clock = SimulatedClock(TIMESTAMP) #no "difference between the current time and the trade time" warnings
+
+
+#fixtures
+
+def binance_futures_contract_info(symbol: str) -> Dict:
+    return {"symbol": symbol, "pair": symbol, "contractType": "PERPETUAL", "status": "TRADING", "baseAsset": symbol[:-4],
+            "quoteAsset": "USDT", "marginAsset": "USDT", "pricePrecision": 2, "quantityPrecision": 3,
+            "baseAssetPrecision": 8, "quotePrecision": 8, "underlyingType": "COIN", "triggerProtect": "0.0500",
+            "filters": [{"filterType": "PRICE_FILTER", "minPrice": "556.80", "maxPrice": "4529764", "tickSize": "0.10"},
+                        {"filterType": "LOT_SIZE", "stepSize": "0.001", "maxQty": "1000", "minQty": "0.001"}],
+            "orderTypes": ["LIMIT", "MARKET", "STOP", "STOP_MARKET", "TAKE_PROFIT", "TAKE_PROFIT_MARKET"],
+            "timeInForce": ["GTC", "IOC", "FOK", "GTX"]}
+
+
+def binance_spot_contract_info(symbol: str) -> Dict:
+    return {"symbol": symbol, "status": "TRADING", "baseAsset": symbol[:-4], "baseAssetPrecision": 8, "quoteAsset": "USDT",
+            "quotePrecision": 8, "orderTypes": ["LIMIT", "LIMIT_MAKER", "MARKET", "STOP_LOSS_LIMIT", "TAKE_PROFIT_LIMIT"],
+            "icebergAllowed": True, "isSpotTradingAllowed": True, "isMarginTradingAllowed": True,
+            "filters": [{"filterType": "PRICE_FILTER", "minPrice": "0.01000000", "maxPrice": "1000000.00000000", "tickSize": "0.01000000"},
+                        {"filterType": "LOT_SIZE", "minQty": "0.00001000", "maxQty": "9000.00000000", "stepSize": "0.00001000"},
+                        {"filterType": "ICEBERG_PARTS", "limit": 10},
+                        {"filterType": "MARKET_LOT_SIZE", "minQty": "0.00000000", "maxQty": "96.41778264", "stepSize": "0.00000000"},
+                        {"filterType": "TRAILING_DELTA", "minTrailingAboveDelta": 10, "maxTrailingAboveDelta": 2000},
+                        {"filterType": "PERCENT_PRICE_BY_SIDE", "bidMultiplierUp": "5", "bidMultiplierDown": "0.2"},
+                        {"filterType": "NOTIONAL", "minNotional": "5.00000000", "applyMinToMarket": True},
+                        {"filterType": "MAX_NUM_ORDERS", "maxNumOrders": 200}],
+            "permissions": ["SPOT", "MARGIN"]}
+
+
+def bitmex_contract_info(symbol: str) -> Dict:
+    return {"symbol": symbol, "rootSymbol": symbol[:3], "state": "Open", "typ": "FFWCSX", "quoteCurrency": "USD",
+            "underlying": symbol[:3], "settlCurrency": "XBt", "tickSize": 0.5, "lotSize": 100, "multiplier": -100000000,
+            "isQuanto": False, "isInverse": True, "initMargin": 0.01, "maintMargin": 0.0035, "makerFee": -0.0001,
+            "takerFee": 0.0005, "fundingRate": 0.0001, "markPrice": 25000.5, "lastPrice": 25000, "volume24h": 1000000}
+
+
+def _symbols(n: int) -> List[str]:
+    return ["SYM%dUSDT" % i for i in range(n)]
+
+
+#websocket messages: json parsing + _on_message of the client
+
+def _message_benchmark(client_factory: Callable, frame_factory: Callable[[int], str]) -> OperationFactory:
+    def factory(n: int):
+        client = client_factory()
+        frames = iter([frame_factory(i) for i in range(n)])
+        on_message = client._on_message
+        return lambda: on_message(None, next(frames))
+    return factory
+
+
+def _binance_client():
+    client = _offline_client(BinanceClient)
+
+    #synced book, the diffs of binance_depth_frame() continue its sequence
+    book = OrderBook("BTCUSDT", futures=True)
+    book.load_snapshot([[f"{25000 - i * 0.1:.1f}", "1.000"] for i in range(1000)],
+                       [[f"{25000.1 + i * 0.1:.1f}", "1.000"] for i in range(1000)], 1001)
+    client.order_books["BTCUSDT"] = book
+
+    return client
+
+
+def binance_book_ticker_frame(i: int) -> str:
+    price = 25000 + (i % 100) * 0.1
+    return json.dumps({"e": "bookTicker", "u": 400900217 + i, "E": TIMESTAMP + i, "T": TIMESTAMP + i, "s": "BTCUSDT",
+                       "b": f"{price:.1f}", "B": "31.21000000", "a": f"{price + 0.1:.1f}", "A": "40.66000000"})
+
+
+def binance_agg_trade_frame(i: int) -> str:
+    price = 25000 + (i % 100) * 0.1
+    return json.dumps({"e": "aggTrade", "E": TIMESTAMP + i, "a": 424951 + i, "s": "BTCUSDT", "p": f"{price:.1f}",
+                       "q": "0.001", "f": 50000 + i, "l": 50000 + i, "T": TIMESTAMP + i, "m": i % 2 == 0})
+
+
+def binance_depth_frame(i: int) -> str:
+    bid = 25000 - (i % 50) * 0.1
+    ask = 25000.1 + (i % 50) * 0.1
+    return json.dumps({"e": "depthUpdate", "E": TIMESTAMP + i, "T": TIMESTAMP + i, "s": "BTCUSDT",
+                       "U": 1001 + i, "u": 1001 + i, "pu": 1000 + i,
+                       "b": [[f"{bid:.1f}", "2.500"], [f"{bid - 5:.1f}", "0.000"]],
+                       "a": [[f"{ask:.1f}", "1.200"], [f"{ask + 5:.1f}", "0.000"]]})
+
+
+def _bitmex_client():
+    client = _offline_client(BitmexClient)
+
+    client.balance_cache = BalanceCache(dict)
+    client.balance_cache.set("XBt", Balance({"initMargin": 0, "maintMargin": 0, "marginBalance": 100000000,
+                                             "walletBalance": 100000000, "unrealisedPnl": 0}, "bitmex"))
+
+    book = OrderBook("XBTUSD")
+    book.apply_l2("partial", [{"symbol": "XBTUSD", "id": 1000 + i, "side": "Sell" if i < 50 else "Buy",
+                               "size": 1000, "price": 25050 - i * 0.5} for i in range(100)])
+    client.order_books["XBTUSD"] = book
+
+    return client
+
+
+def bitmex_instrument_frame(i: int) -> str:
+    price = 25000 + (i % 100) * 0.5
+    return json.dumps({"table": "instrument", "action": "update",
+                       "data": [{"symbol": "XBTUSD", "bidPrice": price, "askPrice": price + 0.5, "timestamp": BITMEX_TIMESTAMP}]})
+
+
+def bitmex_trade_frame(i: int) -> str:
+    price = 25000 + (i % 100) * 0.5
+    return json.dumps({"table": "trade", "action": "insert",
+                       "data": [{"timestamp": BITMEX_TIMESTAMP, "symbol": "XBTUSD", "side": "Buy" if i % 2 == 0 else "Sell",
+                                 "size": 100, "price": price, "tickDirection": "PlusTick",
+                                 "trdMatchID": "00000000-0000-0000-0000-000000000000",
+                                 "grossValue": 400000, "homeNotional": 0.004, "foreignNotional": 100}]})
+
+
+def bitmex_order_book_frame(i: int) -> str:
+    return json.dumps({"table": "orderBookL2", "action": "update",
+                       "data": [{"symbol": "XBTUSD", "id": 1000 + i % 100, "side": "Sell" if i % 100 < 50 else "Buy",
+                                 "size": 500 + i % 1000, "timestamp": BITMEX_TIMESTAMP}]})
+
+
+def bitmex_margin_frame(i: int) -> str:
+    return json.dumps({"table": "margin", "action": "update",
+                       "data": [{"account": 1, "currency": "XBt", "marginBalance": 100000000 + i, "unrealisedPnl": i,
+                                 "timestamp": BITMEX_TIMESTAMP}]})
+
+
+def _json_benchmark(frame_factory: Callable[[int], str]) -> OperationFactory:
+    def factory(n: int):
+        frames = iter([frame_factory(i) for i in range(n)])
+        loads = decoding.loads
+        return lambda: loads(next(frames))
+    return factory
+
+
+#candles built from the trades: Strategy.parse_trades()
+
+def _candle_strategy(history: int, timeframe: str = "1m") -> TechnicalStrategy:
+    strategy = TechnicalStrategy(_BenchClient(), Contract(binance_futures_contract_info("BTCUSDT"), "binance_futures"),
+                                 "Binance", timeframe, 10, 1, 1, {"ema_fast": 12, "ema_slow": 26, "ema_signal": 9, "rsi_length": 14})
+
+    random.seed(1)
+    price = 25000
+    candles = []
+
+    for i in range(history):
+        price *= 1 + random.gauss(0, 0.002)
+        candles.append(Candle([TIMESTAMP - (history - i) * 60000, price, price * 1.001, price * 0.999, price, 10], timeframe, "binance_futures"))
+
+    strategy.candles.extend(candles)
+
+    return strategy
+
+
+def _parse_trades_benchmark(step: int) -> OperationFactory:
+    #step: candles between two trades, 0 same candle, 1 new candle, more than 1 missing candles
+    def factory(n: int):
+        strategy = _candle_strategy(1000)
+        clock = strategy.client.clock
+        state = {"ts": int(strategy.candles[-1].timestamp)}
+
+        def op():
+            state["ts"] += step * 60000
+            clock.set(state["ts"])
+            return strategy.parse_trades(25000.5, 0.01, state["ts"])
+
+        return op
+    return factory
+
+
+#indicators of the technical strategy
+
+def _indicators_warmup_benchmark(history: int) -> OperationFactory:
+    #RSI and MACD computed over the whole history, what a strategy does when it starts
+    def factory(n: int):
+        strategy = _candle_strategy(history)
+
+        def op():
+            strategy._rsi_state = RSI(strategy._rsi_length)
+            strategy._macd_state = MACD(strategy._ema_fast, strategy._ema_slow, strategy._ema_signal)
+            strategy._candles_fed = 0
+            strategy._update_indicators()
+            return strategy._rsi(), strategy._macd()
+
+        return op
+    return factory
+
+
+def _indicators_new_candle_benchmark(history: int) -> OperationFactory:
+    #RSI and MACD after each new candle, what check_trade() does on the hot path
+    def factory(n: int):
+        strategy = _candle_strategy(history)
+        strategy._update_indicators()
+        candles = strategy.candles
+        state = {"ts": int(candles[-1].timestamp)}
+
+        def op():
+            state["ts"] += 60000
+            candles.append(state["ts"], 25000, 25001, 24999, 25000.5, 1)
+            strategy._update_indicators()
+            return strategy._rsi(), strategy._macd()
+
+        return op
+    return factory
+
+
+#order book levels
+
+def _book_level_benchmark(levels: int) -> OperationFactory:
+    #a level removed and another one added at a random place of a book of `levels` levels, the worst case of an update
+    def factory(n: int):
+        book_side = BookSide(descending=False)
+        prices = [round(20000 + i * 0.5, 1) for i in range(levels)]
+        for price in prices:
+            book_side.update(price, 1.0)
+
+        rnd = random.Random(levels)
+        moves = [rnd.randrange(levels) for _ in range(n)]
+        state = {"i": 0}
+
+        def op():
+            price = prices[moves[state["i"]]]
+            state["i"] += 1
+            book_side.update(price, 0)
+            book_side.update(price, 2.0)
+
+        return op
+    return factory
+
+
+#models built from the exchange payloads
+
+def _model_benchmark(build: Callable[[], Any]) -> OperationFactory:
+    return lambda n: build
+
+
+_BINANCE_KLINE = [TIMESTAMP, "25000.10", "25010.00", "24990.50", "25005.20", "152.334", TIMESTAMP + 59999, "3808350.12", 1520,
+                  "80.112", "2002846.55", "0"]
+_BITMEX_BUCKET = {"timestamp": BITMEX_TIMESTAMP, "symbol": "XBTUSD", "open": 25000, "high": 25010, "low": 24990.5,
+                  "close": 25005, "trades": 1520, "volume": 3808300, "vwap": 25001.2, "lastSize": 100, "turnover": 15233400000,
+                  "homeNotional": 152.334, "foreignNotional": 3808300}
+_BINANCE_FUTURES_CONTRACT = binance_futures_contract_info("BTCUSDT")
+_BINANCE_SPOT_CONTRACT = binance_spot_contract_info("BTCUSDT")
+_BITMEX_CONTRACT = bitmex_contract_info("XBTUSD")
+
+
+#UI refresh of the watchlist prices, Root._update_ui()
+
+class _Label: #the tkinter widgets need a display, the Tk calls themselves are not measured
+    def __init__(self, text: str):
+        self._text = text
+
+    def cget(self, option: str) -> str:
+        return self._text
+
+
+class _StringVar:
+    def __init__(self):
+        self.value = ""
+
+    def set(self, value: str):
+        self.value = value
+
+
+def _update_ui_benchmark(watchlist_size: int) -> OperationFactory:
+    def factory(n: int):
+        from interface.root_component import Root #tkinter + tkmacosx, see requirements.txt
+
+        binance_contracts = {symbol: Contract(binance_futures_contract_info(symbol), "binance_futures")
+                             for symbol in _symbols(watchlist_size // 2)}
+        bitmex_contracts = {symbol: Contract(bitmex_contract_info(symbol), "bitmex")
+                            for symbol in ["XBT%d" % i for i in range(watchlist_size - watchlist_size // 2)]}
+
+        binance = SimpleNamespace(logs=[], strategies={}, contracts=binance_contracts, ready=True, ws_connected=True,
+                                  ws_subscriptions={"bookTicker": set(binance_contracts)},
+                                  prices={symbol: {'bid': 25000.1, 'ask': 25000.2} for symbol in binance_contracts})
+        bitmex = SimpleNamespace(logs=[], strategies={}, contracts=bitmex_contracts,
+                                 prices={symbol: {'bid': 25000.5, 'ask': 25001} for symbol in bitmex_contracts})
+
+        rows = [(symbol, "Binance") for symbol in binance_contracts] + [(symbol, "Bitmex") for symbol in bitmex_contracts]
+        body_widgets = {'symbol': {}, 'exchange': {}, 'bid_var': {}, 'ask_var': {}}
+
+        for b_index, (symbol, exchange) in enumerate(rows):
+            body_widgets['symbol'][b_index] = _Label(symbol)
+            body_widgets['exchange'][b_index] = _Label(exchange)
+            body_widgets['bid_var'][b_index] = _StringVar()
+            body_widgets['ask_var'][b_index] = _StringVar()
+
+        root = SimpleNamespace(binance=binance, bitmex=bitmex, _binance_contracts=binance_contracts, _bitmex_contracts=bitmex_contracts,
+                               _watchlist_frame=SimpleNamespace(body_widgets=body_widgets),
+                               _trades_frame=SimpleNamespace(body_widgets={'symbol': {}}),
+                               after=lambda delay, callback: None, _update_ui=None) #not scheduled again
+
+        return lambda: Root._update_ui(root)
+    return factory
+
+
+#(name, operation factory, operations per run)
+BENCHMARKS: List[Tuple[str, OperationFactory, int]] = [
+    ("json/binance/bookTicker", _json_benchmark(binance_book_ticker_frame), 50000),
+    ("json/binance/aggTrade", _json_benchmark(binance_agg_trade_frame), 50000),
+    ("json/binance/depthUpdate", _json_benchmark(binance_depth_frame), 50000),
+    ("json/bitmex/instrument", _json_benchmark(bitmex_instrument_frame), 50000),
+    ("json/bitmex/trade", _json_benchmark(bitmex_trade_frame), 50000),
+    ("on_message/binance/bookTicker", _message_benchmark(_binance_client, binance_book_ticker_frame), 50000),
+    ("on_message/binance/aggTrade", _message_benchmark(_binance_client, binance_agg_trade_frame), 50000),
+    ("on_message/binance/depthUpdate", _message_benchmark(_binance_client, binance_depth_frame), 20000),
+    ("on_message/bitmex/instrument", _message_benchmark(_bitmex_client, bitmex_instrument_frame), 50000),
+    ("on_message/bitmex/trade", _message_benchmark(_bitmex_client, bitmex_trade_frame), 50000),
+    ("on_message/bitmex/orderBookL2", _message_benchmark(_bitmex_client, bitmex_order_book_frame), 50000),
+    ("on_message/bitmex/margin", _message_benchmark(_bitmex_client, bitmex_margin_frame), 50000),
+    ("parse_trades/same_candle", _parse_trades_benchmark(0), 50000),
+    ("parse_trades/new_candle", _parse_trades_benchmark(1), 20000),
+    ("parse_trades/missing_candles", _parse_trades_benchmark(3), 10000),
+    ("indicators/warmup/100", _indicators_warmup_benchmark(100), 2000),
+    ("indicators/warmup/1000", _indicators_warmup_benchmark(1000), 200),
+    ("indicators/warmup/5000", _indicators_warmup_benchmark(5000), 50),
+    ("indicators/new_candle/100", _indicators_new_candle_benchmark(100), 20000),
+    ("indicators/new_candle/1000", _indicators_new_candle_benchmark(1000), 20000),
+    ("indicators/new_candle/5000", _indicators_new_candle_benchmark(5000), 20000),
+    ("order_book/level/1000", _book_level_benchmark(1000), 50000),
+    ("order_book/level/20000", _book_level_benchmark(20000), 50000),
+    ("order_book/level/100000", _book_level_benchmark(100000), 50000),
+    ("models/candle/binance", _model_benchmark(lambda: Candle(_BINANCE_KLINE, "1m", "binance_futures")), 100000),
+    ("models/candle/bitmex", _model_benchmark(lambda: Candle(_BITMEX_BUCKET, "1m", "bitmex")), 100000),
+    ("models/contract/binance_futures", _model_benchmark(lambda: Contract(_BINANCE_FUTURES_CONTRACT, "binance_futures")), 100000),
+    ("models/contract/binance_spot", _model_benchmark(lambda: Contract(_BINANCE_SPOT_CONTRACT, "binance_spot")), 100000),
+    ("models/contract/bitmex", _model_benchmark(lambda: Contract(_BITMEX_CONTRACT, "bitmex")), 100000),
+    ("update_ui/watchlist/50", _update_ui_benchmark(50), 2000),
+    ("update_ui/watchlist/500", _update_ui_benchmark(500), 200),
+    ("update_ui/watchlist/2000", _update_ui_benchmark(2000), 50),
+]
+
+
+#runner
+
+def _timer_overhead() -> int:
+    #nanoseconds taken by two perf_counter_ns() calls, removed from the latencies
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(1000):
+        start = clock()
+        samples.append(clock() - start)
+    return min(samples)
+
+
+def _percentile(sorted_values: List[int], pct: float) -> int:
+    return sorted_values[min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)]
+
+
+def run_benchmark(factory: OperationFactory, ops: int, repeat: int = 3, overhead: int = 0) -> Dict[str, float]:
+    #throughput: best of `repeat` tight loops. latency: one more run with every operation timed on its own
+
+    best = 0
+    for _ in range(repeat):
+        op = factory(ops)
+
+        start = time.perf_counter()
+        for _ in range(ops):
+            op()
+        elapsed = time.perf_counter() - start
+
+        best = max(best, ops / elapsed)
+
+    op = factory(ops)
+    clock = time.perf_counter_ns
+    latencies = [0] * ops
+
+    for i in range(ops):
+        start = clock()
+        op()
+        latencies[i] = clock() - start
+
+    latencies.sort()
+
+    return {"ops": ops, "ops_per_sec": best,
+            "p50_us": max(_percentile(latencies, 50) - overhead, 0) / 1000,
+            "p90_us": max(_percentile(latencies, 90) - overhead, 0) / 1000,
+            "p99_us": max(_percentile(latencies, 99) - overhead, 0) / 1000,
+            "max_us": max(latencies[-1] - overhead, 0) / 1000}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: Dict[str, Dict], previous: Dict[str, Dict], threshold: float) -> List[str]:
+    #names of the benchmarks slower than the previous results by more than threshold
+    regressions = []
+
+    print(f"\n{'benchmark':40} {'before':>14} {'after':>14} {'change':>8}")
+
+    for name, result in results.items():
+        if name not in previous:
+            continue
+
+        change = result['ops_per_sec'] / previous[name]['ops_per_sec'] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        print(f"{name:40} {previous[name]['ops_per_sec']:14,.0f} {result['ops_per_sec']:14,.0f} {change:+8.1%}{flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path benchmarks, offline on synthetic fixtures")
+    parser.add_argument("--filter", default="", help="only the benchmarks whose name contains this")
+    parser.add_argument("--scale", type=float, default=1, help="multiplies the operations per run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json-backend", choices=list(decoding.JSON_BACKENDS.keys()), default=decoding.JSON_BACKEND)
+    parser.add_argument("--output", default=None, help=f"results file, by default a new file in {RESULTS_DIRECTORY}")
+    parser.add_argument("--compare", default=None, help="results file of a previous run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    decoding.set_json_backend(args.json_backend)
+
+    overhead = _timer_overhead()
+    results = {}
+
+    print(f"{'benchmark':40} {'ops/s':>14} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>10}")
+
+    for name, factory, ops in BENCHMARKS:
+        if args.filter not in name:
+            continue
+
+        try:
+            result = run_benchmark(factory, max(int(ops * args.scale), 1), args.repeat, overhead)
+        except ImportError as e: #the UI modules need the packages of requirements.txt
+            print(f"{name:40} skipped: {e}")
+            continue
+
+        results[name] = result
+        print(f"{name:40} {result['ops_per_sec']:14,.0f} {result['p50_us']:9.2f} {result['p90_us']:9.2f} "
+              f"{result['p99_us']:9.2f} {result['max_us']:10.1f}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, "hot_paths_" + time.strftime("%Y%m%d_%H%M%S") + ".json")
+
+    with open(output, "w") as f:
+        json.dump({"time": int(time.time()), "commit": _git_commit(), "python": sys.version.split()[0],
+                   "platform": platform.platform(), "machine": platform.machine(), "json_backend": args.json_backend,
+                   "results": results}, f, indent=2)
+
+    print(f"\nResults saved to {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+        regressions = compare(results, previous, args.threshold)
+
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} benchmarks slower by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
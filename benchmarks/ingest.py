@@ -0,0 +1,109 @@
+import argparse
+import collections
+import json
+import tempfile
+import time
+
+from typing import *
+
+from connectors import decoding
+from connectors.binance import BinanceClient
+from connectors.bitmex import BitmexClient
+from tick_recorder import TickRecorder
+
+#messages/second ceiling of the websocket ingest thread, run offline on synthetic frames: python -m benchmarks.ingest
+
+
+class _NullAggregator: #the candle building is measured separately, only the message handling is timed here
+    def on_trade(self, symbol: str, price: float, size: float, timestamp: int, tick=None):
+        pass
+
+
+def _offline_client(client_class):
+    #client with only the state _on_message needs, no REST requests and no websocket connection
+    client = client_class.__new__(client_class)
+    client.prices = dict()
+    client.aggregator = _NullAggregator()
+    client._symbol_strategies = dict()
+    client._order_rows = collections.OrderedDict()
+    client.order_books = dict()
+    client.tick_recorder = None
+    client.simulators = ()
+    client.platform = "binance_futures" if client_class is BinanceClient else "bitmex"
+    return client
+
+
+def binance_frames(n: int) -> List[str]:
+    frames = []
+    for i in range(n):
+        price = 25000 + (i % 100) * 0.1
+        if i % 2 == 0:
+            frames.append(json.dumps({"e": "bookTicker", "u": 400900217 + i, "E": 1568014460893, "T": 1568014460891,
+                                      "s": "BTCUSDT", "b": f"{price:.1f}", "B": "31.21000000",
+                                      "a": f"{price + 0.1:.1f}", "A": "40.66000000"}))
+        else:
+            frames.append(json.dumps({"e": "aggTrade", "E": 1591261134288, "a": 424951 + i, "s": "BTCUSDT",
+                                      "p": f"{price:.1f}", "q": "0.001", "f": 50000 + i, "l": 50000 + i,
+                                      "T": 1591261134199 + i, "m": False}))
+    return frames
+
+
+def bitmex_frames(n: int) -> List[str]:
+    frames = []
+    for i in range(n):
+        price = 25000 + (i % 100) * 0.5
+        if i % 2 == 0:
+            frames.append(json.dumps({"table": "instrument", "action": "update",
+                                      "data": [{"symbol": "XBTUSD", "bidPrice": price, "askPrice": price + 0.5,
+                                                "timestamp": "2023-06-01T12:34:56.789Z"}]}))
+        else:
+            frames.append(json.dumps({"table": "trade", "action": "insert",
+                                      "data": [{"timestamp": "2023-06-01T12:34:56.789Z", "symbol": "XBTUSD", "side": "Buy",
+                                                "size": 100, "price": price, "tickDirection": "PlusTick",
+                                                "trdMatchID": "00000000-0000-0000-0000-000000000000",
+                                                "grossValue": 400000, "homeNotional": 0.004, "foreignNotional": 100}]}))
+    return frames
+
+
+def measure(handler: Callable, frames: List[str], repeat: int = 3) -> float:
+    #best of `repeat` runs, in messages per second
+    best = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            handler(None, frame)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(frames) / elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Websocket ingest messages/second")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--record", action="store_true", help="with the tick recorder writing to a temporary directory")
+    args = parser.parse_args()
+
+    binance = _offline_client(BinanceClient)
+    bitmex = _offline_client(BitmexClient)
+
+    recorder = None
+    if args.record:
+        recorder = TickRecorder(tempfile.mkdtemp())
+        binance.record_ticks(recorder)
+        bitmex.record_ticks(recorder)
+
+    frames = {"binance": binance_frames(args.messages), "bitmex": bitmex_frames(args.messages)}
+
+    for backend in decoding.JSON_BACKENDS:
+        decoding.set_json_backend(backend)
+
+        for name, client in [("binance", binance), ("bitmex", bitmex)]:
+            print(f"{name:8} {backend:7} {measure(client._on_message, frames[name]):12,.0f} msg/s")
+
+    if recorder is not None:
+        recorder.close()
+        print(f"{recorder.records_written:,} records written to {recorder.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import logging
+import sqlite3
+import time
+
+import numpy as np
+
+from typing import *
+
+from models import Candle, TF_EQUIV
+
+logger = logging.getLogger()
+
+HISTORY_PATH = "candles.db"
+
+TIMEFRAME_MS = {tf: seconds * 1000 for tf, seconds in TF_EQUIV.items()}
+TIMEFRAME_MS["1d"] = 86400000
+
+CANDLES_PAGE_SIZE = 1000 #candles per request, the most binance spot and bitmex return (and the best weight per candle on binance futures)
+
+#fetch_page(start, end) -> candles from the open timestamp start (ms) in ascending order, None if the request failed
+PageFetcher = Callable[[int, int], Optional[List[Candle]]]
+
+
+class CandleHistory:
+    #candles downloaded from the exchanges, kept on disk by (source, symbol, timeframe)
+    #one integer + 5 floats per candle in a WITHOUT ROWID table, the series key is stored once in candle_series
+    #candle_ranges records which timestamps were already downloaded, so only the missing ones are requested again
+
+    def __init__(self, path: str = HISTORY_PATH):
+        self._path = path #own connections, the candles are saved from the strategies and downloader threads
+        self._series_ids: Dict[Tuple[str, str, str], int] = {}
+
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS candle_series (id INTEGER PRIMARY KEY, source TEXT, symbol TEXT, tf TEXT, "
+                     "UNIQUE (source, symbol, tf))")
+        conn.execute("CREATE TABLE IF NOT EXISTS candles (series INTEGER, timestamp INTEGER, open REAL, high REAL, low REAL, "
+                     "close REAL, volume REAL, PRIMARY KEY (series, timestamp)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS candle_ranges (series INTEGER, start INTEGER, end INTEGER)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def _series_id(self, conn: sqlite3.Connection, source: str, symbol: str, tf: str) -> int:
+        key = (source, symbol, tf)
+
+        series_id = self._series_ids.get(key)
+
+        if series_id is None:
+            conn.execute("INSERT OR IGNORE INTO candle_series (source, symbol, tf) VALUES (?, ?, ?)", key)
+            series_id = conn.execute("SELECT id FROM candle_series WHERE source = ? AND symbol = ? AND tf = ?", key).fetchone()[0]
+            self._series_ids[key] = series_id
+
+        return series_id
+
+    def _ranges(self, conn: sqlite3.Connection, series_id: int, start: int, end: int) -> List[Tuple[int, int]]:
+        return conn.execute("SELECT start, end FROM candle_ranges WHERE series = ? AND end >= ? AND start <= ? ORDER BY start",
+                            (series_id, start, end)).fetchall()
+
+    def _add_range(self, conn: sqlite3.Connection, series_id: int, tf_ms: int, start: int, end: int):
+        #merged with the ranges it overlaps or touches, the table stays small however the candles were downloaded
+        ranges = self._ranges(conn, series_id, start - tf_ms, end + tf_ms)
+
+        for range_start, range_end in ranges:
+            start = min(start, range_start)
+            end = max(end, range_end)
+
+        conn.execute("DELETE FROM candle_ranges WHERE series = ? AND end >= ? AND start <= ?", (series_id, start, end))
+        conn.execute("INSERT INTO candle_ranges (series, start, end) VALUES (?, ?, ?)", (series_id, start, end))
+
+    def missing(self, source: str, symbol: str, tf: str, start: int, end: int) -> List[Tuple[int, int]]:
+        #(start, end) open timestamps of the candles between start and end that were never downloaded
+
+        tf_ms = TIMEFRAME_MS[tf]
+        start = start // tf_ms * tf_ms
+        end = end // tf_ms * tf_ms
+
+        conn = self._connect()
+        ranges = self._ranges(conn, self._series_id(conn, source, symbol, tf), start, end)
+        conn.commit()
+        conn.close()
+
+        gaps = []
+        cursor = start
+
+        for range_start, range_end in ranges:
+            if range_start > cursor:
+                gaps.append((cursor, range_start - tf_ms))
+            cursor = max(cursor, range_end + tf_ms)
+
+        if cursor <= end:
+            gaps.append((cursor, end))
+
+        return gaps
+
+    def save(self, source: str, symbol: str, tf: str, candles: Iterable[Candle], start: int, end: int):
+        #candles downloaded for the open timestamps start to end (included), the last one may still be open
+        #only the closed candles are marked as downloaded, the open one is requested again next time
+
+        tf_ms = TIMEFRAME_MS[tf]
+        last_closed = (int(time.time() * 1000) // tf_ms - 1) * tf_ms
+
+        conn = self._connect()
+        series_id = self._series_id(conn, source, symbol, tf)
+
+        conn.executemany("INSERT OR REPLACE INTO candles (series, timestamp, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         ((series_id, int(c.timestamp), c.open, c.high, c.low, c.close, c.volume) for c in candles))
+
+        end = min(end, last_closed)
+        if end >= start:
+            self._add_range(conn, series_id, tf_ms, start, end)
+
+        conn.commit()
+        conn.close()
+
+    def fill(self, source: str, symbol: str, tf: str, fetch_page: PageFetcher, start: int, end: Optional[int] = None) -> bool:
+        #downloads the missing candles between start and end (now if None) page after page, False if a request failed
+
+        tf_ms = TIMEFRAME_MS[tf]
+
+        if end is None:
+            end = int(time.time() * 1000)
+
+        for gap_start, gap_end in self.missing(source, symbol, tf, start, end):
+            cursor = gap_start
+
+            while cursor <= gap_end:
+                candles = fetch_page(cursor, gap_end)
+
+                if candles is None:
+                    return False
+
+                candles = [c for c in candles if cursor <= c.timestamp <= gap_end]
+
+                if len(candles) == 0: #no trading in this period (or before the listing of the contract)
+                    self.save(source, symbol, tf, [], cursor, gap_end)
+                    break
+
+                self.save(source, symbol, tf, candles, cursor, candles[-1].timestamp)
+                cursor = candles[-1].timestamp + tf_ms
+
+        return True
+
+    def _select(self, source: str, symbol: str, tf: str, start: Optional[int], end: Optional[int]) -> List[Tuple]:
+        conn = self._connect()
+        series_id = self._series_id(conn, source, symbol, tf)
+
+        rows = conn.execute("SELECT timestamp, open, high, low, close, volume FROM candles WHERE series = ? AND timestamp >= ? "
+                            "AND timestamp <= ? ORDER BY timestamp",
+                            (series_id, start if start is not None else 0, end if end is not None else 2 ** 62)).fetchall()
+        conn.commit()
+        conn.close()
+
+        return rows
+
+    def load(self, source: str, symbol: str, tf: str, start: Optional[int] = None, end: Optional[int] = None) -> List[Candle]:
+        return [Candle(row, tf, "history") for row in self._select(source, symbol, tf, start, end)]
+
+    def load_array(self, source: str, symbol: str, tf: str, start: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        #(6, n) array ordered like CANDLE_COLUMNS, for the backtester. years of 1m candles without Candle objects
+        rows = self._select(source, symbol, tf, start, end)
+
+        if len(rows) == 0:
+            return np.zeros((6, 0), dtype=np.float64)
+
+        return np.array(rows, dtype=np.float64).T.copy()
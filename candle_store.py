@@ -0,0 +1,144 @@
+import numpy as np
+
+from typing import *
+
+from models import Candle
+
+CANDLE_STORE_CAPACITY = 5000 #candles kept in memory per strategy
+
+CANDLE_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+TS, OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(CANDLE_COLUMNS)) #row of each column in the storage array
+
+
+class CandleView: #behaves like a Candle object but reads and writes directly in the CandleStore arrays
+    __slots__ = ("_store", "_pos")
+
+    def __init__(self, store: "CandleStore", pos: int):
+        self._store = store
+        self._pos = pos #position in the first half of the storage array
+
+    def _get(self, column: int) -> float:
+        return float(self._store._data[column, self._pos])
+
+    def _set(self, column: int, value: float):
+        self._store._data[column, self._pos] = value
+        self._store._data[column, self._pos + self._store.capacity] = value #mirror copy
+
+    timestamp = property(lambda self: int(self._get(TS)), lambda self, v: self._set(TS, v))
+    open = property(lambda self: self._get(OPEN), lambda self, v: self._set(OPEN, v))
+    high = property(lambda self: self._get(HIGH), lambda self, v: self._set(HIGH, v))
+    low = property(lambda self: self._get(LOW), lambda self, v: self._set(LOW, v))
+    close = property(lambda self: self._get(CLOSE), lambda self, v: self._set(CLOSE, v))
+    volume = property(lambda self: self._get(VOLUME), lambda self, v: self._set(VOLUME, v))
+
+
+class CandleStore:
+    #fixed capacity ring buffer, one contiguous float64 row per candle column
+    #every candle is written twice (at pos and pos + capacity), so the last len(self) candles are always a contiguous slice
+    #and the column properties can return numpy views without copying
+
+    def __init__(self, capacity: int = CANDLE_STORE_CAPACITY):
+        if capacity < 2:
+            raise ValueError("CandleStore capacity must be at least 2")
+
+        self.capacity = capacity
+
+        self._data = np.zeros((len(CANDLE_COLUMNS), 2 * capacity), dtype=np.float64)
+        self._size = 0
+        self._last = -1 #position of the last candle in the first half of the array
+
+        self.total = 0 #number of candles appended since the creation, including the ones dropped from the buffer
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _window(self) -> slice:
+        end = self._last + self.capacity + 1
+        return slice(end - self._size, end)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[CandleView, List[CandleView]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._size))]
+
+        if index < 0:
+            index += self._size
+
+        if index < 0 or index >= self._size:
+            raise IndexError("CandleStore index out of range")
+
+        return CandleView(self, (self._last - self._size + 1 + index) % self.capacity)
+
+    def __iter__(self) -> Iterator[CandleView]:
+        for i in range(self._size):
+            yield self[i]
+
+    def append(self, timestamp: int, open_: float, high: float, low: float, close: float, volume: float):
+        pos = (self._last + 1) % self.capacity
+
+        values = (timestamp, open_, high, low, close, volume)
+        self._data[:, pos] = values
+        self._data[:, pos + self.capacity] = values
+
+        self._last = pos
+        self._size = min(self._size + 1, self.capacity)
+        self.total += 1
+
+    def append_candle(self, candle: Candle):
+        self.append(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+
+    def extend(self, candles: List[Candle]):
+        for candle in candles[-self.capacity:]:
+            self.append_candle(candle)
+
+        self.total += max(len(candles) - self.capacity, 0) #count the candles that did not fit in the buffer
+
+    def update_last(self, price: float, size: float): #new trade in the current candle
+        data = self._data
+        pos = self._last
+        mirror = pos + self.capacity
+
+        data[CLOSE, pos] = data[CLOSE, mirror] = price
+        data[VOLUME, pos] = data[VOLUME, mirror] = data[VOLUME, pos] + size
+
+        if price > data[HIGH, pos]:
+            data[HIGH, pos] = data[HIGH, mirror] = price
+        elif price < data[LOW, pos]:
+            data[LOW, pos] = data[LOW, mirror] = price
+
+    @property
+    def array(self) -> np.ndarray: #(6, len) view ordered like CANDLE_COLUMNS
+        return self._data[:, self._window()]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._data[TS, self._window()]
+
+    @property
+    def opens(self) -> np.ndarray:
+        return self._data[OPEN, self._window()]
+
+    @property
+    def highs(self) -> np.ndarray:
+        return self._data[HIGH, self._window()]
+
+    @property
+    def lows(self) -> np.ndarray:
+        return self._data[LOW, self._window()]
+
+    @property
+    def closes(self) -> np.ndarray:
+        return self._data[CLOSE, self._window()]
+
+    @property
+    def volumes(self) -> np.ndarray:
+        return self._data[VOLUME, self._window()]
+
+
+
+def candles_to_array(candles: List[Candle]) -> np.ndarray: #(6, n) array ordered like CANDLE_COLUMNS, for the backtester
+    data = np.empty((len(CANDLE_COLUMNS), len(candles)), dtype=np.float64)
+
+    for i, candle in enumerate(candles):
+        data[:, i] = (candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+
+    return data
@@ -0,0 +1,26 @@
+import time
+
+
+class Clock: #time used by the strategies and the candles, the system time in live trading
+    def time(self) -> float: #seconds, like time.time()
+        return time.time()
+
+    def now(self) -> int: #milliseconds
+        return int(time.time() * 1000)
+
+
+class SimulatedClock(Clock): #set by the replay engine to the timestamp of the tick being replayed
+    def __init__(self, start: int = 0):
+        self._now = start #milliseconds
+
+    def set(self, timestamp: int):
+        self._now = timestamp
+
+    def time(self) -> float:
+        return self._now / 1000
+
+    def now(self) -> int:
+        return self._now
+
+
+SYSTEM_CLOCK = Clock()
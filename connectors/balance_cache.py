@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+import typing
+
+from models import Balance
+
+logger = logging.getLogger()
+
+BALANCE_TTL = 30 #seconds, when no stream keeps the balances up to date
+STREAM_BALANCE_TTL = 600 #with the account stream connected, a full reload now and then in case an update was missed
+
+
+class BalanceCache: #balances of the account, so sizing a trade doesn't need a REST request
+    def __init__(self, loader: typing.Optional[typing.Callable[[], typing.Dict[str, Balance]]], ttl: float = BALANCE_TTL):
+        self._loader = loader #REST request of the client, get_balances(). None for the asyncio clients, they store() what they load
+        self._ttl = ttl
+
+        self._balances: typing.Dict[str, Balance] = {}
+        self._loaded_at = 0.0
+        self._valid = False
+        self.streaming = False #set by the client while its account stream is connected
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock() #one REST request at a time, the other callers wait for its result
+
+    def fresh(self) -> bool:
+        ttl = STREAM_BALANCE_TTL if self.streaming else self._ttl
+        return self._valid and time.time() - self._loaded_at < ttl
+
+    def get(self) -> typing.Dict[str, Balance]:
+        if self.fresh():
+            return self._balances
+
+        return self.refresh()
+
+    def refresh(self) -> typing.Dict[str, Balance]:
+        requested_at = time.time()
+
+        with self._load_lock:
+            if self._valid and self._loaded_at >= requested_at: #loaded by another thread while we were waiting
+                return self._balances
+
+            self.store(self._loader())
+
+            return self._balances
+
+    def store(self, balances: typing.Dict[str, Balance]):
+        with self._lock:
+            if len(balances) > 0: #an empty dict is what get_balances() returns when the request failed
+                self._balances = balances
+                self._loaded_at = time.time()
+                self._valid = True
+
+    def invalidate(self, reload: bool = True):
+        #our balances changed (fill) or can't be trusted anymore (stream lost), reloaded in the background
+        self._valid = False
+
+        if reload and self._loader is not None:
+            t = threading.Thread(target=self.refresh, daemon=True)
+            t.start()
+
+    def on_fill(self):
+        #the account stream sends the new balances by itself, without it they are reloaded
+        if not self.streaming:
+            self.invalidate()
+
+    def cached(self) -> typing.Dict[str, Balance]:
+        #last balances loaded or streamed, without any request
+        return self._balances
+
+    def get_cached(self, asset: str) -> typing.Optional[Balance]:
+        return self._balances.get(asset)
+
+    def set(self, asset: str, balance: Balance):
+        #update received from an account stream, the dict is replaced so the readers never see it change
+        with self._lock:
+            balances = dict(self._balances)
+            balances[asset] = balance
+            self._balances = balances
@@ -1,27 +1,45 @@
 import logging
-import requests
 import time
 import typing # in order to type more complex variables, strings, floating numbers, etc. ex: specifying an argument needs to be passed as a dict: typing.Dict
 import collections
+import copy
 
 from urllib.parse import urlencode
 import hmac
 import hashlib
 
 import websocket
-import json
 
 import threading #used to create threads. goal is to run function in parallel so we don't get stuck in our loop
 
 from models import *
 
-from strategies import TechnicalStrategy, BreakoutStrategy
+from strategies import Strategy, TechnicalStrategy, BreakoutStrategy
+from aggregator import CandleAggregator
+from candle_history import CandleHistory, TIMEFRAME_MS, CANDLES_PAGE_SIZE
+from order_book import OrderBook, ORDER_BOOK_DEPTH
+from tick_recorder import TickRecorder, TickChannel
+from clock import SYSTEM_CLOCK
+from latency import LATENCY_MONITOR
+from connectors.order_cache import OrderCache
+from connectors.simulated import SimulatedClient
+from connectors.balance_cache import BalanceCache
+from connectors import decoding
+from connectors.binance_streams import BinanceStreamManager
+from connectors.rate_limiter import BinanceRateLimiter, request_priority
+from connectors.http_session import create_session, request_timeout, DEFAULT_POOL_SIZE
+
+from database import ContractCache
 
 logger = logging.getLogger() # Binance connector
 
+CONTRACTS_RETRY_INTERVAL = 10 #seconds, contracts requested again while the exchange can't be reached and nothing is cached
+
 
 class BinanceClient:
-    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool): #specifying the data type of arguments
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool,
+                 base_url: typing.Optional[str] = None, wss_url: typing.Optional[str] = None,
+                 http_pool_size: int = DEFAULT_POOL_SIZE, start: bool = True): #specifying the data type of arguments
         
         self.futures = futures
 
@@ -43,30 +61,94 @@ class BinanceClient:
             else:
                 self._base_url = "https://api.binance.com"
                 self._wss_url = "wss://stream.binance.com:9443/ws" 
+
+        #urls of a local stand-in server, for testing
+        if base_url is not None:
+            self._base_url = base_url
+        if wss_url is not None:
+            self._wss_url = wss_url
             
         self._public_key = public_key
         self._secret_key = secret_key
 
         self._headers = {'X-MBX-APIKEY': self._public_key}
+        self._session = create_session(http_pool_size, headers=self._headers) #keep-alive connections to the REST API
+        self._rate_limiter = BinanceRateLimiter(self.futures) #request weight and order count used, from the response headers
+
+        #contracts of the last run at once, the exchange info is downloaded by start() and only the differences applied
+        self._contract_cache = ContractCache(self._base_url)
+        self.contracts = self._contract_cache.load()
+
+        self.candle_history = CandleHistory() #candles already downloaded, only the missing ones are requested
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        self.balance_cache = BalanceCache(self.get_balances) #updated by the user data stream, see the balances property
 
         self.prices = {} #dict with contract name as key with price as a value
         self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = {}
+        self.aggregator = CandleAggregator(self) #shared candles of the strategies
+        self._symbol_strategies: typing.Dict[str, typing.Tuple[Strategy, ...]] = {} #symbol -> strategies, rebuilt when a strategy is added/removed
 
         self.logs = []
 
-        self._ws_id = 1 #increment any time we call subscribe channel method
-        self.ws: websocket.WebSocketApp
         self.reconnect = True
-        self.ws_connected = False
-        self.ws_subscriptions = {"bookTicker": [], "aggTrade": []}
+        self.ws_subscriptions = {"bookTicker": set(), "aggTrade": set(), "depth@100ms": set()}
+        self.order_books: typing.Dict[str, OrderBook] = {} #full depth of the symbols subscribed with subscribe_order_book()
+        self.tick_recorder: typing.Optional[TickChannel] = None #see record_ticks()
+        self.clock = SYSTEM_CLOCK #time of the strategies and candles, simulated when the ticks are replayed
+        self.simulators: typing.Tuple[SimulatedClient, ...] = () #paper trading accounts fed with the ticks, see add_simulator()
+
+        #market data streams sharded over several connections, each with its own thread
+        self.streams = BinanceStreamManager(self._wss_url, self.futures, self._on_message)
+
+        self.orders = OrderCache() #status of our orders, updated by the user data stream
+        self.user_ws: typing.Optional[websocket.WebSocketApp] = None
+        self._listen_key: typing.Optional[str] = None
+
+        self.ready = False #True once the contracts are loaded (cache or exchange) and the streams are started
+
+        if start:
+            self.start()
+
+    def start(self):
+        #requests to the exchange, blocking. main.py runs it in a thread so the UI and the other exchange don't wait
+        if len(self.contracts) > 0: #cached contracts, they are refreshed in the background
+            t = threading.Thread(target=self._refresh_contracts, daemon=True)
+            t.start()
+        else:
+            self._refresh_contracts()
+
+        if len(self.contracts) == 0: #the client is not ready until it has contracts, from the cache or the exchange
+            self._add_log(f"Binance contracts could not be loaded, retrying every {CONTRACTS_RETRY_INTERVAL} seconds")
+            t = threading.Thread(target=self._retry_contracts, daemon=True)
+            t.start()
+            return
+
+        self._connect()
+
+    def _retry_contracts(self):
+        while len(self.contracts) == 0:
+            time.sleep(CONTRACTS_RETRY_INTERVAL)
+
+            if not self.reconnect: #client closed
+                return
+
+            self._refresh_contracts()
 
-        t = threading.Thread(target=self._start_ws) #creating thread object
-        t.start() #start
+        self._connect()
 
-        logger.info("Binance Futures Client successfully initialized")
+    def _connect(self):
+        #balances and streams, once the contracts are loaded
+        if len(self.balance_cache.refresh()) == 0: #requested again the next time the balances are used
+            self._add_log("Binance balances could not be loaded")
+
+        if "BTCUSDT" in self.contracts:
+            self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+
+        t = threading.Thread(target=self._start_user_stream)
+        t.start()
+
+        self.ready = True
+        self._add_log("Binance client successfully initialized")
 
     
     def _add_log(self, msg: str):
@@ -77,29 +159,35 @@ class BinanceClient:
         return hmac.new(self._secret_key.encode(), urlencode(data).encode(), hashlib.sha256).hexdigest() #convert string to byte object with encode(), convert data to query string
 
 
-    def _make_request(self, method: str, endpoint: str, data: typing.Dict): #http method, endpoint, parameters
-        if method == "GET": #http method
-            try:
-                response = requests.get(self._base_url + endpoint, params=data, headers=self._headers) #returns the response object 
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+    @property
+    def balances(self) -> typing.Dict[str, Balance]:
+        #cached balances, the REST request is only made when the cache is too old or invalidated
+        return self.balance_cache.get()
 
-        elif method == "POST":
-            try:
-                response = requests.post(self._base_url + endpoint, params=data, headers=self._headers) #returns the response object         
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+    def _sign_again(self, data: typing.Dict):
+        del data['signature']
+        data['timestamp'] = int(time.time() * 1000)
+        data['signature'] = self._generate_signature(data)
 
-        elif method == "DELETE":
-            try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=self._headers) #returns the response object 
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-        else:
+    def _make_request(self, method: str, endpoint: str, data: typing.Dict): #http method, endpoint, parameters
+        if method not in ["GET", "POST", "DELETE", "PUT"]: #http method
             raise ValueError()
+
+        #waits if the request would exceed a rate limit, the orders and cancels go before the other requests
+        weight, orders = self._rate_limiter.cost(method, endpoint, data)
+        waited = self._rate_limiter.acquire(weight, request_priority(method, endpoint), orders)
+
+        if waited > 0.5 and 'signature' in data: #the timestamp must still be within the receive window
+            self._sign_again(data)
+
+        try:
+            #the pooled session reuses the connections, the timeout and the retries depend on the endpoint/method
+            response = self._session.request(method, self._base_url + endpoint, params=data, timeout=request_timeout(endpoint)) #returns the response object 
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        self._rate_limiter.on_response(response.status_code, response.headers)
         
         if response.status_code == 200:
             return response.json()
@@ -125,26 +213,89 @@ class BinanceClient:
         return collections.OrderedDict(sorted(contracts.items()))  #sorts keys of the dictionary alphabetically
 
     
+    def _refresh_contracts(self):
+        contracts = self.get_contracts()
+
+        if len(contracts) == 0: #request failed, the cached contracts are kept
+            return
+
+        #new dict instead of an update, the UI compares it to the one it already displays
+        self.contracts = self._contract_cache.apply(self.contracts, contracts)
+
     def get_historical_candles(self, contract: Contract, interval: str) -> typing.List[Candle]: #specifies our output is a list of Candle objects
+        #the last 1000 candles (the current one included), from the local history. only the candles since the last call are requested
+        tf_ms = TIMEFRAME_MS[interval]
+        start = (int(time.time() * 1000) // tf_ms - 999) * tf_ms
+
+        if not self.download_candles(contract, interval, start): #the candles already in the local history are still returned
+            logger.warning("%s: candles download for %s %s incomplete, using the local history", self.platform, contract.symbol, interval)
+
+        return self.candle_history.load(self._base_url, contract.symbol, interval, start)
+
+    def download_candles(self, contract: Contract, interval: str, start: int, end: typing.Optional[int] = None) -> bool:
+        #stores the candles between start and end (timestamps in ms, end=None for now) that are not in the history yet
+        return self.candle_history.fill(self._base_url, contract.symbol, interval,
+                                        lambda page_start, page_end: self.get_candles_page(contract, interval, page_start, page_end), start, end)
+
+    def missing_candles(self, contract: Contract, interval: str, start: int, end: int) -> typing.List[typing.Tuple[int, int]]:
+        return self.candle_history.missing(self._base_url, contract.symbol, interval, start, end)
+
+    def save_candles(self, contract: Contract, interval: str, candles: typing.List[Candle], start: int, end: int):
+        self.candle_history.save(self._base_url, contract.symbol, interval, candles, start, end)
+
+    def get_candles_page(self, contract: Contract, interval: str, start: int, end: int) -> typing.Optional[typing.List[Candle]]:
         data = {}
         data['symbol'] = contract.symbol
         data['interval'] = interval
-        data['limit'] = 1000
+        data['startTime'] = start
+        data['endTime'] = end + TIMEFRAME_MS[interval] - 1 #open timestamps are passed, the endTime is compared to the close time
+        data['limit'] = CANDLES_PAGE_SIZE
 
         if self.futures:
             raw_candles = self._make_request("GET", "/fapi/v1/klines", data)
         else:
             raw_candles = self._make_request("GET", "/api/v3/klines", data)
 
-        candles = []
+        if raw_candles is None:
+            return None
 
-        if raw_candles is not None: #if request was successful
-            for c in raw_candles:
-                candles.append(Candle(c, interval, self.platform)) #create Candle object and provide it with information --> c1 = open price, c2 = high price, c3 = low price, c4 = close price, c5 = volume
-        
-        return candles #return list of Candle objects
+        return [Candle(c, interval, self.platform) for c in raw_candles] #c1 = open price, c2 = high price, c3 = low price, c4 = close price, c5 = volume
     
 
+    def subscribe_order_book(self, contract: Contract) -> OrderBook:
+        #depth diffs buffered by the book until the REST snapshot they apply to is loaded
+        book = self.order_books.get(contract.symbol)
+
+        if book is None:
+            book = OrderBook(contract.symbol, self.futures)
+            self.order_books[contract.symbol] = book
+
+            self.subscribe_channel([contract], "depth@100ms")
+            self._load_order_book(book)
+
+        return book
+
+    def _load_order_book(self, book: OrderBook):
+        t = threading.Thread(target=self._request_order_book_snapshot, args=(book,), daemon=True)
+        t.start()
+
+    def _request_order_book_snapshot(self, book: OrderBook):
+        data = {}
+        data['symbol'] = book.symbol
+        data['limit'] = ORDER_BOOK_DEPTH
+
+        while self.reconnect and self.order_books.get(book.symbol) is book:
+            time.sleep(1) #diffs received in the meantime, the snapshot must not be older than the first of them
+
+            if self.futures:
+                snapshot = self._make_request("GET", "/fapi/v1/depth", data)
+            else:
+                snapshot = self._make_request("GET", "/api/v3/depth", data)
+
+            if snapshot is not None and book.load_snapshot(snapshot['bids'], snapshot['asks'], snapshot['lastUpdateId']):
+                logger.info("Binance %s order book loaded (%s bids, %s asks)", book.symbol, len(book.bids), len(book.asks))
+                return
+
     def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
         data = {}
         data['symbol'] = contract.symbol
@@ -220,6 +371,9 @@ class BinanceClient:
 
             order_status = OrderStatus(order_status, self.platform)
 
+            if order_status.status in ["filled", "partially_filled"]:
+                self.balance_cache.on_fill()
+
         return order_status
     
 
@@ -293,121 +447,222 @@ class BinanceClient:
         return order_status
     
 
-    def _start_ws(self): #starts connection and assign a certain function when an event occurs
-        self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close, on_error=self._on_error, #websocketApp object. first argument is websocket url, others to specify call back
-                                    on_message=self._on_message)
-        while True:
-            try:
-                if self.reconnect:
-                    self.ws.run_forever() #infinite loop waiting for messages from server. when message is received, callback function can be triggered
-                else:
-                    break
-            except Exception as e:
-                logger.error("Binance error in run_forever() method: %s", e)
-            time.sleep(2) #2 second pause
+    def add_strategy(self, b_index: int, strategy: Strategy) -> bool:
+        if not self.aggregator.subscribe(strategy): #no historical candles
+            return False
 
-    def _on_open(self, ws):
-        logger.info("Binanace connection opened") #welcome to show websocket connection has been established
-        # self.subscribe_channel(list(self.contracts.values()), "bookTicker") #when connection opens, subscribe to channel
-        # self.subscribe_channel(list(self.contracts.values()), "aggTrade")
+        self.strategies[b_index] = strategy
+        self._index_strategies()
 
-        self.ws_connected = True
+        return True
 
-        # The aggTrade channel is subscribed to in the _switch_strategy() method of strategy_component.py
+    def remove_strategy(self, b_index: int):
+        strategy = self.strategies.pop(b_index)
 
-        for channel in ["bookTicker", "aggTrade"]:
-            for symbol in self.ws_subscriptions[channel]:
-                self.subscribe_channel([self.contracts[symbol]], channel, reconnection=True)
+        self.aggregator.unsubscribe(strategy)
+        self._index_strategies()
 
-        if "BTCUSDT" not in self.ws_subscriptions["bookTicker"]:
-            self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+    def _index_strategies(self):
+        #the websocket thread only reads the index, it gets a new dict instead of one modified while it loops over it
+        index = collections.defaultdict(tuple)
 
+        for strat in self.strategies.values():
+            index[strat.contract.symbol] += (strat,)
 
-    def _on_close(self, ws, close_status_code, close_msg):
-        logger.warning("Binance Websocket connection closed")
-        self.ws_connected = False
-    
-    def _on_error(self, ws, msg: str):
-        logger.error("Binanace connection error: %s", msg)
+        self._symbol_strategies = dict(index)
+
+    @property
+    def ws_connected(self) -> bool:
+        return self.streams.connected
+
+    def close(self):
+        self.reconnect = False
+        self.streams.close()
+
+        if self.user_ws is not None:
+            self.user_ws.close()
+
+    def add_simulator(self, simulator: SimulatedClient):
+        #the simulated orders are filled with the prices received by this client. the tuple is replaced, not modified,
+        #the websocket thread loops over it
+        self.simulators = self.simulators + (simulator,)
+
+    def remove_simulator(self, simulator: SimulatedClient):
+        self.simulators = tuple(s for s in self.simulators if s is not simulator)
+
+    def record_ticks(self, recorder: typing.Optional[TickRecorder]):
+        #every bookTicker and aggTrade message received is written by the recorder, None to stop
+        self.tick_recorder = recorder.channel(self.platform) if recorder is not None else None
 
     def _on_message(self, ws, msg: str):
-        data = json.loads(msg) #convert json string that we received to json object that we can pass. loads() does this
-        
-        if "u" in data and "A" in data:
-            data['e'] = "bookTicker"
+        received = time.time_ns()
+        message = decoding.decode_binance(msg) #only the fields we use are extracted from the hot message types
+        kind = message[0]
 
-        if "e" in data:
-            if data['e'] == "bookTicker":
+        if kind == decoding.BOOK_TICKER:
+            _, symbol, bid, ask, event_time = message
 
-                symbol = data['s']
+            if self.tick_recorder is not None:
+                self.tick_recorder.quote(symbol, event_time, bid, ask)
 
-                if symbol not in self.prices:
-                    self.prices[symbol] = {'bid': float(data['b']), 'ask': float(data['a'])}
-                else:
-                    self.prices[symbol]['bid'] = float(data['b'])
-                    self.prices[symbol]['ask'] = float(data['a'])
-                
-                #pnl calculations/updates
-                try:
-                    for b_index, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            for trade in strat.trades:
-                                if trade.status == "open" and trade.entry_price is not None:
-                                    if trade.side == "long":
-                                        trade.pnl = (self.prices[symbol]['bid'] - trade.entry_price) * trade.quantity
-                                    elif trade.side == "short":
-                                        trade.pnl = (trade.entry_price - self.prices[symbol]['bid']) * trade.quantity
-                except RuntimeError as e:
-                    logger.error("Error while looping through the Binance strategies: %s", e)
-
-            if data['e'] == "aggTrade":
-                symbol = data['s']
-
-                for key, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        res = strat.parse_trades(float(data['p']), float(data['q']), data['T'])
-                        strat.check_trade(res)
+            for simulator in self.simulators:
+                simulator.on_quote(symbol, bid, ask)
+
+            prices = self.prices.get(symbol)
+            if prices is None:
+                self.prices[symbol] = {'bid': bid, 'ask': ask}
+            else:
+                prices['bid'] = bid
+                prices['ask'] = ask
+
+            #pnl calculations/updates, only for the strategies trading this symbol
+            for strat in self._symbol_strategies.get(symbol, ()):
+                if strat.open_trades:
+                    strat.update_pnl(bid, ask)
+
+        elif kind == decoding.AGG_TRADE:
+            _, symbol, price, quantity, trade_time, buyer_maker = message
+
+            if self.tick_recorder is not None:
+                self.tick_recorder.trade(symbol, trade_time, price, quantity, buyer_maker)
+
+            for simulator in self.simulators: #simulated orders are matched before the strategies see the trade
+                simulator.on_trade(symbol, price)
+
+            tick = LATENCY_MONITOR.on_trade(self.platform, trade_time, received)
+
+            self.aggregator.on_trade(symbol, price, quantity, trade_time, tick) #candles built once per symbol / timeframe
+            LATENCY_MONITOR.on_trade_processed(tick)
+
+        elif kind == decoding.DEPTH_UPDATE:
+            _, symbol, first_id, last_id, previous_id, bids, asks, event_time = message
+
+            book = self.order_books.get(symbol)
+            if book is not None and not book.on_diff(first_id, last_id, previous_id, bids, asks, event_time):
+                logger.warning("Binance %s order book out of sequence, reloading it", symbol)
+                self._load_order_book(book)
+
+        elif "error" in message[1]: #answer to a SUBSCRIBE message
+            logger.error("Binance websocket error: %s", message[1]['error'])
         
     
-    def subscribe_channel(self, contracts: typing.List[Contract], channel: str, reconnection=False): #subscribe to a channel that provides us with market data. parameter is symbol you want data on
-        #creating json object. create python dict and fill it with the keys from binance documentation
+    def _listen_key_request(self, method: str, listen_key: typing.Optional[str] = None):
+        #the listen key identifies the user data stream, it expires if not renewed within 60 minutes
+        data = {}
+        if listen_key is not None and not self.futures:
+            data['listenKey'] = listen_key
 
-        if len(contracts) > 200:
-            logger.warning("Subscribing to more than 200 symbols will most likely fail. "
-                           "Consider subscribing only when adding a symbol to your Watchlist or when starting a strategy for a symbol.")
+        if self.futures:
+            return self._make_request(method, "/fapi/v1/listenKey", data)
+        else:
+            return self._make_request(method, "/api/v3/userDataStream", data)
 
-        data = {}
-        data['method'] = "SUBSCRIBE"
-        data['params'] = [] #list of channels we want to subscribe to
+    def _start_user_stream(self): #private stream with the updates of our orders
+        t = threading.Thread(target=self._keep_alive_user_stream, daemon=True)
+        t.start()
+
+        while self.reconnect:
+            listen_key = self._listen_key_request("POST")
+
+            if listen_key is None:
+                time.sleep(5)
+                continue
+
+            self._listen_key = listen_key['listenKey']
+
+            self.user_ws = websocket.WebSocketApp(self._wss_url + "/" + self._listen_key, on_open=self._on_user_open,
+                                                  on_close=self._on_user_close, on_error=self._on_user_error,
+                                                  on_message=self._on_user_message)
+            try:
+                self.user_ws.run_forever()
+            except Exception as e:
+                logger.error("Binance error in user data stream run_forever() method: %s", e)
+            time.sleep(2)
+
+    def _keep_alive_user_stream(self):
+        while self.reconnect:
+            time.sleep(30 * 60)
+            if self._listen_key is not None:
+                self._listen_key_request("PUT", self._listen_key)
+
+    def _on_user_open(self, ws):
+        logger.info("Binance user data stream opened")
+
+        #the balance updates sent while disconnected are lost too
+        self.balance_cache.streaming = True
+        self.balance_cache.invalidate()
+
+        #orders updates sent while the stream was disconnected are lost, check the pending orders once
+        for contract, order_id in self.orders.pending():
+            order_status = self.get_order_status(contract, order_id)
+            if order_status is not None:
+                self.orders.update(order_status)
+
+    def _on_user_close(self, ws, close_status_code, close_msg):
+        logger.warning("Binance user data stream closed")
+        self.balance_cache.streaming = False
+
+    def _on_user_error(self, ws, msg: str):
+        logger.error("Binance user data stream error: %s", msg)
+
+    def _on_user_message(self, ws, msg: str):
+        data = decoding.loads(msg)
+
+        if "e" not in data:
+            return
+
+        if data['e'] == "ORDER_TRADE_UPDATE": #futures
+            order_status = OrderStatus(data['o'], "binance_futures_stream")
+            self.orders.update(order_status)
+
+            if order_status.status in ["filled", "partially_filled"]:
+                self.balance_cache.on_fill()
+
+        elif data['e'] == "executionReport": #spot
+            order_status = OrderStatus(data, "binance_spot_stream")
+            self.orders.update(order_status)
+
+            if order_status.status in ["filled", "partially_filled"]:
+                self.balance_cache.on_fill()
+
+        elif data['e'] == "ACCOUNT_UPDATE": #futures, only the wallet balance of the assets that changed is sent
+            for b in data['a']['B']:
+                balance = self.balance_cache.get_cached(b['a'])
+                if balance is None:
+                    self.balance_cache.invalidate()
+                    continue
+
+                balance = copy.copy(balance)
+                balance.wallet_balance = float(b['wb'])
+                self.balance_cache.set(b['a'], balance)
+
+        elif data['e'] == "outboundAccountPosition": #spot
+            for b in data['B']:
+                self.balance_cache.set(b['a'], Balance({'free': b['f'], 'locked': b['l']}, self.platform))
+
+        elif data['e'] == "listenKeyExpired":
+            logger.warning("Binance listen key expired, reconnecting the user data stream")
+            ws.close()
+
+    def subscribe_channel(self, contracts: typing.List[Contract], channel: str): #subscribe to a channel that provides us with market data. parameter is symbol you want data on
+        #the stream manager spreads the streams over as many connections as needed, so the whole universe can be subscribed to
 
         if len(contracts) == 0:
-            data['params'].append(channel)
+            streams = [channel]
         else:
-            for contract in contracts:
-                if contract.symbol not in self.ws_subscriptions[channel] or reconnection:
-                    data['params'].append(contract.symbol.lower() + "@" + channel) #appending to the list of channels
-                    if contract.symbol not in self.ws_subscriptions[channel]:
-                        self.ws_subscriptions[channel].append(contract.symbol)
-
-            if len(data['params']) == 0:
-                return
+            symbols = [contract.symbol for contract in contracts if contract.symbol not in self.ws_subscriptions[channel]]
+            self.ws_subscriptions[channel].update(symbols)
 
-        data['id'] = self._ws_id
+            streams = [symbol.lower() + "@" + channel for symbol in symbols]
 
-        #send() expects string not dict. json.dumps(data) converts dict to JSON string. similar to query string idea
-        try:
-            self.ws.send(json.dumps(data)) #send() to send JSON object through the websocket connection
-            logger.info("Binance: subscribing to: %s", ','.join(data['params']))
-        except Exception as e:
-            logger.error("Websocket error while subscribing to @bookTicker and @aggTrade: %s", e)
-            
-        self._ws_id += 1
+        if len(streams) > 0:
+            self.streams.subscribe(streams)
     
     def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
 
         logger.info("Getting Binance trade size...")
 
-        balance = self.get_balances()
+        balance = self.balances #local lookup, no REST request on the signal path
         if balance is not None:
             if contract.quote_asset in balance:  #with binance Spot, the quote asset isn't necessarily USDT
                 if self.futures:
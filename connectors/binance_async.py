@@ -0,0 +1,561 @@
+import asyncio
+import logging
+import time
+import typing
+import collections
+
+from urllib.parse import urlencode
+import hmac
+import hashlib
+
+import aiohttp
+
+from models import *
+
+from connectors import decoding
+from connectors.http_session import request_timeout
+from connectors.rate_limiter import BinanceRateLimiter, request_priority
+from connectors.order_cache import OrderCache
+from connectors.binance_streams import FUTURES_MAX_STREAMS, SPOT_MAX_STREAMS, FUTURES_MAX_MESSAGES, SPOT_MAX_MESSAGES, \
+    SUBSCRIBE_BATCH, URL_STREAMS
+
+logger = logging.getLogger()
+
+
+class AsyncStreamConnection: #one combined stream connection, a task of the client event loop instead of a thread
+    def __init__(self, client: "AsyncBinanceClient", connection_id: int):
+        self._client = client
+        self.id = connection_id
+
+        self.streams: typing.Set[str] = set()
+        self.ws: typing.Optional[aiohttp.ClientWebSocketResponse] = None
+
+        self._pending: typing.List[str] = []
+        self._wake_sender = asyncio.Event()
+        self._msg_id = 1
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and not self.ws.closed
+
+    def add(self, streams: typing.List[str]):
+        new_streams = [s for s in streams if s not in self.streams]
+        self.streams.update(new_streams)
+
+        if self.connected: #otherwise they are part of the next connection
+            self._pending.extend(new_streams)
+            self._wake_sender.set()
+
+    async def run(self):
+        while self._client.reconnect:
+            url_streams = sorted(self.streams)[:URL_STREAMS]
+            url = self._client.stream_url + "/stream?streams=" + "/".join(url_streams)
+
+            try:
+                async with self._client.session.ws_connect(url, heartbeat=60) as ws:
+                    logger.info("Binance connection %s opened", self.id)
+
+                    self.ws = ws
+                    self._pending = [s for s in sorted(self.streams) if s not in url_streams]
+                    self._wake_sender.set()
+
+                    sender = asyncio.create_task(self._send_subscriptions())
+
+                    try:
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                self._client._on_message(msg.data)
+                            elif msg.type in [aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR]:
+                                break
+                    finally:
+                        sender.cancel()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Binance connection %s error: %s", self.id, e)
+
+            self.ws = None
+            logger.warning("Binance websocket connection %s closed", self.id)
+
+            await asyncio.sleep(2)
+
+    async def _send_subscriptions(self):
+        interval = 2 / self._client.max_messages #half of the message rate limit, the pongs count too
+
+        while True:
+            await self._wake_sender.wait()
+            self._wake_sender.clear()
+
+            while self.connected and len(self._pending) > 0:
+                params = self._pending[:SUBSCRIBE_BATCH]
+                del self._pending[:SUBSCRIBE_BATCH]
+
+                try:
+                    await self.ws.send_json({"method": "SUBSCRIBE", "params": params, "id": self._msg_id})
+                    logger.info("Binance: subscribing to %s streams on connection %s", len(params), self.id)
+                except Exception as e:
+                    logger.error("Websocket error while subscribing on connection %s: %s", self.id, e)
+                    break
+
+                self._msg_id += 1
+
+                await asyncio.sleep(interval)
+
+
+class AsyncBinanceClient: #asyncio version of BinanceClient, the REST requests and the websocket streams share one event loop
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool,
+                 base_url: typing.Optional[str] = None, wss_url: typing.Optional[str] = None,
+                 on_trade: typing.Optional[typing.Callable[[str, float, float, int], None]] = None):
+
+        self.futures = futures
+
+        if self.futures:
+            self.platform = "binance_futures"
+            if testnet:
+                self._base_url = "https://testnet.binancefuture.com"
+                self._wss_url = "wss://stream.binancefuture.com/ws"
+            else:
+                self._base_url = "https://fapi.binance.com"
+                self._wss_url = "wss://fstream.binance.com/ws"
+        else:
+            self.platform = "binance_spot"
+            if testnet:
+                self._base_url = "https://testnet.binance.vision"
+                self._wss_url = "wss://testnet.binance.vision/ws"
+            else:
+                self._base_url = "https://api.binance.com"
+                self._wss_url = "wss://stream.binance.com:9443/ws"
+
+        #urls of a local stand-in server, for testing
+        if base_url is not None:
+            self._base_url = base_url
+        if wss_url is not None:
+            self._wss_url = wss_url
+
+        self.stream_url = self._wss_url[:-len("/ws")] if self._wss_url.endswith("/ws") else self._wss_url
+        self.max_streams = FUTURES_MAX_STREAMS if futures else SPOT_MAX_STREAMS
+        self.max_messages = FUTURES_MAX_MESSAGES if futures else SPOT_MAX_MESSAGES
+
+        self._public_key = public_key
+        self._secret_key = secret_key
+
+        self._headers = {'X-MBX-APIKEY': self._public_key}
+
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self._rate_limiter = BinanceRateLimiter(self.futures)
+
+        self.contracts: typing.Dict[str, Contract] = {}
+        self.balances: typing.Dict[str, Balance] = {}
+        self.prices = {}
+
+        self.on_trade = on_trade #called with (symbol, price, quantity, trade time) for each aggTrade message
+
+        self.reconnect = True
+        self.ws_subscriptions = {"bookTicker": set(), "aggTrade": set()}
+        self.connections: typing.List[AsyncStreamConnection] = []
+        self._symbol_connections: typing.Dict[str, AsyncStreamConnection] = {}
+
+        self.orders = OrderCache()
+        self._listen_key: typing.Optional[str] = None
+
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        #must be awaited inside the running event loop, the contracts and the balances are requested concurrently
+        self.session = aiohttp.ClientSession(headers=self._headers)
+
+        self.contracts, self.balances = await asyncio.gather(self.get_contracts(), self.get_balances())
+
+        self._tasks.append(asyncio.create_task(self._run_user_stream()))
+
+        if "BTCUSDT" in self.contracts:
+            self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+
+        logger.info("Binance async client successfully initialized")
+
+    async def close(self):
+        self.reconnect = False
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _generate_signature(self, data: typing.Dict) -> str:
+        return hmac.new(self._secret_key.encode(), urlencode(data).encode(), hashlib.sha256).hexdigest()
+
+    async def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+        if method not in ["GET", "POST", "DELETE", "PUT"]:
+            raise ValueError()
+
+        #waits if the request would exceed a rate limit, the orders and cancels go before the other requests
+        weight, orders = self._rate_limiter.cost(method, endpoint, data)
+        waited = await self._rate_limiter.acquire_async(weight, request_priority(method, endpoint), orders)
+
+        if waited > 0.5 and 'signature' in data: #the timestamp must still be within the receive window
+            del data['signature']
+            data['timestamp'] = int(time.time() * 1000)
+            data['signature'] = self._generate_signature(data)
+
+        #the query string is built like the signed one, so the parameters are sent in the same order
+        url = self._base_url + endpoint
+        if len(data) > 0:
+            url += "?" + urlencode(data)
+
+        connect_timeout, read_timeout = request_timeout(endpoint)
+
+        try:
+            async with self.session.request(method, url, timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)) as response:
+                status_code = response.status
+                response_data = await response.json(content_type=None)
+
+                self._rate_limiter.on_response(status_code, response.headers)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        if status_code == 200:
+            return response_data
+        else:
+            logger.error("Error while making %s request to %s: %s (error code %s)",
+                         method, endpoint, response_data, status_code)
+            return None
+
+    async def get_contracts(self) -> typing.Dict[str, Contract]:
+
+        if self.futures:
+            exchange_info = await self._make_request("GET", "/fapi/v1/exchangeInfo", {})
+        else:
+            exchange_info = await self._make_request("GET", "/api/v3/exchangeInfo", {})
+
+        contracts = {}
+
+        if exchange_info is not None:
+            for contract_data in exchange_info['symbols']:
+                contracts[contract_data['symbol']] = Contract(contract_data, self.platform)
+
+        return collections.OrderedDict(sorted(contracts.items()))
+
+    async def get_historical_candles(self, contract: Contract, interval: str) -> typing.List[Candle]:
+        data = {}
+        data['symbol'] = contract.symbol
+        data['interval'] = interval
+        data['limit'] = 1000
+
+        if self.futures:
+            raw_candles = await self._make_request("GET", "/fapi/v1/klines", data)
+        else:
+            raw_candles = await self._make_request("GET", "/api/v3/klines", data)
+
+        candles = []
+
+        if raw_candles is not None:
+            for c in raw_candles:
+                candles.append(Candle(c, interval, self.platform))
+
+        return candles
+
+    async def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
+        data = {}
+        data['symbol'] = contract.symbol
+
+        if self.futures:
+            ob_data = await self._make_request("GET", "/fapi/v1/ticker/bookTicker", data)
+        else:
+            ob_data = await self._make_request("GET", "/api/v3/ticker/bookTicker", data)
+
+        if ob_data is not None:
+            self.prices[contract.symbol] = {'bid': float(ob_data['bidPrice']), 'ask': float(ob_data['askPrice'])}
+
+            return self.prices[contract.symbol]
+
+    async def get_balances(self) -> typing.Dict[str, Balance]:
+        data = {}
+        data['timestamp'] = int(time.time() * 1000)
+        data['signature'] = self._generate_signature(data)
+
+        balances = {}
+
+        if self.futures:
+            account_data = await self._make_request("GET", "/fapi/v1/account", data)
+        else:
+            account_data = await self._make_request("GET", "/api/v3/account", data)
+
+        if account_data is not None:
+            if self.futures:
+                for a in account_data['assets']:
+                    balances[a['asset']] = Balance(a, self.platform)
+            else:
+                for a in account_data['balances']:
+                    balances[a['asset']] = Balance(a, self.platform)
+
+        return balances
+
+    async def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, price=None, tif=None) -> OrderStatus:
+        data = {}
+        data['symbol'] = contract.symbol
+        data['side'] = side.upper()
+        data['quantity'] = round(int(quantity / contract.lot_size) * contract.lot_size, 8)
+        data['type'] = order_type.upper()
+
+        if price is not None:
+            data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
+            data['price'] = '%.*f' % (contract.price_decimals, data['price']) #avoids scientific notation
+
+        if tif is not None:
+            data['timeInForce'] = tif
+
+        data['timestamp'] = int(time.time() * 1000)
+        data['signature'] = self._generate_signature(data)
+
+        if self.futures:
+            order_status = await self._make_request("POST", "/fapi/v1/order", data)
+        else:
+            order_status = await self._make_request("POST", "/api/v3/order", data)
+
+        if order_status is not None:
+
+            if not self.futures:
+                if order_status['status'] == "FILLED":
+                    order_status['avgPrice'] = await self._get_execution_price(contract, order_status['orderId'])
+                else:
+                    order_status['avgPrice'] = 0
+
+            order_status = OrderStatus(order_status, self.platform)
+
+        return order_status
+
+    async def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
+        data = {}
+        data['orderId'] = order_id
+        data['symbol'] = contract.symbol
+
+        data['timestamp'] = int(time.time() * 1000)
+        data['signature'] = self._generate_signature(data)
+
+        if self.futures:
+            order_status = await self._make_request("DELETE", "/fapi/v1/order", data)
+        else:
+            order_status = await self._make_request("DELETE", "/api/v3/order", data)
+
+        if order_status is not None:
+            if not self.futures:
+                order_status['avgPrice'] = await self._get_execution_price(contract, order_id)
+            order_status = OrderStatus(order_status, self.platform)
+
+        return order_status
+
+    async def _get_execution_price(self, contract: Contract, order_id: int) -> float:
+
+        data = {}
+        data['timestamp'] = int(time.time() * 1000)
+        data['symbol'] = contract.symbol
+        data['signature'] = self._generate_signature(data)
+
+        trades = await self._make_request("GET", "/api/v3/myTrades", data)
+
+        avg_price = 0
+
+        if trades is not None:
+
+            executed_qty = 0
+            for t in trades:
+                if t['orderId'] == order_id:
+                    executed_qty += float(t['qty'])
+
+            for t in trades:
+                if t['orderId'] == order_id:
+                    fill_pct = float(t['qty']) / executed_qty
+                    avg_price += (float(t['price']) * fill_pct)
+
+        return round(round(avg_price / contract.tick_size) * contract.tick_size, 8)
+
+    async def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
+
+        data = {}
+        data['timestamp'] = int(time.time() * 1000)
+        data['symbol'] = contract.symbol
+        data['orderId'] = order_id
+        data['signature'] = self._generate_signature(data)
+
+        if self.futures:
+            order_status = await self._make_request("GET", "/fapi/v1/order", data)
+        else:
+            order_status = await self._make_request("GET", "/api/v3/order", data)
+
+        if order_status is not None:
+            if not self.futures:
+                if order_status['status'] == "FILLED":
+                    order_status['avgPrice'] = await self._get_execution_price(contract, order_id)
+                else:
+                    order_status['avgPrice'] = 0
+
+            order_status = OrderStatus(order_status, self.platform)
+
+        return order_status
+
+    async def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+
+        balance = await self.get_balances()
+
+        if contract.quote_asset not in balance:
+            return None
+
+        if self.futures:
+            balance = balance[contract.quote_asset].wallet_balance
+        else:
+            balance = balance[contract.quote_asset].free
+
+        trade_size = (balance * balance_pct / 100) / price
+
+        trade_size = round(round(trade_size / contract.lot_size) * contract.lot_size, 8)
+
+        logger.info("Binance current %s balance = %s, trade size = %s", contract.quote_asset, balance, trade_size)
+
+        return trade_size
+
+    @property
+    def ws_connected(self) -> bool:
+        return any(connection.connected for connection in self.connections)
+
+    def _connection_for(self, symbol: str) -> AsyncStreamConnection:
+        #same placement as BinanceStreamManager: connection of the symbol, else the least loaded one, else a new one
+
+        connection = self._symbol_connections.get(symbol)
+        if connection is not None and len(connection.streams) < self.max_streams:
+            return connection
+
+        available = [c for c in self.connections if len(c.streams) < self.max_streams]
+
+        if len(available) > 0:
+            connection = min(available, key=lambda c: len(c.streams))
+        else:
+            connection = AsyncStreamConnection(self, len(self.connections) + 1)
+            self.connections.append(connection)
+            self._tasks.append(asyncio.create_task(connection.run()))
+
+        self._symbol_connections.setdefault(symbol, connection)
+
+        return connection
+
+    def subscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        #not a coroutine: the streams are sent by the connection tasks, it must be called from the event loop thread
+
+        if len(contracts) == 0:
+            streams = [channel]
+        else:
+            symbols = [contract.symbol for contract in contracts if contract.symbol not in self.ws_subscriptions[channel]]
+            self.ws_subscriptions[channel].update(symbols)
+
+            streams = [symbol.lower() + "@" + channel for symbol in symbols]
+
+        for stream in streams:
+            if any(stream in c.streams for c in self.connections):
+                continue
+            self._connection_for(stream.split("@")[0]).add([stream])
+
+    def _on_message(self, msg: str):
+        message = decoding.decode_binance(msg)
+        kind = message[0]
+
+        if kind == decoding.BOOK_TICKER:
+            _, symbol, bid, ask, _ = message
+
+            prices = self.prices.get(symbol)
+            if prices is None:
+                self.prices[symbol] = {'bid': bid, 'ask': ask}
+            else:
+                prices['bid'] = bid
+                prices['ask'] = ask
+
+        elif kind == decoding.AGG_TRADE:
+            if self.on_trade is not None:
+                _, symbol, price, quantity, trade_time, _ = message
+                self.on_trade(symbol, price, quantity, trade_time)
+
+        elif "error" in message[1]:
+            logger.error("Binance websocket error: %s", message[1]['error'])
+
+    async def _listen_key_request(self, method: str, listen_key: typing.Optional[str] = None):
+        data = {}
+        if listen_key is not None and not self.futures:
+            data['listenKey'] = listen_key
+
+        if self.futures:
+            return await self._make_request(method, "/fapi/v1/listenKey", data)
+        else:
+            return await self._make_request(method, "/api/v3/userDataStream", data)
+
+    async def _keep_alive_user_stream(self):
+        while self.reconnect:
+            await asyncio.sleep(30 * 60)
+            if self._listen_key is not None:
+                await self._listen_key_request("PUT", self._listen_key)
+
+    async def _run_user_stream(self): #private stream with the updates of our orders
+        keep_alive = asyncio.create_task(self._keep_alive_user_stream())
+
+        try:
+            while self.reconnect:
+                listen_key = await self._listen_key_request("POST")
+
+                if listen_key is None:
+                    await asyncio.sleep(5)
+                    continue
+
+                self._listen_key = listen_key['listenKey']
+
+                try:
+                    async with self.session.ws_connect(self._wss_url + "/" + self._listen_key, heartbeat=60) as ws:
+                        logger.info("Binance user data stream opened")
+
+                        #orders updates sent while the stream was disconnected are lost, check the pending orders at once
+                        pending = self.orders.pending()
+                        for order_status in await asyncio.gather(*[self.get_order_status(c, o) for c, o in pending]):
+                            if order_status is not None:
+                                self.orders.update(order_status)
+
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            if not self._on_user_message(msg.data):
+                                break
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Binance user data stream error: %s", e)
+
+                logger.warning("Binance user data stream closed")
+                await asyncio.sleep(2)
+        finally:
+            keep_alive.cancel()
+
+    def _on_user_message(self, msg: str) -> bool:
+        #False when the stream must be reconnected
+        data = decoding.loads(msg)
+
+        if "e" not in data:
+            return True
+
+        if data['e'] == "ORDER_TRADE_UPDATE": #futures
+            self.orders.update(OrderStatus(data['o'], "binance_futures_stream"))
+
+        elif data['e'] == "executionReport": #spot
+            self.orders.update(OrderStatus(data, "binance_spot_stream"))
+
+        elif data['e'] == "listenKeyExpired":
+            logger.warning("Binance listen key expired, reconnecting the user data stream")
+            return False
+
+        return True
@@ -0,0 +1,196 @@
+import collections
+import json
+import logging
+import threading
+import time
+import typing
+
+import websocket
+
+logger = logging.getLogger()
+
+#binance limits of the market data connections
+FUTURES_MAX_STREAMS = 200
+SPOT_MAX_STREAMS = 1024
+FUTURES_MAX_MESSAGES = 10 #incoming messages per second and per connection, pings and pongs included
+SPOT_MAX_MESSAGES = 5
+
+SUBSCRIBE_BATCH = 100 #streams per SUBSCRIBE message
+URL_STREAMS = 100 #streams passed in the combined stream url when connecting, the others are subscribed to afterwards
+
+
+class StreamConnection: #one websocket connection with its combined streams, run in its own thread
+    def __init__(self, manager: "BinanceStreamManager", connection_id: int):
+        self._manager = manager
+        self.id = connection_id
+
+        self.streams: typing.Set[str] = set() #every stream this connection should receive, used again when reconnecting
+        self.ws: typing.Optional[websocket.WebSocketApp] = None
+        self.connected = False
+
+        self._lock = threading.Lock()
+        self._url_streams: typing.Set[str] = set() #streams of the url of the current connection
+        self._pending: typing.List[str] = [] #streams waiting to be sent in a SUBSCRIBE message
+        self._msg_id = 1
+
+        self._has_streams = threading.Event()
+        self._wake_sender = threading.Event()
+
+        t = threading.Thread(target=self._run)
+        t.start()
+
+        t = threading.Thread(target=self._send_subscriptions, daemon=True)
+        t.start()
+
+    def add(self, streams: typing.List[str]):
+        with self._lock:
+            new_streams = [s for s in streams if s not in self.streams]
+            self.streams.update(new_streams)
+
+            if self.connected: #otherwise they are part of the next connection
+                self._pending.extend(new_streams)
+
+        self._has_streams.set()
+        self._wake_sender.set()
+
+    def close(self):
+        self._has_streams.set()
+        self._wake_sender.set()
+
+        if self.ws is not None:
+            self.ws.close()
+
+    def _run(self):
+        while self._manager.running:
+            self._has_streams.wait(1)
+
+            with self._lock:
+                if len(self.streams) == 0:
+                    continue
+
+                url_streams = sorted(self.streams)[:URL_STREAMS]
+                self._url_streams = set(url_streams)
+
+            url = self._manager.base_url + "/stream?streams=" + "/".join(url_streams)
+
+            self.ws = websocket.WebSocketApp(url, on_open=self._on_open, on_close=self._on_close, on_error=self._on_error,
+                                             on_message=self._manager.on_message)
+            try:
+                self.ws.run_forever()
+            except Exception as e:
+                logger.error("Binance error in run_forever() method of connection %s: %s", self.id, e)
+
+            self.connected = False
+            time.sleep(2)
+
+    def _on_open(self, ws):
+        logger.info("Binance connection %s opened", self.id)
+
+        with self._lock:
+            self.connected = True
+            self._pending = [s for s in sorted(self.streams) if s not in self._url_streams]
+
+        self._wake_sender.set()
+
+    def _on_close(self, ws, close_status_code, close_msg):
+        logger.warning("Binance websocket connection %s closed", self.id)
+        self.connected = False
+
+    def _on_error(self, ws, msg: str):
+        logger.error("Binance connection %s error: %s", self.id, msg)
+
+    def _send_subscriptions(self):
+        #batched SUBSCRIBE messages, spaced to use at most half of the message rate limit (the pongs count too)
+        interval = 2 / self._manager.max_messages
+
+        while self._manager.running:
+            self._wake_sender.wait()
+            self._wake_sender.clear()
+
+            while self._manager.running:
+                with self._lock:
+                    if not self.connected or len(self._pending) == 0:
+                        break
+
+                    params = self._pending[:SUBSCRIBE_BATCH]
+                    del self._pending[:SUBSCRIBE_BATCH]
+
+                    msg_id = self._msg_id
+                    self._msg_id += 1
+
+                try:
+                    self.ws.send(json.dumps({"method": "SUBSCRIBE", "params": params, "id": msg_id}))
+                    logger.info("Binance: subscribing to %s streams on connection %s", len(params), self.id)
+                except Exception as e:
+                    logger.error("Websocket error while subscribing on connection %s: %s", self.id, e)
+                    break #subscribed again by the url of the next connection
+
+                time.sleep(interval)
+
+
+class BinanceStreamManager: #market data streams sharded over several combined stream connections
+    def __init__(self, wss_url: str, futures: bool, on_message: typing.Callable):
+        if wss_url.endswith("/ws"):
+            wss_url = wss_url[:-len("/ws")]
+
+        self.base_url = wss_url
+        self.max_streams = FUTURES_MAX_STREAMS if futures else SPOT_MAX_STREAMS
+        self.max_messages = FUTURES_MAX_MESSAGES if futures else SPOT_MAX_MESSAGES
+        self.on_message = on_message
+
+        self.running = True
+        self.connections: typing.List[StreamConnection] = []
+
+        self._lock = threading.Lock()
+        self._symbol_connections: typing.Dict[str, StreamConnection] = {} #the streams of a symbol stay on one connection/thread
+
+    @property
+    def connected(self) -> bool:
+        return any(connection.connected for connection in self.connections)
+
+    def _connection_for(self, symbol: str, planned: typing.Dict[StreamConnection, int]) -> StreamConnection:
+        #connection of the symbol if it has room, else the least loaded one, else a new one
+
+        def load(connection: StreamConnection) -> int:
+            return len(connection.streams) + planned[connection]
+
+        connection = self._symbol_connections.get(symbol)
+        if connection is not None and load(connection) < self.max_streams:
+            return connection
+
+        available = [c for c in self.connections if load(c) < self.max_streams]
+
+        if len(available) > 0:
+            connection = min(available, key=load)
+        else:
+            connection = StreamConnection(self, len(self.connections) + 1)
+            self.connections.append(connection)
+            logger.info("Binance: opening market data connection %s", connection.id)
+
+        self._symbol_connections.setdefault(symbol, connection)
+
+        return connection
+
+    def subscribe(self, streams: typing.List[str]):
+        #streams like "btcusdt@aggTrade", they are sent once the connection is open and again after each reconnection
+
+        with self._lock:
+            planned = collections.defaultdict(int)
+            assignments = collections.defaultdict(list)
+
+            for stream in dict.fromkeys(streams):
+                if any(stream in c.streams for c in self.connections):
+                    continue
+
+                connection = self._connection_for(stream.split("@")[0], planned)
+                planned[connection] += 1
+                assignments[connection].append(stream)
+
+            for connection, connection_streams in assignments.items():
+                connection.add(connection_streams)
+
+    def close(self):
+        self.running = False
+
+        for connection in self.connections:
+            connection.close()
@@ -1,8 +1,8 @@
 import logging
-import requests
 import time
 import typing
 import collections
+import copy
 
 from urllib.parse import urlencode
 
@@ -12,18 +12,35 @@ import hashlib
 import websocket
 import json
 
-import dateutil.parser
-
 import threading
 
 from models import *
 
-from strategies import TechnicalStrategy, BreakoutStrategy
+from strategies import Strategy, TechnicalStrategy, BreakoutStrategy
+from aggregator import CandleAggregator
+from candle_history import CandleHistory, TIMEFRAME_MS, CANDLES_PAGE_SIZE
+from order_book import OrderBook
+from tick_recorder import TickRecorder, TickChannel
+from clock import SYSTEM_CLOCK
+from latency import LATENCY_MONITOR
+from connectors.order_cache import OrderCache, FINAL_STATUSES, MAX_CACHED_ORDERS
+from connectors.simulated import SimulatedClient
+from connectors.balance_cache import BalanceCache
+from connectors import decoding
+from connectors.rate_limiter import BitmexRateLimiter, request_priority
+from connectors.http_session import create_session, request_timeout, DEFAULT_POOL_SIZE
+
+from database import ContractCache
 
 logger = logging.getLogger()
 
+CONTRACTS_RETRY_INTERVAL = 10 #seconds, contracts requested again while the exchange can't be reached and nothing is cached
+
+
 class BitmexClient:
-    def __init__(self, public_key: str, secret_key: str, testnet: bool):
+    def __init__(self, public_key: str, secret_key: str, testnet: bool,
+                 base_url: typing.Optional[str] = None, wss_url: typing.Optional[str] = None,
+                 http_pool_size: int = DEFAULT_POOL_SIZE, start: bool = True):
 
         self.futures = True
         self.platform = "bitmex"
@@ -34,30 +51,102 @@ class BitmexClient:
         else:
             self._base_url = "https://www.bitmex.com"
             self._wss_url = "wss://www.bitmex.com/realtime"
+
+        #urls of a local stand-in server, for testing
+        if base_url is not None:
+            self._base_url = base_url
+        if wss_url is not None:
+            self._wss_url = wss_url
         
         self._public_key = public_key
         self._secret_key = secret_key
 
-        self.ws: websocket.WebSocketApp #websocket app object
+        self._session = create_session(http_pool_size) #keep-alive connections to the REST API
+        self._rate_limiter = BitmexRateLimiter() #requests left, from the response headers
+
+        self.ws: typing.Optional[websocket.WebSocketApp] = None #websocket app object, created by start()
         self.reconnect = True
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        #contracts of the last run at once, the exchange info is downloaded by start() and only the differences applied
+        self._contract_cache = ContractCache(self._base_url)
+        self.contracts = self._contract_cache.load()
+
+        self.candle_history = CandleHistory() #candles already downloaded, only the missing ones are requested
+
+        self.balance_cache = BalanceCache(self.get_balances) #updated by the margin topic, see the balances property
 
         self.prices = {}
         self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = {}
+        self.aggregator = CandleAggregator(self) #shared candles of the strategies
+        self._symbol_strategies: typing.Dict[str, typing.Tuple[Strategy, ...]] = {} #symbol -> strategies, rebuilt when a strategy is added/removed
 
         self.logs = [] #root component will loop through this list and display new items
 
+        self.orders = OrderCache() #status of our orders, updated by the order and execution topics
+        self._order_rows: typing.Dict[str, typing.Dict] = collections.OrderedDict() #the websocket only sends the fields that changed
+        self.order_books: typing.Dict[str, OrderBook] = {} #full depth of the symbols subscribed with subscribe_order_book()
+        self.tick_recorder: typing.Optional[TickChannel] = None #see record_ticks()
+        self.clock = SYSTEM_CLOCK #time of the strategies and candles, simulated when the ticks are replayed
+        self.simulators: typing.Tuple[SimulatedClient, ...] = () #paper trading accounts fed with the ticks, see add_simulator()
+
+        self.ready = False #True once the contracts are loaded (cache or exchange) and the streams are started
+
+        if start:
+            self.start()
+
+    def start(self):
+        #requests to the exchange, blocking. main.py runs it in a thread so the UI and the other exchange don't wait
+        if len(self.contracts) > 0: #cached contracts, they are refreshed in the background
+            t = threading.Thread(target=self._refresh_contracts, daemon=True)
+            t.start()
+        else:
+            self._refresh_contracts()
+
+        if len(self.contracts) == 0: #the client is not ready until it has contracts, from the cache or the exchange
+            self._add_log(f"Bitmex contracts could not be loaded, retrying every {CONTRACTS_RETRY_INTERVAL} seconds")
+            t = threading.Thread(target=self._retry_contracts, daemon=True)
+            t.start()
+            return
+
+        self._connect()
+
+    def _retry_contracts(self):
+        while len(self.contracts) == 0:
+            time.sleep(CONTRACTS_RETRY_INTERVAL)
+
+            if not self.reconnect: #client closed
+                return
+
+            self._refresh_contracts()
+
+        self._connect()
+
+    def _connect(self):
+        #balances and streams, once the contracts are loaded
+        if len(self.balance_cache.refresh()) == 0: #requested again the next time the balances are used
+            self._add_log("Bitmex balances could not be loaded")
+
         t = threading.Thread(target=self._start_ws)
         t.start()
 
-        logger.info("Bitmex Client successfully initialized")
+        self.ready = True
+        self._add_log("Bitmex client successfully initialized")
+
+    def close(self):
+        self.reconnect = False
+
+        if self.ws is not None:
+            self.ws.close()
     
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
     
+    @property
+    def balances(self) -> typing.Dict[str, Balance]:
+        #cached balances, the REST request is only made when the cache is too old or invalidated
+        return self.balance_cache.get()
+
     def _generate_signature(self, method: str, endpoint: str, expires: str, data: typing.Dict) -> str:
  
         message = method + endpoint + "?" + urlencode(data) + expires if len(data) > 0 else method + endpoint + expires
@@ -65,34 +154,27 @@ class BitmexClient:
 
     def _make_request(self, method: str, endpoint: str, data: typing.Dict): #http method, endpoint, parameters
 
+        #waits if the request would exceed a rate limit, the orders and cancels go before the other requests
+        requests_number, orders = self._rate_limiter.cost(method, endpoint, data)
+        self._rate_limiter.acquire(requests_number, request_priority(method, endpoint), orders)
+
         headers = {}
         expires = str(int(time.time()) + 5)
         headers['api-expires'] = expires
         headers['api-key'] = self._public_key
         headers['api-signature'] = self._generate_signature(method, endpoint, expires, data)
 
-        if method == "GET": #http method
-            try:
-                response = requests.get(self._base_url + endpoint, params=data, headers=headers) #returns the response object 
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+        if method not in ["GET", "POST", "DELETE"]: #http method
+            raise ValueError()
 
-        elif method == "POST":
-            try:
-                response = requests.post(self._base_url + endpoint, params=data, headers=headers) #returns the response object         
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+        try:
+            #the pooled session reuses the connections, the timeout and the retries depend on the endpoint/method
+            response = self._session.request(method, self._base_url + endpoint, params=data, headers=headers, timeout=request_timeout(endpoint)) #returns the response object 
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
 
-        elif method == "DELETE":
-            try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=headers) #returns the response object 
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-        else:
-            raise ValueError()
+        self._rate_limiter.on_response(response.status_code, response.headers)
         
         if response.status_code == 200:
             return response.json()
@@ -129,24 +211,61 @@ class BitmexClient:
         
         return balances
 
+    def _refresh_contracts(self):
+        contracts = self.get_contracts()
+
+        if len(contracts) == 0: #request failed, the cached contracts are kept
+            return
+
+        #new dict instead of an update, the UI compares it to the one it already displays
+        self.contracts = self._contract_cache.apply(self.contracts, contracts)
+
     def get_historical_candles(self, contract: Contract, timeframe: str) -> typing.List[Candle]:
+        #the last 500 candles (the current one included), from the local history. only the candles since the last call are requested
+        tf_ms = TIMEFRAME_MS[timeframe]
+        start = (int(time.time() * 1000) // tf_ms - 499) * tf_ms
+
+        if not self.download_candles(contract, timeframe, start): #the candles already in the local history are still returned
+            logger.warning("%s: candles download for %s %s incomplete, using the local history", self.platform, contract.symbol, timeframe)
+
+        return self.candle_history.load(self._base_url, contract.symbol, timeframe, start)
+
+    def download_candles(self, contract: Contract, timeframe: str, start: int, end: typing.Optional[int] = None) -> bool:
+        #stores the candles between start and end (timestamps in ms, end=None for now) that are not in the history yet
+        return self.candle_history.fill(self._base_url, contract.symbol, timeframe,
+                                        lambda page_start, page_end: self.get_candles_page(contract, timeframe, page_start, page_end), start, end)
+
+    def missing_candles(self, contract: Contract, timeframe: str, start: int, end: int) -> typing.List[typing.Tuple[int, int]]:
+        return self.candle_history.missing(self._base_url, contract.symbol, timeframe, start, end)
+
+    def save_candles(self, contract: Contract, timeframe: str, candles: typing.List[Candle], start: int, end: int):
+        self.candle_history.save(self._base_url, contract.symbol, timeframe, candles, start, end)
+
+    def get_candles_page(self, contract: Contract, timeframe: str, start: int, end: int) -> typing.Optional[typing.List[Candle]]:
+        tf_ms = TIMEFRAME_MS[timeframe]
+
         data = {}
 
         data['symbol'] = contract.symbol
         data['partial'] = True
         data['binSize'] = timeframe
-        data['count'] = 500
-        data['reverse'] = True #show newest
+        data['count'] = CANDLES_PAGE_SIZE
+        data['reverse'] = False #oldest first, from startTime
+        #bitmex timestamps the candles with their close time
+        data['startTime'] = format_bitmex_timestamp(start + tf_ms)
+        data['endTime'] = format_bitmex_timestamp(end + tf_ms)
 
         raw_candles = self._make_request("GET", "/api/v1/trade/bucketed", data)
 
+        if raw_candles is None:
+            return None
+
         candles = []
 
-        if raw_candles is not None:
-            for c in reversed(raw_candles):
-                if c['open'] is None or c['close'] is None:
-                    continue
-                candles.append(Candle(c, timeframe, "bitmex"))
+        for c in raw_candles:
+            if c['open'] is None or c['close'] is None:
+                continue
+            candles.append(Candle(c, timeframe, "bitmex"))
 
         return candles
 
@@ -169,6 +288,9 @@ class BitmexClient:
 
         if order_status is not None:
             order_status = OrderStatus(order_status, "bitmex")
+
+            if order_status.status in ["filled", "partiallyfilled"]:
+                self.balance_cache.on_fill()
         
         return order_status
 
@@ -196,6 +318,30 @@ class BitmexClient:
                     return OrderStatus(order, "bitmex") 
         
     
+    def add_strategy(self, b_index: int, strategy: Strategy) -> bool:
+        if not self.aggregator.subscribe(strategy): #no historical candles
+            return False
+
+        self.strategies[b_index] = strategy
+        self._index_strategies()
+
+        return True
+
+    def remove_strategy(self, b_index: int):
+        strategy = self.strategies.pop(b_index)
+
+        self.aggregator.unsubscribe(strategy)
+        self._index_strategies()
+
+    def _index_strategies(self):
+        #the websocket thread only reads the index, it gets a new dict instead of one modified while it loops over it
+        index = collections.defaultdict(tuple)
+
+        for strat in self.strategies.values():
+            index[strat.contract.symbol] += (strat,)
+
+        self._symbol_strategies = dict(index)
+
     def _start_ws(self): #starts connection and assign a certain function when an event occurs
         self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close, on_error=self._on_error, on_message=self._on_message) #websocketApp object. first argument is websocket url, others to specify call back
         
@@ -216,70 +362,174 @@ class BitmexClient:
         self.subscribe_channel("instrument") #when connection opens, subscribe to channel
         self.subscribe_channel("trade")
 
+        #private topics: authenticate the connection first
+        expires = str(int(time.time()) + 5)
+        signature = self._generate_signature("GET", "/realtime", expires, {})
+
+        try:
+            self.ws.send(json.dumps({"op": "authKeyExpires", "args": [self._public_key, int(expires), signature]}))
+        except Exception as e:
+            logger.error("Websocket error while authenticating: %s", e)
+
+        self.subscribe_channel("order")
+        self.subscribe_channel("execution")
+        self.subscribe_channel("margin")
+
+        for symbol in self.order_books: #a partial of each book follows
+            self.subscribe_channel("orderBookL2:" + symbol)
+
+        #the balance updates sent while disconnected are lost
+        self.balance_cache.streaming = True
+        self.balance_cache.invalidate()
+
+        #orders updates sent while the connection was closed are lost, check the pending orders once
+        for contract, order_id in self.orders.pending():
+            order_status = self.get_order_status(contract, order_id)
+            if order_status is not None:
+                self.orders.update(order_status)
+
     def _on_close(self, ws, close_status_code, close_msg):
         logger.warning("Bitmex Websocket connection closed")
+        self.balance_cache.streaming = False
+
+        for book in self.order_books.values():
+            book.reset()
     
     def _on_error(self, ws, msg: str):
         logger.error("Bitmex connection error: %s", msg)
 
+    def add_simulator(self, simulator: SimulatedClient):
+        #the simulated orders are filled with the prices received by this client. the tuple is replaced, not modified,
+        #the websocket thread loops over it
+        self.simulators = self.simulators + (simulator,)
+
+    def remove_simulator(self, simulator: SimulatedClient):
+        self.simulators = tuple(s for s in self.simulators if s is not simulator)
+
+    def record_ticks(self, recorder: typing.Optional[TickRecorder]):
+        #every quote (instrument) and trade received is written by the recorder, None to stop
+        self.tick_recorder = recorder.channel(self.platform) if recorder is not None else None
+
     def _on_message(self, ws, msg: str):
-        data = json.loads(msg) #convert json string that we received to json object that we can pass. loads() does this
-        
-        if "table" in data:
-            if data['table'] == "instrument":
-
-                for d in data['data']:
-
-                    symbol = d['symbol']
-
-                    if symbol not in self.prices:
-                        self.prices[symbol] = {'bid': None, 'ask': None}
-
-                    if 'bidPrice' in d:
-                        self.prices[symbol]['bid'] = d['bidPrice']
-
-                    if 'askPrice' in d:
-                        self.prices[symbol]['ask'] = d['askPrice']
-
-                    #pnl calculations/updates
-                    try:
-                        for b_index, strat in self.strategies.items():
-                            if strat.contract.symbol == symbol:
-                                for trade in strat.trades:
-                                    if trade.status == "open" and trade.entry_price is not None:
-
-                                        if trade.side == "long":
-                                            price = self.prices[symbol]['bid']
-                                        else:
-                                            price = self.prices[symbol]['ask']
-
-                                        multiplier = trade.contract.multiplier
-
-                                        if trade.contract.inverse:
-                                            if trade.side == "long":
-                                                trade.pnl = (1 / trade.entry_price - 1 / price) * multiplier * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (1 / price - 1 / trade.entry_price) * multiplier * trade.quantity
-                                        else:
-                                            if trade.side == "long":
-                                                trade.pnl = (price - trade.entry_price) * multiplier * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (trade.entry_price - price) * multiplier * trade.quantity
-                    except RuntimeError as e:
-                        logger.error("Error while looping through the Bitmex strategies: %s", e)
-            
-            if data['table'] == "trade":
-
-                for d in data['data']:
-                    symbol = d['symbol']
-                    ts = int(dateutil.parser.isoparse(d['timestamp']).timestamp() * 1000) #timestamp represents time of the trade, iso format converted to unix timestamp
-
-                    for key, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            res = strat.parse_trades(float(d['price']), float(d['size']), ts)
-                            strat.check_trade(res)
+        received = time.time_ns()
+        table, action, rows = decoding.decode_bitmex(msg)
+
+        if table == "instrument":
+
+            for d in rows:
+
+                symbol = d['symbol']
+
+                prices = self.prices.get(symbol)
+                if prices is None:
+                    prices = {'bid': None, 'ask': None}
+                    self.prices[symbol] = prices
+
+                if 'bidPrice' in d:
+                    prices['bid'] = d['bidPrice']
+
+                if 'askPrice' in d:
+                    prices['ask'] = d['askPrice']
+
+                if self.tick_recorder is not None and ('bidPrice' in d or 'askPrice' in d):
+                    self.tick_recorder.quote(symbol, parse_bitmex_timestamp(d['timestamp']) if 'timestamp' in d else None,
+                                             prices['bid'], prices['ask'])
+
+                for simulator in self.simulators:
+                    simulator.on_quote(symbol, prices['bid'], prices['ask'])
+
+                strategies = self._symbol_strategies.get(symbol)
+                if strategies is None:
+                    continue
+
+                #pnl calculations/updates, only for the strategies trading this symbol
+                for strat in strategies:
+                    if strat.open_trades:
+                        strat.update_pnl(prices['bid'], prices['ask'])
+
+        elif table == "trade":
+
+            for d in rows:
+                ts = parse_bitmex_timestamp(d['timestamp']) #timestamp represents time of the trade, iso format converted to unix timestamp
+
+                if self.tick_recorder is not None:
+                    self.tick_recorder.trade(d['symbol'], ts, float(d['price']), float(d['size']), d['side'] == "Sell")
+
+                for simulator in self.simulators: #simulated orders are matched before the strategies see the trade
+                    simulator.on_trade(d['symbol'], float(d['price']))
+
+                tick = LATENCY_MONITOR.on_trade(self.platform, ts, received)
+
+                self.aggregator.on_trade(d['symbol'], float(d['price']), float(d['size']), ts, tick) #candles built once per symbol / timeframe
+                LATENCY_MONITOR.on_trade_processed(tick)
+
+        elif table == "margin":
+
+            for d in rows:
+                balance = self.balance_cache.get_cached(d['currency'])
+
+                if balance is None:
+                    if all(key in d for key in BITMEX_BALANCE_FIELDS):
+                        self.balance_cache.set(d['currency'], Balance(d, "bitmex"))
+                    continue
+
+                balance = copy.copy(balance) #only the fields that changed are sent
+                for key, attribute in BITMEX_BALANCE_FIELDS.items():
+                    if key in d:
+                        setattr(balance, attribute, d[key] * BITMEX_MULTIPLIER)
+
+                self.balance_cache.set(d['currency'], balance)
+
+        elif table == "orderBookL2":
+
+            symbol_rows = {} #a message can contain the rows of several books
+            for d in rows:
+                symbol_rows.setdefault(d['symbol'], []).append(d)
+
+            for symbol, book_rows in symbol_rows.items():
+                book = self.order_books.get(symbol)
+                if book is not None:
+                    book.apply_l2(action, book_rows)
+
+        elif table in ["order", "execution"]:
+
+            for d in rows:
+                if 'orderID' not in d:
+                    continue
+
+                row = self._order_rows.setdefault(d['orderID'], {})
+                row.update(d)
+
+                #orders of other sessions or still resting on the book never reach a final status here, the oldest
+                #rows leave like in the OrderCache
+                self._order_rows.move_to_end(d['orderID'])
+                while len(self._order_rows) > MAX_CACHED_ORDERS:
+                    self._order_rows.popitem(last=False)
+
+                if all(key in row for key in ["ordStatus", "avgPx", "cumQty"]):
+                    order_status = OrderStatus(row, "bitmex")
+                    self.orders.update(order_status)
+
+                    if order_status.status in ["filled", "partiallyfilled"]:
+                        self.balance_cache.on_fill()
+
+                    if order_status.status in FINAL_STATUSES:
+                        del self._order_rows[d['orderID']]
                     
     
+    def subscribe_order_book(self, contract: Contract) -> OrderBook:
+        #the partial sent after the subscription loads the book, then the insert/update/delete rows keep it current
+        book = self.order_books.get(contract.symbol)
+
+        if book is None:
+            book = OrderBook(contract.symbol)
+            self.order_books[contract.symbol] = book
+
+            if self.ws is not None: #otherwise subscribed by _on_open()
+                self.subscribe_channel("orderBookL2:" + contract.symbol)
+
+        return book
+
     def subscribe_channel(self, topic: str): 
         #creating json object. create python dict and fill it with the keys from binance documentation
         data = {}
@@ -294,7 +544,7 @@ class BitmexClient:
     
     def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
 
-        balance = self.get_balances()
+        balance = self.balances #local lookup, no REST request on the signal path
         if balance is not None:
             if "XBt" in balance:
                 balance = balance['XBt'].wallet_balance
@@ -0,0 +1,386 @@
+import asyncio
+import logging
+import time
+import typing
+import collections
+import copy
+
+from urllib.parse import urlencode
+
+import hmac
+import hashlib
+
+import aiohttp
+
+from models import *
+
+from connectors import decoding
+from connectors.http_session import request_timeout
+from connectors.rate_limiter import BitmexRateLimiter, request_priority
+from connectors.order_cache import OrderCache, FINAL_STATUSES, MAX_CACHED_ORDERS
+from connectors.balance_cache import BalanceCache
+
+logger = logging.getLogger()
+
+
+class AsyncBitmexClient: #asyncio version of BitmexClient, the REST requests and the websocket share one event loop
+    def __init__(self, public_key: str, secret_key: str, testnet: bool,
+                 base_url: typing.Optional[str] = None, wss_url: typing.Optional[str] = None,
+                 on_trade: typing.Optional[typing.Callable[[str, float, float, int], None]] = None):
+
+        self.futures = True
+        self.platform = "bitmex"
+
+        if testnet:
+            self._base_url = "https://testnet.bitmex.com"
+            self._wss_url = "wss://testnet.bitmex.com/realtime"
+        else:
+            self._base_url = "https://www.bitmex.com"
+            self._wss_url = "wss://www.bitmex.com/realtime"
+
+        #urls of a local stand-in server, for testing
+        if base_url is not None:
+            self._base_url = base_url
+        if wss_url is not None:
+            self._wss_url = wss_url
+
+        self._public_key = public_key
+        self._secret_key = secret_key
+
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self._rate_limiter = BitmexRateLimiter()
+        self.ws: typing.Optional[aiohttp.ClientWebSocketResponse] = None
+        self.reconnect = True
+
+        self.contracts: typing.Dict[str, Contract] = {}
+        self.balance_cache = BalanceCache(None) #updated by the margin topic, reloaded in the event loop by get_cached_balances()
+        self.prices = {}
+
+        self.on_trade = on_trade #called with (symbol, price, size, timestamp) for each row of the trade table
+
+        self.orders = OrderCache()
+        self._order_rows: typing.Dict[str, typing.Dict] = collections.OrderedDict() #the websocket only sends the fields that changed
+
+        self._topics = ["instrument", "trade"]
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        #must be awaited inside the running event loop, the contracts and the balances are requested concurrently
+        self.session = aiohttp.ClientSession()
+
+        self.contracts, balances = await asyncio.gather(self.get_contracts(), self.get_balances())
+        self.balance_cache.store(balances)
+
+        self._tasks.append(asyncio.create_task(self._run_ws()))
+
+        logger.info("Bitmex async client successfully initialized")
+
+    async def close(self):
+        self.reconnect = False
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self.session is not None:
+            await self.session.close()
+
+    @property
+    def balances(self) -> typing.Dict[str, Balance]:
+        #last balances loaded or streamed, get_cached_balances() reloads them when they are too old
+        return self.balance_cache.cached()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _generate_signature(self, method: str, endpoint: str, expires: str, data: typing.Dict) -> str:
+
+        message = method + endpoint + "?" + urlencode(data) + expires if len(data) > 0 else method + endpoint + expires
+        return hmac.new(self._secret_key.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    async def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+        if method not in ["GET", "POST", "DELETE"]:
+            raise ValueError()
+
+        #waits if the request would exceed a rate limit, the orders and cancels go before the other requests
+        requests_number, orders = self._rate_limiter.cost(method, endpoint, data)
+        await self._rate_limiter.acquire_async(requests_number, request_priority(method, endpoint), orders)
+
+        headers = {}
+        expires = str(int(time.time()) + 5)
+        headers['api-expires'] = expires
+        headers['api-key'] = self._public_key
+        headers['api-signature'] = self._generate_signature(method, endpoint, expires, data)
+
+        #the query string must be exactly the signed one (aiohttp doesn't accept booleans in params)
+        url = self._base_url + endpoint
+        if len(data) > 0:
+            url += "?" + urlencode(data)
+
+        connect_timeout, read_timeout = request_timeout(endpoint)
+
+        try:
+            async with self.session.request(method, url, headers=headers, timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)) as response:
+                status_code = response.status
+                response_data = await response.json(content_type=None)
+
+                self._rate_limiter.on_response(status_code, response.headers)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        if status_code == 200:
+            return response_data
+        else:
+            logger.error("Error while making %s request to %s: %s (error code %s)",
+                         method, endpoint, response_data, status_code)
+            return None
+
+    async def get_contracts(self) -> typing.Dict[str, Contract]:
+
+        instruments = await self._make_request("GET", "/api/v1/instrument/active", {})
+
+        contracts = {}
+
+        if instruments is not None:
+            for s in instruments:
+                contracts[s['symbol']] = Contract(s, "bitmex")
+
+        return collections.OrderedDict(sorted(contracts.items()))
+
+    async def get_balances(self) -> typing.Dict[str, Balance]:
+        data = {}
+        data['currency'] = "all"
+
+        margin_data = await self._make_request("GET", "/api/v1/user/margin", data)
+
+        balances = {}
+
+        if margin_data is not None:
+            for a in margin_data:
+                balances[a['currency']] = Balance(a, "bitmex")
+
+        return balances
+
+    async def get_historical_candles(self, contract: Contract, timeframe: str) -> typing.List[Candle]:
+        data = {}
+
+        data['symbol'] = contract.symbol
+        data['partial'] = True
+        data['binSize'] = timeframe
+        data['count'] = 500
+        data['reverse'] = True
+
+        raw_candles = await self._make_request("GET", "/api/v1/trade/bucketed", data)
+
+        candles = []
+
+        if raw_candles is not None:
+            for c in reversed(raw_candles):
+                if c['open'] is None or c['close'] is None:
+                    continue
+                candles.append(Candle(c, timeframe, "bitmex"))
+
+        return candles
+
+    async def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None, tif=None) -> OrderStatus:
+        data = {}
+
+        data['symbol'] = contract.symbol
+        data['side'] = side.capitalize()
+        data['orderQty'] = round(quantity / contract.lot_size) * contract.lot_size
+        data['ordType'] = order_type.capitalize()
+
+        if price is not None:
+            data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
+
+        if tif is not None:
+            data['timeInForce'] = tif
+
+        order_status = await self._make_request("POST", "/api/v1/order", data)
+
+        if order_status is not None:
+            order_status = OrderStatus(order_status, "bitmex")
+
+            if order_status.status in ["filled", "partiallyfilled"]:
+                self.balance_cache.on_fill()
+
+        return order_status
+
+    async def cancel_order(self, order_id: str) -> OrderStatus:
+        data = {}
+        data['orderID'] = order_id
+
+        order_status = await self._make_request("DELETE", "/api/v1/order", data)
+
+        if order_status is not None:
+            order_status = OrderStatus(order_status[0], "bitmex")
+
+        return order_status
+
+    async def get_order_status(self, contract: Contract, order_id: str) -> OrderStatus:
+        data = {}
+        data['symbol'] = contract.symbol
+        data['reverse'] = True
+
+        order_status = await self._make_request("GET", "/api/v1/order", data)
+
+        if order_status is not None:
+            for order in order_status:
+                if order['orderID'] == order_id:
+                    return OrderStatus(order, "bitmex")
+
+    async def get_cached_balances(self) -> typing.Dict[str, Balance]:
+        #the REST request is only made when the cache is too old or invalidated, like the balances of BitmexClient
+        if not self.balance_cache.fresh():
+            self.balance_cache.store(await self.get_balances())
+
+        return self.balance_cache.cached()
+
+    async def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+
+        balance = await self.get_cached_balances() #no REST request on the signal path while the cache is fresh
+
+        if "XBt" not in balance:
+            return None
+
+        balance = balance['XBt'].wallet_balance
+
+        xbt_size = balance * balance_pct / 100
+
+        #number of contracts to trade
+        if contract.inverse:
+            contracts_number = xbt_size / (contract.multiplier / price)
+        else:
+            contracts_number = xbt_size / (contract.multiplier * price)
+
+        logger.info("Bitmex current XBT balance = %s, contracts number = %s", balance, contracts_number)
+
+        return int(contracts_number)
+
+    async def _run_ws(self):
+        while self.reconnect:
+            try:
+                async with self.session.ws_connect(self._wss_url, heartbeat=30) as ws:
+                    self.ws = ws
+                    await self._on_open()
+
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._on_message(msg.data)
+                        elif msg.type in [aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR]:
+                            break
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Bitmex connection error: %s", e)
+
+            self.ws = None
+            self.balance_cache.streaming = False
+            logger.warning("Bitmex websocket connection closed")
+
+            await asyncio.sleep(2)
+
+    async def _on_open(self):
+        logger.info("Bitmex connection opened")
+
+        #private topics: authenticate the connection first, then every topic in one message
+        expires = str(int(time.time()) + 5)
+        signature = self._generate_signature("GET", "/realtime", expires, {})
+
+        await self.ws.send_json({"op": "authKeyExpires", "args": [self._public_key, int(expires), signature]})
+        await self.ws.send_json({"op": "subscribe", "args": self._topics + ["order", "execution", "margin"]})
+
+        #the balance updates sent while disconnected are lost
+        self.balance_cache.streaming = True
+        self.balance_cache.invalidate()
+
+        #orders updates sent while the connection was closed are lost, check the pending orders at once
+        pending = self.orders.pending()
+        for order_status in await asyncio.gather(*[self.get_order_status(c, o) for c, o in pending]):
+            if order_status is not None:
+                self.orders.update(order_status)
+
+    def _on_message(self, msg: str):
+        table, action, rows = decoding.decode_bitmex(msg)
+
+        if table == "instrument":
+
+            for d in rows:
+                prices = self.prices.get(d['symbol'])
+                if prices is None:
+                    prices = {'bid': None, 'ask': None}
+                    self.prices[d['symbol']] = prices
+
+                if 'bidPrice' in d:
+                    prices['bid'] = d['bidPrice']
+
+                if 'askPrice' in d:
+                    prices['ask'] = d['askPrice']
+
+        elif table == "trade":
+
+            if self.on_trade is not None:
+                for d in rows:
+                    self.on_trade(d['symbol'], float(d['price']), float(d['size']), parse_bitmex_timestamp(d['timestamp']))
+
+        elif table == "margin":
+
+            for d in rows:
+                balance = self.balance_cache.get_cached(d['currency'])
+
+                if balance is None:
+                    if all(key in d for key in BITMEX_BALANCE_FIELDS):
+                        self.balance_cache.set(d['currency'], Balance(d, "bitmex"))
+                    continue
+
+                balance = copy.copy(balance) #only the fields that changed are sent
+                for key, attribute in BITMEX_BALANCE_FIELDS.items():
+                    if key in d:
+                        setattr(balance, attribute, d[key] * BITMEX_MULTIPLIER)
+
+                self.balance_cache.set(d['currency'], balance)
+
+        elif table in ["order", "execution"]:
+
+            for d in rows:
+                if 'orderID' not in d:
+                    continue
+
+                row = self._order_rows.setdefault(d['orderID'], {})
+                row.update(d)
+
+                #orders of other sessions or still resting on the book never reach a final status here, the oldest
+                #rows leave like in the OrderCache
+                self._order_rows.move_to_end(d['orderID'])
+                while len(self._order_rows) > MAX_CACHED_ORDERS:
+                    self._order_rows.popitem(last=False)
+
+                if all(key in row for key in ["ordStatus", "avgPx", "cumQty"]):
+                    order_status = OrderStatus(row, "bitmex")
+                    self.orders.update(order_status)
+
+                    if order_status.status in ["filled", "partiallyfilled"]:
+                        self.balance_cache.on_fill()
+
+                    if order_status.status in FINAL_STATUSES:
+                        del self._order_rows[d['orderID']]
+
+        elif table is None and "error" in rows:
+            logger.error("Bitmex websocket error: %s", rows['error'])
+
+    def subscribe_channel(self, topic: str):
+        #not a coroutine: the topic is also kept for the next connections, it must be called from the event loop thread
+
+        if topic in self._topics:
+            return
+
+        self._topics.append(topic)
+
+        if self.ws is not None and not self.ws.closed:
+            asyncio.create_task(self.ws.send_json({"op": "subscribe", "args": [topic]}))
@@ -0,0 +1,84 @@
+import json
+import logging
+import typing
+
+logger = logging.getLogger()
+
+#message kinds returned by the decode functions
+OTHER = 0
+BOOK_TICKER = 1
+AGG_TRADE = 2
+DEPTH_UPDATE = 3
+
+
+def _load_backends() -> typing.Dict[str, typing.Callable]:
+    backends = {"json": json.loads}
+
+    try:
+        import ujson
+        backends["ujson"] = ujson.loads
+    except ImportError:
+        pass
+
+    try:
+        import orjson #fastest, accepts str and bytes
+        backends["orjson"] = orjson.loads
+    except ImportError:
+        pass
+
+    return backends
+
+
+JSON_BACKENDS = _load_backends()
+JSON_BACKEND = next(name for name in ["orjson", "ujson", "json"] if name in JSON_BACKENDS)
+
+loads = JSON_BACKENDS[JSON_BACKEND]
+
+
+def set_json_backend(name: str):
+    global loads, JSON_BACKEND
+
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"JSON backend {name} is not installed, available: {list(JSON_BACKENDS.keys())}")
+
+    JSON_BACKEND = name
+    loads = JSON_BACKENDS[name]
+
+    logger.info("JSON backend: %s", name)
+
+
+def decode_binance(msg: typing.Union[str, bytes]) -> typing.Tuple:
+    #(BOOK_TICKER, symbol, bid, ask, event time or None on spot), (AGG_TRADE, symbol, price, quantity, trade time, buyer is maker),
+    #(DEPTH_UPDATE, symbol, first update id, last update id, previous update id, bids, asks, event time) or (OTHER, data)
+    #the fields are read directly instead of going through a chain of membership tests
+
+    data = loads(msg)
+
+    if "data" in data and "stream" in data: #combined stream wrapper
+        data = data['data']
+
+    event = data.get("e")
+
+    if event == "aggTrade":
+        return AGG_TRADE, data['s'], float(data['p']), float(data['q']), data['T'], data['m']
+
+    if event == "bookTicker" or (event is None and "u" in data and "A" in data): #spot bookTicker has no event type
+        return BOOK_TICKER, data['s'], float(data['b']), float(data['a']), data.get('E')
+
+    if event == "depthUpdate": #"pu" only on futures, the levels are converted by the order book
+        return DEPTH_UPDATE, data['s'], data['U'], data['u'], data.get('pu'), data['b'], data['a'], data['E']
+
+    return OTHER, data
+
+
+def decode_bitmex(msg: typing.Union[str, bytes]) -> typing.Tuple[typing.Optional[str], typing.Optional[str], typing.Any]:
+    #(table, action, rows) for the table messages, (None, None, data) for the others (subscriptions, errors)
+
+    data = loads(msg)
+
+    table = data.get("table")
+
+    if table is None:
+        return None, None, data
+
+    return table, data.get("action"), data['data']
@@ -0,0 +1,49 @@
+import typing
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10 #connections kept alive per host
+
+#(connect, read) timeouts in seconds, a stalled request can't block the websocket thread for longer than that
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    "/fapi/v1/order": (3.05, 5),
+    "/api/v3/order": (3.05, 5),
+    "/api/v1/order": (3.05, 5),
+    "/fapi/v1/klines": (3.05, 20),
+    "/api/v3/klines": (3.05, 20),
+    "/api/v1/trade/bucketed": (3.05, 20),
+    "/fapi/v1/exchangeInfo": (3.05, 20),
+    "/api/v3/exchangeInfo": (3.05, 20),
+    "/api/v1/instrument/active": (3.05, 20),
+}
+
+#idempotent methods are retried on read errors and server errors too, the other ones (orders) only when the
+#connection failed, i.e. when the request didn't reach the exchange
+RETRY_METHODS = ["GET", "PUT", "DELETE"]
+RETRY_STATUSES = [500, 502, 503, 504]
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = 3, read_retries: int = 1, backoff: float = 0.3,
+                   headers: typing.Optional[typing.Dict] = None) -> requests.Session:
+
+    #a read timeout already cost the whole timeout, it is retried less than a refused connection or a 5xx
+    retry = Retry(total=retries, connect=retries, read=read_retries, status=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=RETRY_METHODS, raise_on_status=False)
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if headers is not None:
+        session.headers.update(headers)
+
+    return session
+
+
+def request_timeout(endpoint: str) -> typing.Tuple[float, float]:
+    return ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
@@ -0,0 +1,63 @@
+import collections
+import logging
+import threading
+import typing
+
+from models import OrderStatus, Contract
+
+logger = logging.getLogger()
+
+FINAL_STATUSES = ["filled", "canceled", "cancelled", "expired", "rejected", "expired_in_match"]
+MAX_CACHED_ORDERS = 1000 #orders nobody is waiting for are only kept in case a watch() arrives after the update
+
+
+class OrderCache: #latest status of our orders, fed by the private websocket streams instead of polling the REST API
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self._orders: typing.Dict[typing.Any, OrderStatus] = collections.OrderedDict()
+        self._callbacks: typing.Dict[typing.Any, typing.List[typing.Callable[[OrderStatus], None]]] = {}
+        self._contracts: typing.Dict[typing.Any, Contract] = {} #contract of the watched orders, for the REST reconciliation
+
+    def update(self, order_status: OrderStatus):
+        #new status received from the stream (or from a REST reconciliation), calls the callbacks once the order is final
+
+        with self._lock:
+            self._orders[order_status.order_id] = order_status
+            self._orders.move_to_end(order_status.order_id)
+
+            while len(self._orders) > MAX_CACHED_ORDERS:
+                self._orders.popitem(last=False)
+
+            if order_status.status in FINAL_STATUSES:
+                callbacks = self._callbacks.pop(order_status.order_id, [])
+                self._contracts.pop(order_status.order_id, None)
+            else:
+                callbacks = []
+
+        for callback in callbacks:
+            try:
+                callback(order_status)
+            except Exception as e:
+                logger.error("Error in the order %s update callback: %s", order_status.order_id, e)
+
+    def get(self, order_id) -> typing.Optional[OrderStatus]:
+        return self._orders.get(order_id)
+
+    def watch(self, contract: Contract, order_id, callback: typing.Callable[[OrderStatus], None]):
+        #callback(order_status) is called once when the order is filled, canceled, expired or rejected
+
+        with self._lock:
+            order_status = self._orders.get(order_id)
+
+            if order_status is None or order_status.status not in FINAL_STATUSES:
+                self._callbacks.setdefault(order_id, []).append(callback)
+                self._contracts[order_id] = contract
+                return
+
+        callback(order_status) #the update arrived before the watch
+
+    def pending(self) -> typing.List[typing.Tuple[Contract, typing.Any]]:
+        #(contract, order_id) of the orders someone is waiting for, checked through the REST API after a stream reconnection
+        with self._lock:
+            return [(self._contracts[order_id], order_id) for order_id in self._callbacks]
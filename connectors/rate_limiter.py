@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+#request priorities, a lower priority can only use part of each limit so the orders always have room
+PRIORITY_HIGH = 0 #order placement and cancels
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2 #bulk data: historical candles, contracts lists
+PRIORITY_SHARES = {PRIORITY_HIGH: 1.0, PRIORITY_NORMAL: 0.9, PRIORITY_LOW: 0.7}
+
+ORDER_ENDPOINTS = ["/fapi/v1/order", "/api/v3/order", "/api/v1/order"]
+BULK_ENDPOINTS = ["/fapi/v1/klines", "/api/v3/klines", "/fapi/v1/exchangeInfo", "/api/v3/exchangeInfo",
+                  "/api/v1/instrument/active", "/api/v1/trade/bucketed"]
+
+
+def request_priority(method: str, endpoint: str) -> int:
+    if endpoint in ORDER_ENDPOINTS and method in ["POST", "DELETE"]:
+        return PRIORITY_HIGH
+    if endpoint in BULK_ENDPOINTS:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+
+class RateWindow: #amount used in a fixed time window (weight, orders, requests)
+    def __init__(self, limit: int, seconds: int):
+        self.limit = limit
+        self.seconds = seconds
+        self.used = 0
+        self.reset_at = 0.0
+
+    def _roll(self, now: float):
+        if now >= self.reset_at:
+            self.used = 0
+            self.reset_at = (now // self.seconds + 1) * self.seconds #the exchange windows are aligned on the clock
+
+    def wait_time(self, amount: int, share: float, now: float) -> float:
+        self._roll(now)
+
+        if amount == 0 or self.used == 0 or self.used + amount <= self.limit * share:
+            return 0
+
+        return self.reset_at - now
+
+    def consume(self, amount: int, now: float):
+        self._roll(now)
+        self.used += amount
+
+    def set_used(self, used: int, now: float, reset_at: typing.Optional[float] = None):
+        #value reported by the exchange, it includes the requests of the other programs using the same IP/account
+        self._roll(now)
+        self.used = used
+        if reset_at is not None:
+            self.reset_at = reset_at
+
+
+class RateLimiter: #delays the requests before a limit is reached instead of getting a 429 (or an IP ban)
+    def __init__(self, weight_windows: typing.Dict[str, RateWindow], order_windows: typing.Dict[str, RateWindow]):
+        self.weight_windows = weight_windows
+        self.order_windows = order_windows
+
+        self._condition = threading.Condition()
+        self._high_waiting = 0
+        self._blocked_until = 0.0
+
+    def cost(self, method: str, endpoint: str, data: typing.Dict) -> typing.Tuple[int, int]:
+        #(weight, orders) of a request
+        return 1, 0
+
+    def update(self, headers: typing.Mapping[str, str]):
+        pass
+
+    def _wait_time(self, weight: int, orders: int, priority: int, now: float) -> float:
+        if now < self._blocked_until:
+            return self._blocked_until - now
+
+        if priority != PRIORITY_HIGH and self._high_waiting > 0: #an order is waiting for some room, let it go first
+            return 0.05
+
+        share = PRIORITY_SHARES[priority]
+
+        waits = [w.wait_time(weight, share, now) for w in self.weight_windows.values()]
+        waits += [w.wait_time(orders, share, now) for w in self.order_windows.values()]
+
+        return max(waits, default=0)
+
+    def _consume(self, weight: int, orders: int, now: float):
+        for window in self.weight_windows.values():
+            window.consume(weight, now)
+        for window in self.order_windows.values():
+            window.consume(orders, now)
+
+    def acquire(self, weight: int, priority: int, orders: int = 0) -> float:
+        #blocks the calling thread until the request can be sent, returns the seconds waited
+
+        start = time.time()
+
+        with self._condition:
+            if priority == PRIORITY_HIGH:
+                self._high_waiting += 1
+
+            try:
+                while True:
+                    now = time.time()
+                    wait = self._wait_time(weight, orders, priority, now)
+
+                    if wait <= 0:
+                        self._consume(weight, orders, now)
+                        return now - start
+
+                    if wait > 1:
+                        logger.warning("Rate limit: request delayed by %.1f seconds", wait)
+
+                    self._condition.wait(wait)
+            finally:
+                if priority == PRIORITY_HIGH:
+                    self._high_waiting -= 1
+                    self._condition.notify_all()
+
+    async def acquire_async(self, weight: int, priority: int, orders: int = 0) -> float:
+        #same as acquire() for the asyncio clients, the event loop keeps running while the request waits
+
+        start = time.time()
+
+        if priority == PRIORITY_HIGH:
+            with self._condition:
+                self._high_waiting += 1
+
+        try:
+            while True:
+                with self._condition:
+                    now = time.time()
+                    wait = self._wait_time(weight, orders, priority, now)
+
+                    if wait <= 0:
+                        self._consume(weight, orders, now)
+                        return now - start
+
+                if wait > 1:
+                    logger.warning("Rate limit: request delayed by %.1f seconds", wait)
+
+                await asyncio.sleep(wait)
+        finally:
+            if priority == PRIORITY_HIGH:
+                with self._condition:
+                    self._high_waiting -= 1
+                    self._condition.notify_all()
+
+    def block(self, seconds: float):
+        #429/418 received: nothing is sent until the exchange accepts requests again
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+
+        logger.error("Rate limit exceeded, requests paused for %s seconds", seconds)
+
+    def on_response(self, status_code: int, headers: typing.Mapping[str, str]):
+        with self._condition:
+            self.update(headers)
+
+        if status_code in [418, 429]:
+            try:
+                retry_after = float(headers.get("Retry-After", 60))
+            except ValueError:
+                retry_after = 60
+            self.block(retry_after)
+
+
+class BinanceRateLimiter(RateLimiter):
+    def __init__(self, futures: bool):
+        self.futures = futures
+
+        if futures:
+            super().__init__({"1M": RateWindow(2400, 60)}, {"10S": RateWindow(300, 10), "1M": RateWindow(1200, 60)})
+        else:
+            super().__init__({"1M": RateWindow(6000, 60)}, {"10S": RateWindow(100, 10), "1D": RateWindow(200000, 86400)})
+
+    def cost(self, method: str, endpoint: str, data: typing.Dict) -> typing.Tuple[int, int]:
+        #request weights from the binance documentation
+
+        if endpoint in ["/fapi/v1/klines", "/api/v3/klines"]:
+            if not self.futures:
+                return 2, 0
+            limit = data.get('limit', 500)
+            if limit < 100:
+                return 1, 0
+            elif limit < 500:
+                return 2, 0
+            elif limit <= 1000:
+                return 5, 0
+            return 10, 0
+
+        if endpoint in ["/fapi/v1/order", "/api/v3/order"]:
+            if method == "POST":
+                return (0 if self.futures else 1), 1
+            if method == "GET" and not self.futures:
+                return 4, 0
+            return 1, 0
+
+        weights = {
+            "/fapi/v1/exchangeInfo": 1,
+            "/api/v3/exchangeInfo": 20,
+            "/fapi/v1/account": 5,
+            "/api/v3/account": 20,
+            "/fapi/v1/ticker/bookTicker": 2,
+            "/api/v3/ticker/bookTicker": 2,
+            "/fapi/v1/depth": 20, #limit=1000
+            "/api/v3/depth": 50,
+            "/api/v3/myTrades": 20,
+            "/fapi/v1/listenKey": 1,
+            "/api/v3/userDataStream": 2,
+        }
+
+        return weights.get(endpoint, 1), 0
+
+    def update(self, headers: typing.Mapping[str, str]):
+        #X-MBX-USED-WEIGHT-1M, X-MBX-ORDER-COUNT-10S, ...
+        now = time.time()
+
+        for name, value in headers.items():
+            name = name.upper()
+
+            if name.startswith("X-MBX-USED-WEIGHT-"):
+                window = self.weight_windows.get(name[len("X-MBX-USED-WEIGHT-"):])
+            elif name.startswith("X-MBX-ORDER-COUNT-"):
+                window = self.order_windows.get(name[len("X-MBX-ORDER-COUNT-"):])
+            else:
+                continue
+
+            if window is not None:
+                window.set_used(int(value), now)
+
+
+class BitmexRateLimiter(RateLimiter):
+    def __init__(self):
+        #120 requests per minute, the order endpoints also have a limit of 10 per second
+        super().__init__({"minute": RateWindow(120, 60)}, {"second": RateWindow(10, 1)})
+
+    def cost(self, method: str, endpoint: str, data: typing.Dict) -> typing.Tuple[int, int]:
+        if endpoint == "/api/v1/order" and method in ["POST", "DELETE"]:
+            return 1, 1
+        return 1, 0
+
+    def update(self, headers: typing.Mapping[str, str]):
+        #x-ratelimit-limit, x-ratelimit-remaining, x-ratelimit-reset (unix time) and x-ratelimit-remaining-1s
+        now = time.time()
+
+        values = {name.lower(): value for name, value in headers.items() if name.lower().startswith("x-ratelimit-")}
+
+        if "x-ratelimit-remaining" in values:
+            window = self.weight_windows["minute"]
+            window.limit = int(values.get("x-ratelimit-limit", window.limit))
+
+            reset_at = float(values["x-ratelimit-reset"]) if "x-ratelimit-reset" in values else None
+            window.set_used(window.limit - int(values["x-ratelimit-remaining"]), now, reset_at)
+
+        if "x-ratelimit-remaining-1s" in values:
+            window = self.order_windows["second"]
+            window.set_used(window.limit - int(values["x-ratelimit-remaining-1s"]), now)
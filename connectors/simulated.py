@@ -0,0 +1,488 @@
+import logging
+import threading
+import typing
+import uuid
+
+from models import *
+
+from clock import Clock, SYSTEM_CLOCK
+from order_book import OrderBook
+from tick_recorder import QUOTE, TRADE_BUY, TRADE_SELL
+from connectors.order_cache import OrderCache
+
+logger = logging.getLogger()
+
+#(maker, taker) fee rates of the regular accounts, a negative maker fee is a rebate
+DEFAULT_FEES = {"binance_futures": (0.0002, 0.0004), "binance_spot": (0.001, 0.001), "bitmex": (-0.00025, 0.00075)}
+DEFAULT_LEVERAGE = {"binance_futures": 20, "binance_spot": 1, "bitmex": 100} #default leverage of new accounts
+MAINTENANCE_MARGIN = 0.005 #of the position value, for the margin balance fields only (no liquidations)
+
+IMMEDIATE_TIF = ["IOC", "FOK", "ImmediateOrCancel", "FillOrKill"]
+
+
+class SimulatedOrder:
+    __slots__ = ("order_id", "contract", "type", "side", "quantity", "price", "tif", "arrival", "arrived",
+                 "status", "avg_price", "executed_qty")
+
+    def __init__(self, order_id, contract: Contract, order_type: str, side: str, quantity: float, price: typing.Optional[float],
+                 tif: typing.Optional[str], arrival: int):
+        self.order_id = order_id
+        self.contract = contract
+        self.type = order_type #"market" or "limit"
+        self.side = side #"buy" or "sell"
+        self.quantity = quantity
+        self.price = price
+        self.tif = tif
+        self.arrival = arrival #time the order reaches the exchange, after the injected latency
+        self.arrived = False
+
+        self.status = "new"
+        self.avg_price = 0.0
+        self.executed_qty = 0
+
+
+class SimulatedClient:
+    #paper trading account with the interface the strategies use (platform, futures, clock, orders, balances,
+    #get_trade_size(), place_order(), get_order_status()...), the quantities and prices are rounded like the real
+    #client of the platform and the statuses are parsed by OrderStatus from the same fields as the exchange answers
+    #
+    #the orders are matched against the ticks it receives: on_quote()/on_trade() from a live client (add_simulator())
+    #or on_tick() from a ReplayEngine (add_listener()). market orders are filled at the best bid/ask, or through the
+    #order book when the live client maintains one for the symbol, limit orders when the price trades through them.
+    #orders are filled at once, not partially
+    #
+    #hundreds of strategy variants can share one live client, each with its own SimulatedClient:
+    #    simulator = SimulatedClient("binance_futures", client.contracts, {"USDT": 1000}, order_books=client.order_books)
+    #    client.add_simulator(simulator)
+    #    client.add_strategy(b_index, TechnicalStrategy(simulator, contract, "Binance", "1m", ...))
+
+    def __init__(self, platform: str, contracts: typing.Dict[str, Contract], balances: typing.Dict[str, float],
+                 clock: Clock = SYSTEM_CLOCK, latency: int = 0, fees: typing.Optional[typing.Tuple[float, float]] = None,
+                 leverage: typing.Optional[float] = None, order_books: typing.Optional[typing.Dict[str, OrderBook]] = None):
+        #balances: initial amount of each asset, XBt in BTC for bitmex. latency: milliseconds until an order reaches the exchange
+
+        self.platform = platform
+        self.futures = platform != "binance_spot"
+        self.contracts = contracts
+        self.clock = clock
+
+        self.latency = latency
+        self.maker_fee, self.taker_fee = fees if fees is not None else DEFAULT_FEES[platform]
+        self.leverage = leverage if leverage is not None else DEFAULT_LEVERAGE[platform]
+
+        self.order_books = order_books if order_books is not None else {}
+        self.prices: typing.Dict[str, typing.Dict[str, typing.Optional[float]]] = {} #symbol -> bid/ask/last, from the ticks received
+
+        self.orders = OrderCache() #same interface as the live clients, the strategies watch their orders with it
+
+        self._lock = threading.Lock() #ticks from the websocket threads, orders from the strategies and the UI
+
+        self._wallet: typing.Dict[str, float] = dict(balances) #futures: wallet balance of the margin assets, spot: free amounts
+        self._locked: typing.Dict[str, float] = {asset: 0.0 for asset in balances} #spot: reserved by the open limit orders
+        self._positions: typing.Dict[str, typing.List[float]] = {} #futures: symbol -> [signed quantity, average entry price]
+
+        self._orders: typing.Dict[typing.Any, SimulatedOrder] = {}
+        self._open_orders: typing.Dict[str, typing.List[SimulatedOrder]] = {} #symbol -> orders not filled yet, checked on each tick
+        self._next_id = 1
+
+        self.fees_paid = 0.0
+
+        self.logs = []
+
+    #contract math
+
+    def _margin_asset(self, contract: Contract) -> str:
+        return "XBt" if contract.exchange == "bitmex" else contract.quote_asset
+
+    def _value(self, contract: Contract, quantity: float, price: float) -> float:
+        #value of a quantity of contracts, in the margin asset
+        if contract.exchange != "bitmex":
+            return quantity * price
+        if contract.inverse:
+            return quantity * contract.multiplier / price
+        return quantity * contract.multiplier * price #linear and quanto
+
+    def _pnl(self, contract: Contract, quantity: float, entry_price: float, price: float) -> float:
+        #quantity: signed, positive for a long position
+        if contract.exchange == "bitmex":
+            if contract.inverse:
+                return (1 / entry_price - 1 / price) * contract.multiplier * quantity
+            return (price - entry_price) * contract.multiplier * quantity
+        return (price - entry_price) * quantity
+
+    def _mark_price(self, symbol: str) -> typing.Optional[float]:
+        prices = self.prices.get(symbol)
+        if prices is None:
+            return None
+        if prices['bid'] is not None and prices['ask'] is not None:
+            return (prices['bid'] + prices['ask']) / 2
+        return prices['last']
+
+    #account
+
+    @property
+    def balances(self) -> typing.Dict[str, Balance]:
+        with self._lock:
+            if not self.futures:
+                return {asset: Balance({'free': free, 'locked': self._locked.get(asset, 0.0)}, self.platform)
+                        for asset, free in self._wallet.items()}
+
+            initial_margin = {asset: 0.0 for asset in self._wallet}
+            unrealized_pnl = {asset: 0.0 for asset in self._wallet}
+
+            for symbol, (quantity, entry_price) in self._positions.items():
+                if quantity == 0:
+                    continue
+
+                contract = self.contracts[symbol]
+                asset = self._margin_asset(contract)
+                price = self._mark_price(symbol)
+
+                initial_margin[asset] = initial_margin.get(asset, 0.0) + self._value(contract, abs(quantity), entry_price) / self.leverage
+                if price is not None:
+                    unrealized_pnl[asset] = unrealized_pnl.get(asset, 0.0) + self._pnl(contract, quantity, entry_price, price)
+
+            balances = {}
+
+            for asset, wallet in self._wallet.items():
+                margin = initial_margin.get(asset, 0.0)
+                pnl = unrealized_pnl.get(asset, 0.0)
+                maintenance = margin * self.leverage * MAINTENANCE_MARGIN
+
+                if self.platform == "bitmex": #the exchange sends satoshis
+                    info = {'initMargin': margin, 'maintMargin': maintenance, 'marginBalance': wallet + pnl,
+                            'walletBalance': wallet, 'unrealisedPnl': pnl}
+                    balances[asset] = Balance({key: value / BITMEX_MULTIPLIER for key, value in info.items()}, "bitmex")
+                else:
+                    balances[asset] = Balance({'initialMargin': margin, 'maintMargin': maintenance, 'marginBalance': wallet + pnl,
+                                               'walletBalance': wallet, 'unrealizedProfit': pnl}, self.platform)
+
+            return balances
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        return self.balances
+
+    def get_positions(self) -> typing.Dict[str, typing.Tuple[float, float]]:
+        #futures: symbol -> (signed quantity, average entry price) of the open positions
+        with self._lock:
+            return {symbol: (quantity, entry_price) for symbol, (quantity, entry_price) in self._positions.items() if quantity != 0}
+
+    def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+        #same sizing as the client of the platform
+
+        balance = self.balances
+
+        if self.platform == "bitmex":
+            if "XBt" not in balance:
+                return None
+
+            xbt_size = balance['XBt'].wallet_balance * balance_pct / 100
+
+            if contract.inverse:
+                return int(xbt_size / (contract.multiplier / price))
+            return int(xbt_size / (contract.multiplier * price))
+
+        if contract.quote_asset not in balance:
+            return None
+
+        if self.futures:
+            balance = balance[contract.quote_asset].wallet_balance
+        else:
+            balance = balance[contract.quote_asset].free
+
+        trade_size = (balance * balance_pct / 100) / price
+
+        return round(round(trade_size / contract.lot_size) * contract.lot_size, 8)
+
+    #orders
+
+    def _round_quantity(self, contract: Contract, quantity: float) -> float:
+        if self.platform == "bitmex":
+            return round(quantity / contract.lot_size) * contract.lot_size
+        return round(int(quantity / contract.lot_size) * contract.lot_size, 8) #binance truncates
+
+    def _status(self, order: SimulatedOrder) -> OrderStatus:
+        #parsed by OrderStatus like the answers of the exchange
+
+        if self.platform == "bitmex":
+            return OrderStatus({'orderID': order.order_id, 'ordStatus': order.status.capitalize(), 'avgPx': order.avg_price,
+                                'cumQty': order.executed_qty}, "bitmex")
+
+        return OrderStatus({'orderId': order.order_id, 'status': order.status.upper(), 'avgPrice': str(order.avg_price),
+                            'executedQty': str(order.executed_qty)}, self.platform)
+
+    def _taker_price(self, order: SimulatedOrder) -> typing.Optional[float]:
+        #price of the order taking the liquidity on the other side, None if nothing is known about the book yet
+        symbol = order.contract.symbol
+
+        book = self.order_books.get(symbol)
+        if book is not None and book.synced:
+            price = book.fill_price(order.side, order.quantity)
+            if price is not None:
+                return price
+
+        prices = self.prices.get(symbol)
+        if prices is None:
+            return None
+
+        price = prices['ask'] if order.side == "buy" else prices['bid']
+
+        return price if price is not None else prices['last']
+
+    def _can_afford(self, contract: Contract, side: str, quantity: float, price: float) -> bool:
+        if not self.futures:
+            if side == "buy":
+                return self._wallet.get(contract.quote_asset, 0.0) >= quantity * price * (1 + self.taker_fee)
+            return self._wallet.get(contract.base_asset, 0.0) >= quantity
+
+        position = self._positions.get(contract.symbol, [0, 0])[0]
+        increase = quantity - abs(position) if (position > 0) != (side == "buy") and position != 0 else quantity
+        if increase <= 0: #reduces the position
+            return True
+
+        asset = self._margin_asset(contract)
+        used = sum(self._value(self.contracts[symbol], abs(q), entry_price)
+                   for symbol, (q, entry_price) in self._positions.items() if q != 0 and self._margin_asset(self.contracts[symbol]) == asset)
+
+        return self._value(contract, increase, price) / self.leverage <= self._wallet.get(asset, 0.0) - used / self.leverage
+
+    def _reserved(self, order: SimulatedOrder) -> typing.Tuple[str, float]:
+        #spot: asset and amount locked by a limit order
+        if order.side == "buy":
+            return order.contract.quote_asset, order.quantity * order.price
+        return order.contract.base_asset, order.quantity
+
+    def _release(self, order: SimulatedOrder):
+        if not self.futures and order.type == "limit":
+            asset, amount = self._reserved(order)
+            self._locked[asset] -= amount
+            self._wallet[asset] += amount
+
+    def _fill(self, order: SimulatedOrder, price: float, maker: bool) -> bool:
+        #False if the account can't pay for it anymore, the order is then rejected like by the exchange
+
+        contract = order.contract
+        quantity = order.quantity
+        fee_rate = self.maker_fee if maker else self.taker_fee
+
+        if not self.futures: #the fee is taken from the asset received
+            self._release(order) #the amount reserved by a limit order is used for the fill
+
+            if order.side == "buy":
+                cost = quantity * price
+                if self._wallet.get(contract.quote_asset, 0.0) < cost:
+                    return False
+                self._wallet[contract.quote_asset] -= cost
+                self._wallet[contract.base_asset] = self._wallet.get(contract.base_asset, 0.0) + quantity * (1 - fee_rate)
+                self.fees_paid += quantity * fee_rate * price
+            else:
+                if self._wallet.get(contract.base_asset, 0.0) < quantity:
+                    return False
+                self._wallet[contract.base_asset] -= quantity
+                self._wallet[contract.quote_asset] = self._wallet.get(contract.quote_asset, 0.0) + quantity * price * (1 - fee_rate)
+                self.fees_paid += quantity * price * fee_rate
+
+        else:
+            asset = self._margin_asset(contract)
+
+            fee = self._value(contract, quantity, price) * fee_rate
+            self._wallet[asset] = self._wallet.get(asset, 0.0) - fee
+            self.fees_paid += fee
+
+            position = self._positions.setdefault(contract.symbol, [0, 0.0])
+            held, entry_price = position
+            signed = quantity if order.side == "buy" else -quantity
+
+            if held == 0 or (held > 0) == (signed > 0): #opens or increases the position, new average entry price
+                if contract.exchange == "bitmex" and contract.inverse:
+                    entry_price = (abs(held) + quantity) / (abs(held) / entry_price + quantity / price) if held != 0 else price
+                else:
+                    entry_price = (abs(held) * entry_price + quantity * price) / (abs(held) + quantity)
+                position[0] = round(held + signed, 8) #no float residue left when the position is closed
+                position[1] = entry_price
+            else: #reduces, closes or reverses the position
+                closed = min(quantity, abs(held))
+                self._wallet[asset] += self._pnl(contract, closed if held > 0 else -closed, entry_price, price)
+
+                position[0] = round(held + signed, 8)
+                if position[0] == 0:
+                    position[1] = 0.0
+                elif (position[0] > 0) != (held > 0): #reversed, the rest is a new position
+                    position[1] = price
+
+        order.status = "filled"
+        order.avg_price = round(round(price / contract.tick_size) * contract.tick_size, 8) if not self.futures else price
+        order.executed_qty = quantity
+
+        return True
+
+    def _process(self, symbol: str, trade_price: typing.Optional[float] = None) -> typing.List[OrderStatus]:
+        #matches the open orders of the symbol with the latest prices, returns the statuses that changed
+
+        orders = self._open_orders.get(symbol)
+        if not orders:
+            return []
+
+        now = self.clock.now()
+        prices = self.prices.get(symbol, {})
+        updates = []
+
+        for order in orders:
+            if now < order.arrival: #still on its way to the exchange
+                continue
+
+            if not order.arrived: #checked against the book as a taker first
+                price = self._taker_price(order)
+                if price is None:
+                    continue
+
+                order.arrived = True
+
+                if order.type == "market" or (order.side == "buy" and price <= order.price) or \
+                        (order.side == "sell" and price >= order.price):
+                    if not self._fill(order, price, maker=False):
+                        order.status = "rejected" if self.platform != "bitmex" else "canceled"
+
+                elif order.tif in IMMEDIATE_TIF: #not marketable, canceled instead of resting in the book
+                    order.status = "expired" if self.platform != "bitmex" else "canceled"
+                    self._release(order)
+
+                else: #rests in the book
+                    continue
+
+                updates.append(order)
+                continue
+
+            #resting limit order: filled when the market trades through its price (or the book crosses it)
+            if order.side == "buy":
+                reached = (trade_price is not None and trade_price < order.price) or \
+                          (prices.get('ask') is not None and prices['ask'] <= order.price)
+            else:
+                reached = (trade_price is not None and trade_price > order.price) or \
+                          (prices.get('bid') is not None and prices['bid'] >= order.price)
+
+            if reached:
+                if not self._fill(order, order.price, maker=True):
+                    order.status = "rejected" if self.platform != "bitmex" else "canceled"
+                updates.append(order)
+
+        if len(updates) > 0:
+            self._open_orders[symbol] = [order for order in orders if order.status == "new"]
+
+        return [self._status(order) for order in updates]
+
+    def _publish(self, updates: typing.List[OrderStatus]):
+        #outside of the lock, the callbacks of the strategies can place orders
+        for order_status in updates:
+            self.orders.update(order_status)
+
+    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, price=None, tif=None) -> OrderStatus:
+        #None when the exchange would refuse the order (quantity below the lot size, not enough balance)
+
+        quantity = self._round_quantity(contract, quantity)
+        order_type = order_type.lower()
+        side = side.lower()
+
+        if quantity <= 0:
+            logger.error("Simulated %s order refused: quantity below the lot size of %s", self.platform, contract.symbol)
+            return None
+
+        if price is not None:
+            price = round(round(price / contract.tick_size) * contract.tick_size, 8)
+        elif order_type != "market":
+            logger.error("Simulated %s %s order refused: no price", self.platform, order_type)
+            return None
+
+        with self._lock:
+            if self.platform == "bitmex":
+                order_id = str(uuid.UUID(int=self._next_id)) #uuid like the exchange ids, but the same in every replay
+            else:
+                order_id = self._next_id
+            self._next_id += 1
+
+            order = SimulatedOrder(order_id, contract, order_type, side, quantity, price, tif, self.clock.now() + self.latency)
+
+            estimate = price if price is not None else self._taker_price(order)
+            if estimate is not None and not self._can_afford(contract, side, quantity, estimate):
+                logger.error("Simulated %s order refused: insufficient balance for %s %s", self.platform, quantity, contract.symbol)
+                return None
+
+            if not self.futures and order_type == "limit": #reserved until the order is filled or canceled
+                asset, amount = self._reserved(order)
+                self._wallet[asset] = self._wallet.get(asset, 0.0) - amount
+                self._locked[asset] = self._locked.get(asset, 0.0) + amount
+
+            self._orders[order_id] = order
+            self._open_orders[contract.symbol] = self._open_orders.get(contract.symbol, []) + [order]
+
+            updates = self._process(contract.symbol) #reaches the exchange now without latency
+            order_status = self._status(order)
+
+        self._publish(updates)
+
+        return order_status
+
+    def cancel_order(self, *args) -> OrderStatus:
+        #(contract, order_id) like BinanceClient or (order_id) like BitmexClient, the cancellation is not delayed
+        order_id = args[-1]
+
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+
+            if order.status == "new":
+                order.status = "canceled"
+                self._open_orders[order.contract.symbol] = [o for o in self._open_orders[order.contract.symbol] if o is not order]
+
+                self._release(order)
+
+            order_status = self._status(order)
+
+        self._publish([order_status])
+
+        return order_status
+
+    def get_order_status(self, contract: Contract, order_id) -> OrderStatus:
+        with self._lock:
+            order = self._orders.get(order_id)
+            return self._status(order) if order is not None else None
+
+    #market data
+
+    def on_quote(self, symbol: str, bid: typing.Optional[float], ask: typing.Optional[float]):
+        with self._lock:
+            prices = self.prices.get(symbol)
+            if prices is None:
+                self.prices[symbol] = {'bid': bid, 'ask': ask, 'last': None}
+            else:
+                prices['bid'] = bid
+                prices['ask'] = ask
+
+            updates = self._process(symbol)
+
+        if updates:
+            self._publish(updates)
+
+    def on_trade(self, symbol: str, price: float):
+        with self._lock:
+            prices = self.prices.get(symbol)
+            if prices is None:
+                self.prices[symbol] = {'bid': None, 'ask': None, 'last': price}
+            else:
+                prices['last'] = price
+
+            updates = self._process(symbol, price)
+
+        if updates:
+            self._publish(updates)
+
+    def on_tick(self, kind: int, exchange: str, symbol: str, timestamp: int, a: float, b: float):
+        #ReplayEngine listener, the replay clock is already set to the timestamp of the tick
+        if exchange != self.platform:
+            return
+
+        if kind == QUOTE:
+            self.on_quote(symbol, a if a == a else None, b if b == b else None) #NaN when the side was unknown
+        elif kind == TRADE_BUY or kind == TRADE_SELL:
+            self.on_trade(symbol, a)
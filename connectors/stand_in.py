@@ -0,0 +1,515 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import typing
+import uuid
+
+from aiohttp import web, WSMsgType
+
+#local stand-in for the parts of the Binance futures and Bitmex APIs the clients use: contracts, balances, orders,
+#the listen key of the Binance user data stream and the authenticated Bitmex topics. the clients are pointed to it with
+#base_url/wss_url, the flows below check the order updates arrive through the private streams:
+#python -m connectors.stand_in
+
+PUBLIC_KEY = "stand-in-key"
+SECRET_KEY = "stand-in-secret"
+
+BITMEX_PRIVATE_TOPICS = ["order", "execution", "margin", "position"]
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class StandInExchange:
+    #served by an aiohttp application in a background thread, the state is only modified by its event loop.
+    #market orders are filled fill_delay seconds after the REST answer, limit orders rest until fill_*_order()
+
+    def __init__(self, public_key: str = PUBLIC_KEY, secret_key: str = SECRET_KEY, fill_delay: float = 0.05):
+        self.public_key = public_key
+        self.secret_key = secret_key
+        self.fill_delay = fill_delay
+
+        self.prices = {"BTCUSDT": 25000.0, "XBTUSD": 25000.0} #market orders fill price
+
+        self.listen_keys: typing.List[str] = [] #valid listen keys, the expired ones are removed
+        self.keep_alives = 0
+        self._binance_users: typing.Dict[str, web.WebSocketResponse] = {} #listen key -> user data stream
+        self._binance_orders: typing.Dict[int, typing.Dict] = {}
+        self._binance_ids = itertools.count(1000)
+
+        self._bitmex_sockets: typing.Dict[web.WebSocketResponse, typing.Dict] = {} #socket -> authenticated, topics
+        self._bitmex_orders: typing.Dict[str, typing.Dict] = {}
+
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._runner: typing.Optional[web.AppRunner] = None
+        self.port: typing.Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def binance_wss_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    @property
+    def bitmex_wss_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/realtime"
+
+    def _application(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([web.get("/fapi/v1/exchangeInfo", self._binance_exchange_info),
+                        web.get("/fapi/v1/account", self._binance_account),
+                        web.route("*", "/fapi/v1/listenKey", self._binance_listen_key),
+                        web.post("/fapi/v1/order", self._binance_new_order),
+                        web.get("/fapi/v1/order", self._binance_get_order),
+                        web.get("/ws/{listen_key}", self._binance_user_stream),
+                        web.get("/stream", self._binance_market_stream),
+                        web.get("/api/v1/instrument/active", self._bitmex_instruments),
+                        web.get("/api/v1/user/margin", self._bitmex_margin),
+                        web.post("/api/v1/order", self._bitmex_new_order),
+                        web.get("/api/v1/order", self._bitmex_get_orders),
+                        web.get("/realtime", self._bitmex_realtime)])
+        return app
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+
+            self._runner = web.AppRunner(self._application())
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+
+            started.set()
+            self._loop.run_forever()
+
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        started.wait()
+
+    def stop(self):
+        self._call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _call(self, coroutine) -> typing.Any: #from the thread of the caller
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout=10)
+
+    #controls, from the flows
+
+    def fill_binance_order(self, order_id: int, price: typing.Optional[float] = None):
+        #the update is lost if the user data stream is disconnected, like on the exchange
+        self._call(self._fill_binance(order_id, price))
+
+    def fill_bitmex_order(self, order_id: str, price: typing.Optional[float] = None):
+        self._call(self._fill_bitmex(order_id, price))
+
+    def expire_listen_keys(self):
+        self._call(self._expire_listen_keys())
+
+    def drop_bitmex_connections(self):
+        self._call(self._drop_bitmex_connections())
+
+    def bitmex_subscribed(self, topic: str) -> int: #authenticated connections subscribed to the topic
+        return sum(1 for state in list(self._bitmex_sockets.values()) if state['authenticated'] and topic in state['topics'])
+
+    #binance
+
+    def _binance_signed(self, request: web.Request) -> typing.Optional[typing.Dict]:
+        #parameters of a signed request, None if the signature doesn't match. the signature is the last parameter
+        query, _, signature = request.query_string.partition("&signature=")
+        expected = hmac.new(self.secret_key.encode(), query.encode(), hashlib.sha256).hexdigest()
+
+        if request.headers.get("X-MBX-APIKEY") != self.public_key or not hmac.compare_digest(signature, expected):
+            return None
+
+        return dict(request.query)
+
+    @staticmethod
+    def _binance_error(code: int, msg: str, status: int = 400) -> web.Response:
+        return web.json_response({"code": code, "msg": msg}, status=status)
+
+    async def _binance_exchange_info(self, request: web.Request) -> web.Response:
+        return web.json_response({"symbols": [{"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT",
+                                               "pricePrecision": 2, "quantityPrecision": 3}]})
+
+    async def _binance_account(self, request: web.Request) -> web.Response:
+        if self._binance_signed(request) is None:
+            return self._binance_error(-1022, "Signature for this request is not valid.")
+
+        return web.json_response({"assets": [{"asset": "USDT", "initialMargin": "0", "maintMargin": "0",
+                                              "marginBalance": "1000", "walletBalance": "1000", "unrealizedProfit": "0"}]})
+
+    async def _binance_listen_key(self, request: web.Request) -> web.Response:
+        if request.headers.get("X-MBX-APIKEY") != self.public_key:
+            return self._binance_error(-2015, "Invalid API-key, IP, or permissions for action.", 401)
+
+        if request.method == "POST":
+            listen_key = uuid.uuid4().hex
+            self.listen_keys.append(listen_key)
+            return web.json_response({"listenKey": listen_key})
+
+        if request.method == "PUT":
+            self.keep_alives += 1
+            return web.json_response({})
+
+        return web.json_response({})
+
+    async def _binance_user_stream(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        listen_key = request.match_info['listen_key']
+        if listen_key not in self.listen_keys or listen_key in self._binance_users:
+            await ws.close()
+            return ws
+
+        self._binance_users[listen_key] = ws
+
+        async for _ in ws: #nothing is expected from the client
+            pass
+
+        if self._binance_users.get(listen_key) is ws:
+            del self._binance_users[listen_key]
+
+        return ws
+
+    async def _binance_market_stream(self, request: web.Request) -> web.WebSocketResponse:
+        #the market data streams are accepted but send nothing, only the SUBSCRIBE messages are answered
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                data = json.loads(msg.data)
+                if data.get("method") == "SUBSCRIBE":
+                    await ws.send_json({"result": None, "id": data.get("id")})
+
+        return ws
+
+    async def _binance_push(self, order: typing.Dict):
+        event = {"e": "ORDER_TRADE_UPDATE", "E": _now_ms(), "T": _now_ms(),
+                 "o": {"s": order['symbol'], "i": order['orderId'], "S": order['side'], "o": order['type'],
+                       "q": order['origQty'], "X": order['status'], "ap": order['avgPrice'], "z": order['executedQty']}}
+
+        for ws in list(self._binance_users.values()):
+            await ws.send_json(event)
+
+    async def _binance_new_order(self, request: web.Request) -> web.Response:
+        params = self._binance_signed(request)
+        if params is None:
+            return self._binance_error(-1022, "Signature for this request is not valid.")
+
+        order = {"orderId": next(self._binance_ids), "symbol": params['symbol'], "side": params['side'],
+                 "type": params['type'], "origQty": params['quantity'], "price": params.get('price', "0"),
+                 "status": "NEW", "avgPrice": "0", "executedQty": "0", "updateTime": _now_ms()}
+        self._binance_orders[order['orderId']] = order
+
+        await self._binance_push(order)
+
+        if order['type'] == "MARKET":
+            self._loop.call_later(self.fill_delay, lambda: asyncio.ensure_future(self._fill_binance(order['orderId'])))
+
+        return web.json_response(order)
+
+    async def _binance_get_order(self, request: web.Request) -> web.Response:
+        params = self._binance_signed(request)
+        if params is None:
+            return self._binance_error(-1022, "Signature for this request is not valid.")
+
+        order = self._binance_orders.get(int(params['orderId']))
+        if order is None:
+            return self._binance_error(-2013, "Order does not exist.")
+
+        return web.json_response(order)
+
+    async def _fill_binance(self, order_id: int, price: typing.Optional[float] = None):
+        order = self._binance_orders[order_id]
+
+        if price is None:
+            price = float(order['price']) if order['type'] == "LIMIT" else self.prices[order['symbol']]
+
+        order.update({"status": "FILLED", "avgPrice": str(price), "executedQty": order['origQty'], "updateTime": _now_ms()})
+
+        await self._binance_push(order)
+
+    async def _expire_listen_keys(self):
+        for listen_key, ws in list(self._binance_users.items()):
+            self.listen_keys.remove(listen_key)
+            del self._binance_users[listen_key]
+
+            await ws.send_json({"e": "listenKeyExpired", "E": _now_ms(), "listenKey": listen_key})
+            await ws.close()
+
+    #bitmex
+
+    def _bitmex_signature(self, message: str) -> str:
+        return hmac.new(self.secret_key.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    def _bitmex_authenticated(self, request: web.Request) -> bool:
+        expires = request.headers.get("api-expires", "")
+        signature = request.headers.get("api-signature", "")
+
+        return (request.headers.get("api-key") == self.public_key and
+                hmac.compare_digest(signature, self._bitmex_signature(request.method + request.path_qs + expires)))
+
+    @staticmethod
+    def _bitmex_error(msg: str, status: int = 401) -> web.Response:
+        return web.json_response({"error": {"message": msg, "name": "HTTPError"}}, status=status)
+
+    async def _bitmex_instruments(self, request: web.Request) -> web.Response:
+        return web.json_response([{"symbol": "XBTUSD", "rootSymbol": "XBT", "quoteCurrency": "USD", "tickSize": 0.5,
+                                   "lotSize": 100, "isQuanto": False, "isInverse": True, "multiplier": -100000000}])
+
+    async def _bitmex_margin(self, request: web.Request) -> web.Response:
+        if not self._bitmex_authenticated(request):
+            return self._bitmex_error("Signature not valid.")
+
+        return web.json_response([{"currency": "XBt", "initMargin": 0, "maintMargin": 0, "marginBalance": 100000000,
+                                   "walletBalance": 100000000, "unrealisedPnl": 0}])
+
+    async def _bitmex_push(self, table: str, action: str, rows: typing.List[typing.Dict]):
+        for ws, state in list(self._bitmex_sockets.items()):
+            if state['authenticated'] and table in state['topics']:
+                await ws.send_json({"table": table, "action": action, "data": rows})
+
+    async def _bitmex_new_order(self, request: web.Request) -> web.Response:
+        if not self._bitmex_authenticated(request):
+            return self._bitmex_error("Signature not valid.")
+
+        params = request.query
+        order = {"orderID": str(uuid.uuid4()), "symbol": params['symbol'], "side": params['side'],
+                 "ordType": params['ordType'], "orderQty": float(params['orderQty']),
+                 "price": float(params['price']) if 'price' in params else None,
+                 "ordStatus": "New", "avgPx": None, "cumQty": 0, "leavesQty": float(params['orderQty']),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}
+        self._bitmex_orders[order['orderID']] = order
+
+        await self._bitmex_push("order", "insert", [dict(order)])
+
+        if order['ordType'] == "Market":
+            self._loop.call_later(self.fill_delay, lambda: asyncio.ensure_future(self._fill_bitmex(order['orderID'])))
+
+        return web.json_response(order)
+
+    async def _bitmex_get_orders(self, request: web.Request) -> web.Response:
+        if not self._bitmex_authenticated(request):
+            return self._bitmex_error("Signature not valid.")
+
+        orders = [o for o in self._bitmex_orders.values() if o['symbol'] == request.query.get('symbol')]
+        if request.query.get('reverse') == "True":
+            orders.reverse()
+
+        return web.json_response(orders)
+
+    async def _fill_bitmex(self, order_id: str, price: typing.Optional[float] = None):
+        order = self._bitmex_orders[order_id]
+
+        if price is None:
+            price = order['price'] if order['ordType'] == "Limit" else self.prices[order['symbol']]
+
+        order.update({"ordStatus": "Filled", "avgPx": price, "cumQty": order['orderQty'], "leavesQty": 0})
+
+        #like the exchange, the rows only carry the fields that changed: the execution sends the quantity, the order
+        #update the status and the average price, the client has to merge them
+        await self._bitmex_push("execution", "insert", [{"execID": str(uuid.uuid4()), "orderID": order_id,
+                                                         "symbol": order['symbol'], "execType": "Trade",
+                                                         "lastQty": order['orderQty'], "lastPx": price,
+                                                         "cumQty": order['cumQty']}])
+        await self._bitmex_push("order", "update", [{"orderID": order_id, "symbol": order['symbol'],
+                                                     "ordStatus": "Filled", "avgPx": price, "leavesQty": 0}])
+
+    async def _bitmex_realtime(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        state = {"authenticated": False, "topics": set()}
+        self._bitmex_sockets[ws] = state
+
+        await ws.send_json({"info": "Welcome to the BitMEX Realtime API (stand-in)."})
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+
+            data = json.loads(msg.data)
+
+            if data.get("op") == "authKeyExpires":
+                key, expires, signature = data['args']
+                state['authenticated'] = (key == self.public_key and
+                                          hmac.compare_digest(signature, self._bitmex_signature(f"GET/realtime{expires}")))
+                await ws.send_json({"success": state['authenticated'], "request": data})
+
+            elif data.get("op") == "subscribe":
+                for topic in data['args']:
+                    if topic.split(":")[0] in BITMEX_PRIVATE_TOPICS and not state['authenticated']:
+                        await ws.send_json({"status": 401, "error": f"Authentication required for {topic}", "request": data})
+                        continue
+
+                    state['topics'].add(topic)
+                    await ws.send_json({"success": True, "subscribe": topic, "request": data})
+
+        self._bitmex_sockets.pop(ws, None)
+
+        return ws
+
+    async def _drop_bitmex_connections(self):
+        for ws in list(self._bitmex_sockets):
+            self._bitmex_sockets.pop(ws, None)
+            await ws.close()
+
+
+#flows
+
+def _wait_for(condition: typing.Callable[[], bool], what: str, timeout: float = 15):
+    deadline = time.time() + timeout
+
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError(f"Timed out waiting for {what}")
+        time.sleep(0.02)
+
+
+def _expect(condition: bool, what: str):
+    if not condition:
+        raise RuntimeError(f"Unexpected: {what}")
+
+
+def _watch(client, contract, order_id) -> threading.Event:
+    #the event is set with the final status of the order, received from the stream or the REST reconciliation
+    done = threading.Event()
+
+    def callback(order_status):
+        done.status = order_status
+        done.set()
+
+    client.orders.watch(contract, order_id, callback)
+    return done
+
+
+def binance_flow(exchange: StandInExchange):
+    from connectors.binance import BinanceClient
+
+    client = BinanceClient(exchange.public_key, exchange.secret_key, testnet=True, futures=True,
+                           base_url=exchange.base_url, wss_url=exchange.binance_wss_url, start=False)
+    client.start()
+
+    try:
+        _expect(client.ready and "BTCUSDT" in client.contracts, "binance client not ready")
+        _wait_for(lambda: len(exchange._binance_users) == 1, "the user data stream")
+        first_key = client._listen_key
+
+        contract = client.contracts["BTCUSDT"]
+
+        #market order: acknowledged NEW by REST, filled by the ORDER_TRADE_UPDATE event
+        order_status = client.place_order(contract, "MARKET", 0.01, "BUY")
+        _expect(order_status is not None and order_status.status == "new", "binance market order not acknowledged")
+
+        done = _watch(client, contract, order_status.order_id)
+        _wait_for(done.is_set, "the binance market order fill")
+        _expect(done.status.status == "filled" and done.status.avg_price == exchange.prices["BTCUSDT"], "binance fill")
+        print("binance: market order filled from the user data stream")
+
+        #keep alive of the listen key
+        client._listen_key_request("PUT", client._listen_key)
+        _expect(exchange.keep_alives == 1, "binance listen key keep alive")
+
+        #limit order filled while the stream is reconnecting: the update is lost, the REST reconciliation finds it
+        order_status = client.place_order(contract, "LIMIT", 0.01, "BUY", price=24000, tif="GTC")
+        done = _watch(client, contract, order_status.order_id)
+
+        exchange.expire_listen_keys()
+        exchange.fill_binance_order(order_status.order_id)
+
+        _wait_for(done.is_set, "the binance limit order reconciliation")
+        _expect(client._listen_key != first_key, "binance listen key not renewed")
+        _expect(done.status.status == "filled" and done.status.avg_price == 24000, "binance reconciled fill")
+        print("binance: listen key expired, new user data stream, missed fill found by REST")
+
+    finally:
+        client.close()
+
+
+def bitmex_flow(exchange: StandInExchange):
+    from connectors.bitmex import BitmexClient
+
+    client = BitmexClient(exchange.public_key, exchange.secret_key, testnet=True,
+                          base_url=exchange.base_url, wss_url=exchange.bitmex_wss_url, start=False)
+    client.start()
+
+    try:
+        _expect(client.ready and "XBTUSD" in client.contracts, "bitmex client not ready")
+        _wait_for(lambda: exchange.bitmex_subscribed("order") == 1 and exchange.bitmex_subscribed("execution") == 1,
+                  "the authenticated order and execution topics")
+
+        contract = client.contracts["XBTUSD"]
+
+        #market order: the final status is only complete once the execution and order rows are merged
+        order_status = client.place_order(contract, "Market", 100, "Buy")
+        _expect(order_status is not None and order_status.status == "new", "bitmex market order not acknowledged")
+
+        done = _watch(client, contract, order_status.order_id)
+        _wait_for(done.is_set, "the bitmex market order fill")
+        _expect(done.status.status == "filled" and done.status.executed_qty == 100, "bitmex fill")
+        _expect(order_status.order_id not in client._order_rows, "bitmex order rows of a final order kept")
+        print("bitmex: market order filled from the order and execution topics")
+
+        #limit order filled while disconnected: found by the REST reconciliation after the reconnection
+        order_status = client.place_order(contract, "Limit", 100, "Buy", price=24000)
+        done = _watch(client, contract, order_status.order_id)
+
+        exchange.drop_bitmex_connections()
+        exchange.fill_bitmex_order(order_status.order_id)
+
+        _wait_for(done.is_set, "the bitmex limit order reconciliation")
+        _expect(done.status.status == "filled" and done.status.avg_price == 24000, "bitmex reconciled fill")
+        print("bitmex: connection dropped, reconnected, missed fill found by REST")
+
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the private stream flows of the clients against a local stand-in exchange")
+    parser.add_argument("--exchange", choices=["binance", "bitmex", "all"], default="all")
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the clients")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s :: %(message)s")
+
+    #the clients cache the contracts and candles in the working directory, not in the databases of the bot
+    os.chdir(tempfile.mkdtemp(prefix="stand_in_"))
+
+    flows = [flow for name, flow in [("binance", binance_flow), ("bitmex", bitmex_flow)] if args.exchange in [name, "all"]]
+
+    for flow in flows:
+        #one server per exchange: the clients cache their contracts by base url
+        exchange = StandInExchange()
+        exchange.start()
+
+        try:
+            flow(exchange)
+        finally:
+            exchange.stop()
+
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
+import collections
+import json
+import logging
 import sqlite3
+import time
 import typing
 
+from models import Contract
+
+logger = logging.getLogger()
+
+CONTRACT_CACHE_VERSION = 1 #to increase when the attributes of Contract change, the caches of an older version are ignored
+
 
 class WorkspaceData:
     def __init__(self) -> None:
@@ -32,4 +42,88 @@ class WorkspaceData:
         self.cursor.execute(f"SELECT * FROM {table}")
         data = self.cursor.fetchall()
 
-        return data
\ No newline at end of file
+        return data
+
+
+class ContractCache: #parsed contracts of an exchange, the app starts from them instead of waiting for the exchange info
+    def __init__(self, source: str, path: str = "database.db"):
+        self.source = source #REST url of the client, testnet and live environments have different contracts
+        self._path = path #own connections, the cache is written from the refresh threads
+
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS contracts (source TEXT, symbol TEXT, data TEXT, PRIMARY KEY (source, symbol))")
+        conn.execute("CREATE TABLE IF NOT EXISTS contracts_version (source TEXT PRIMARY KEY, version INTEGER, updated_at INTEGER)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=10)
+
+    def load(self) -> typing.Dict[str, Contract]:
+        #empty if there is no cache for this source or if it was written by another version
+        conn = self._connect()
+
+        row = conn.execute("SELECT version FROM contracts_version WHERE source = ?", (self.source,)).fetchone()
+
+        contracts = collections.OrderedDict()
+
+        if row is not None and row[0] == CONTRACT_CACHE_VERSION:
+            for symbol, data in conn.execute("SELECT symbol, data FROM contracts WHERE source = ? ORDER BY symbol", (self.source,)):
+                contracts[symbol] = Contract(json.loads(data), "cache")
+
+        conn.close()
+
+        return contracts
+
+    def save(self, contracts: typing.Dict[str, Contract], symbols: typing.Optional[typing.List[str]] = None,
+             removed: typing.Optional[typing.List[str]] = None):
+        #writes the given symbols (all if None) and deletes the removed ones
+
+        conn = self._connect()
+
+        if symbols is None:
+            conn.execute("DELETE FROM contracts WHERE source = ?", (self.source,))
+            symbols = list(contracts.keys())
+
+        conn.executemany("INSERT OR REPLACE INTO contracts (source, symbol, data) VALUES (?, ?, ?)",
+                         [(self.source, symbol, json.dumps(vars(contracts[symbol]))) for symbol in symbols])
+
+        if removed:
+            conn.executemany("DELETE FROM contracts WHERE source = ? AND symbol = ?", [(self.source, symbol) for symbol in removed])
+
+        conn.execute("INSERT OR REPLACE INTO contracts_version (source, version, updated_at) VALUES (?, ?, ?)",
+                     (self.source, CONTRACT_CACHE_VERSION, int(time.time())))
+
+        conn.commit()
+        conn.close()
+
+    def apply(self, current: typing.Dict[str, Contract], fresh: typing.Dict[str, Contract]) -> typing.Dict[str, Contract]:
+        #new contracts dict with the differences between the cached contracts and the ones just downloaded
+        #the Contract objects already in use (strategies, trades) are updated in place, only the differences are saved
+
+        contracts = collections.OrderedDict()
+        changed = []
+
+        for symbol, contract in fresh.items():
+            old = current.get(symbol)
+
+            if old is None:
+                contracts[symbol] = contract
+                changed.append(symbol)
+
+            elif vars(old) != vars(contract):
+                old.__dict__.update(vars(contract))
+                contracts[symbol] = old
+                changed.append(symbol)
+
+            else:
+                contracts[symbol] = old
+
+        removed = [symbol for symbol in current if symbol not in fresh]
+
+        self.save(contracts, changed if len(current) > 0 else None, removed) #nothing cached: the old rows are replaced
+
+        if len(changed) > 0 or len(removed) > 0:
+            logger.info("Contracts of %s refreshed: %s new or changed, %s removed", self.source, len(changed), len(removed))
+
+        return contracts
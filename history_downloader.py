@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import *
+
+from candle_history import TIMEFRAME_MS, CANDLES_PAGE_SIZE
+from models import Contract
+
+logger = logging.getLogger()
+
+DOWNLOAD_WORKERS = 8 #requests in parallel, below the connections pool of the clients (DEFAULT_POOL_SIZE)
+
+#nightly refresh of the candle history, e.g. the last year of 1m, 5m and 1h candles of every binance futures contract:
+#python -m history_downloader --exchange binance_futures --timeframes 1m,5m,1h --days 365
+
+
+class HistoryDownloader:
+    #downloads the candles missing from the history of a client for many symbols/timeframes at once
+    #the periods are split into pages planned in advance, so the pages of a series are requested in parallel. the client
+    #rate limiter spaces the requests (candles are low priority, the orders of the strategies always go first)
+    #each page is saved as soon as it is received: nothing is kept in memory and an interrupted download resumes
+    #where it stopped, the pages already saved are not missing anymore
+
+    def __init__(self, client, workers: int = DOWNLOAD_WORKERS):
+        self._client = client #BinanceClient or BitmexClient
+        self._workers = workers
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock() #counters updated by the workers
+
+        self.pages_done = 0
+        self.pages_failed = 0
+        self.candles_saved = 0
+
+    def _pages(self, contracts: List[Contract], timeframes: List[str], start: int, end: int) -> Iterator[Tuple[Contract, str, int, int]]:
+        #(contract, timeframe, page start, page end) of every missing page, generated lazily
+
+        for contract in contracts:
+            for tf in timeframes:
+                page_ms = TIMEFRAME_MS[tf] * CANDLES_PAGE_SIZE
+
+                for gap_start, gap_end in self._client.missing_candles(contract, tf, start, end):
+                    for page_start in range(gap_start, gap_end + 1, page_ms):
+                        yield contract, tf, page_start, min(page_start + page_ms - TIMEFRAME_MS[tf], gap_end)
+
+    def _download_page(self, contract: Contract, tf: str, start: int, end: int):
+        if self._stop.is_set():
+            return
+
+        candles = self._client.get_candles_page(contract, tf, start, end)
+
+        if candles is None: #request failed, the page stays missing and is requested by the next run
+            with self._lock:
+                self.pages_failed += 1
+            return
+
+        candles = [c for c in candles if start <= c.timestamp <= end]
+        self._client.save_candles(contract, tf, candles, start, end)
+
+        with self._lock:
+            self.pages_done += 1
+            self.candles_saved += len(candles)
+
+    def run(self, contracts: List[Contract], timeframes: List[str], start: int, end: Optional[int] = None) -> bool:
+        #True if every missing page was downloaded
+
+        if end is None:
+            end = int(time.time() * 1000)
+
+        self._stop.clear()
+        started_at = time.time()
+
+        pending: Set[Future] = set()
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for page in self._pages(contracts, timeframes, start, end):
+                if self._stop.is_set():
+                    break
+
+                if len(pending) >= self._workers * 2: #the pages are submitted as the workers need them, not all at once
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+                pending.add(executor.submit(self._download_page, *page))
+
+            for future in pending:
+                future.result()
+
+        logger.info("History download: %s pages (%s candles) in %.1f seconds, %s failed", self.pages_done,
+                    self.candles_saved, time.time() - started_at, self.pages_failed)
+
+        return self.pages_failed == 0 and not self._stop.is_set()
+
+    def stop(self):
+        #the pages being downloaded are saved, the other ones are downloaded by the next run
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the missing candles of the local history")
+    parser.add_argument("--exchange", choices=["binance_futures", "binance_spot", "bitmex"], default="binance_futures")
+    parser.add_argument("--symbols", default="", help="comma separated, all the contracts if empty")
+    parser.add_argument("--timeframes", default="1m")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--testnet", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s :: %(message)s')
+
+    #the candles are public data, the keys can stay empty
+    public_key = os.environ.get("API_KEY", "")
+    secret_key = os.environ.get("API_SECRET", "")
+
+    if args.exchange == "bitmex":
+        from connectors.bitmex import BitmexClient
+        client = BitmexClient(public_key, secret_key, testnet=args.testnet, start=False)
+    else:
+        from connectors.binance import BinanceClient
+        client = BinanceClient(public_key, secret_key, testnet=args.testnet, futures=args.exchange == "binance_futures", start=False)
+
+    contracts = client.get_contracts()
+
+    if args.symbols != "":
+        contracts = {symbol: contracts[symbol] for symbol in args.symbols.split(",") if symbol in contracts}
+
+    downloader = HistoryDownloader(client, args.workers)
+
+    try:
+        downloader.run(list(contracts.values()), args.timeframes.split(","), int((time.time() - args.days * 86400) * 1000))
+    except KeyboardInterrupt: #the pages already saved are kept, the next run downloads the other ones
+        logger.warning("History download interrupted after %s pages", downloader.pages_done)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from typing import *
+
+
+class EMA: #exponential moving average updated one value at a time, same recursion as pandas ewm(adjust=True).mean()
+    def __init__(self, span: Optional[float] = None, com: Optional[float] = None, min_periods: int = 0):
+
+        if span is not None:
+            self._alpha = 2 / (span + 1)
+        elif com is not None:
+            self._alpha = 1 / (com + 1)
+        else:
+            raise ValueError("EMA needs a span or a com")
+
+        self._old_wt_factor = 1 - self._alpha
+        self._min_periods = max(min_periods, 1)
+
+        self._weighted = None #running weighted average
+        self._old_wt = 1.0 #sum of the weights of the previous values
+        self.nobs = 0 #number of values received so far
+
+        self.value = math.nan
+
+    def update(self, x: float) -> float:
+
+        self.nobs += 1
+
+        if self._weighted is None: #first value
+            self._weighted = x
+        else:
+            self._old_wt *= self._old_wt_factor
+
+            if self._weighted != x:
+                self._weighted = (self._old_wt * self._weighted + x) / (self._old_wt + 1)
+
+            self._old_wt += 1
+
+        self.value = self._weighted if self.nobs >= self._min_periods else math.nan
+
+        return self.value
+
+
+class MACD: #moving average convergence-divergence
+    def __init__(self, ema_fast: int, ema_slow: int, ema_signal: int):
+        self._ema_fast = EMA(span=ema_fast)
+        self._ema_slow = EMA(span=ema_slow)
+        self._ema_signal = EMA(span=ema_signal)
+
+        self.macd_line = math.nan
+        self.macd_signal = math.nan
+
+    def update(self, close: float) -> Tuple[float, float]:
+
+        self.macd_line = self._ema_fast.update(close) - self._ema_slow.update(close)
+        self.macd_signal = self._ema_signal.update(self.macd_line) #moving avg of macd line
+
+        return self.macd_line, self.macd_signal
+
+
+class RSI: #relative strength index with Wilder smoothing (com = length - 1)
+    def __init__(self, length: int):
+        self._avg_gain = EMA(com=(length - 1), min_periods=length)
+        self._avg_loss = EMA(com=(length - 1), min_periods=length)
+
+        self._prev_close = None
+
+        self.value = math.nan
+
+    def update(self, close: float) -> float:
+
+        if self._prev_close is None: #first close has no delta
+            self._prev_close = close
+            return self.value
+
+        delta = close - self._prev_close
+        self._prev_close = close
+
+        avg_gain = self._avg_gain.update(delta if delta > 0 else 0.0)
+        avg_loss = self._avg_loss.update(-delta if delta < 0 else 0.0)
+
+        if math.isnan(avg_gain) or math.isnan(avg_loss):
+            self.value = math.nan
+        elif avg_loss == 0: #same as the pandas division by zero: inf -> 100, 0 / 0 -> nan
+            self.value = 100.0 if avg_gain > 0 else math.nan
+        else:
+            rs = avg_gain / avg_loss #relative strength
+            rsi = 100 - 100 / (1 + rs)
+            self.value = round(rsi * 100) / 100 #same rounding as pandas round(2)
+
+        return self.value
+
+
+#vectorized versions over a whole array of closes, used by the backtester. value i is the indicator of candle i
+
+def rsi_series(closes: np.ndarray, length: int) -> np.ndarray:
+
+    delta = pd.Series(closes).diff()
+
+    up = delta.clip(lower=0)
+    down = -delta.clip(upper=0)
+
+    avg_gain = up.iloc[1:].ewm(com=(length - 1), min_periods=length).mean() #first value has no delta
+    avg_loss = down.iloc[1:].ewm(com=(length - 1), min_periods=length).mean()
+
+    rs = avg_gain / avg_loss #relative strength
+
+    rsi = 100 - 100 / (1 + rs)
+    rsi = rsi.round(2)
+
+    return np.concatenate(([np.nan], rsi.to_numpy()))
+
+
+def macd_series(closes: np.ndarray, ema_fast: int, ema_slow: int, ema_signal: int) -> Tuple[np.ndarray, np.ndarray]:
+
+    closes = pd.Series(closes)
+
+    macd_line = closes.ewm(span=ema_fast).mean() - closes.ewm(span=ema_slow).mean()
+    macd_signal = macd_line.ewm(span=ema_signal).mean()
+
+    return macd_line.to_numpy(), macd_signal.to_numpy()
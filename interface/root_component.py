@@ -2,10 +2,13 @@ import tkinter as tk
 from tkinter.messagebox import askquestion
 import logging
 import json
+import time
 
 from connectors.bitmex import BitmexClient
 from connectors.binance import BinanceClient
 
+from latency import LATENCY_MONITOR
+
 from interface.styling import * #access variables in styling file
 from interface.logging_component import Logging
 from interface.watchlist_component import Watchlist
@@ -33,6 +36,11 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
         self.main_menu.add_cascade(label="Workspace", menu=self.workspace_menu)
         self.workspace_menu.add_command(label="Save workspace", command=self._save_workspace)
 
+        self.latency_menu = tk.Menu(self.main_menu, tearoff=False)
+        self.main_menu.add_cascade(label="Latency", menu=self.latency_menu)
+        self.latency_menu.add_command(label="Show latency", command=self._show_latency)
+        self.latency_menu.add_command(label="Save latency histograms", command=self._save_latency)
+
         #left and right split by creating two frames in the root component
         self._left_frame = tk.Frame(self, bg=BG_COLOR) #self = root
         self._left_frame.pack(side=tk.LEFT)
@@ -40,6 +48,10 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
         self._right_frame = tk.Frame(self, bg=BG_COLOR) #self = root
         self._right_frame.pack(side=tk.LEFT) #left has priority
 
+        #contracts displayed, the clients replace their dict when the contracts are refreshed in the background
+        self._binance_contracts = self.binance.contracts
+        self._bitmex_contracts = self.bitmex.contracts
+
         self._watchlist_frame = Watchlist(self.binance.contracts, self.bitmex.contracts, self._left_frame, bg=BG_COLOR)
         self._watchlist_frame.pack(side=tk.TOP, padx=10)
 
@@ -59,11 +71,9 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
     def _ask_before_close(self): 
         result = askquestion("Confirmation", "Do you really want to exit the application?") #whether user wants to close the application
         if result == "yes":
-            self.binance.reconnect = False
-            self.bitmex.reconnect = False
+            self.binance.close()
 
-            self.binance.ws.close()
-            self.bitmex.ws.close()
+            self.bitmex.close()
 
             self.destroy() #destroys UI and terminates program
         
@@ -83,6 +93,14 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
                 self.logging_frame.add_log(log['log'])
                 log['displayed'] = True #it has now been added
         
+        #contracts
+        if self.binance.contracts is not self._binance_contracts or self.bitmex.contracts is not self._bitmex_contracts:
+            self._binance_contracts = self.binance.contracts
+            self._bitmex_contracts = self.bitmex.contracts
+
+            self._watchlist_frame.update_symbols(self._binance_contracts, self._bitmex_contracts)
+            self._strategy_frame.update_contracts()
+
         #trades and logs
         for client in [self.binance, self.bitmex]:
 
@@ -119,7 +137,7 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
                 exchange = self._watchlist_frame.body_widgets['exchange'][key].cget("text")
                 
                 if exchange == "Binance":
-                    if symbol not in self.binance.contracts:
+                    if symbol not in self.binance.contracts or not self.binance.ready: #no REST request from the UI while the client starts
                         continue
 
                     if symbol not in self.binance.ws_subscriptions["bookTicker"] and self.binance.ws_connected:
@@ -203,3 +221,17 @@ class Root(tk.Tk): #root class will inherit from tk.Tk() class
 
         self.logging_frame.add_log("Workspace saved")
 
+    def _show_latency(self):
+        lines = LATENCY_MONITOR.report()
+
+        if len(lines) == 0:
+            self.logging_frame.add_log("No latency recorded yet")
+
+        for line in lines:
+            self.logging_frame.add_log(line)
+
+    def _save_latency(self):
+        path = f"latency_{int(time.time())}.json"
+        LATENCY_MONITOR.dump(path)
+
+        self.logging_frame.add_log(f"Latency histograms saved to {path}")
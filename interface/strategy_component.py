@@ -3,6 +3,8 @@ import typing
 import tkmacosx as tkmac
 
 import json
+import logging
+import threading
 
 from interface.styling import *
 from interface.scrollable_frame import ScrollableFrame
@@ -11,13 +13,18 @@ from connectors.binance import BinanceClient
 from connectors.bitmex import BitmexClient
 
 from strategies import TechnicalStrategy, BreakoutStrategy
+from backtesting import run_backtest
+from candle_store import candles_to_array
 from utils import *
 
 from database import WorkspaceData
+from models import Contract
 
 if typing.TYPE_CHECKING:
     from interface.root_component import Root
 
+logger = logging.getLogger()
+
 class StrategyEditor(tk.Frame): #activate/deactive strategies
     def __init__(self, root: "Root", binance: BinanceClient, bitmex: BitmexClient, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -35,9 +42,7 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
         self._all_contracts = []
         self._all_timeframes = ["1m", "5m", "15m", "30m", "1h", "4h"]
 
-        for exchange, client in self._exchanges.items():
-            for symbol, contract in client.contracts.items():
-                self._all_contracts.append(symbol + "_" + exchange.capitalize())
+        self.update_contracts()
 
         self._commands_frame = tk.Frame(self, bg=BG_COLOR)
         self._commands_frame.pack(side=tk.TOP)
@@ -106,6 +111,32 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
 
         self._load_workspace()
     
+    def update_contracts(self):
+        #list updated in place for the new rows, the menus of the existing rows are rebuilt (an OptionMenu copies its values)
+        all_contracts = []
+
+        for exchange, client in self._exchanges.items():
+            for symbol in client.contracts.keys():
+                all_contracts.append(symbol + "_" + exchange.capitalize())
+
+        self._all_contracts[:] = all_contracts
+
+        for b_index, option_menu in self.body_widgets.get('contract', {}).items():
+            variable = self.body_widgets['contract_var'][b_index]
+            self._set_menu_values(option_menu, variable, all_contracts)
+
+            if variable.get() == "" and len(all_contracts) > 0: #row added before the contracts were loaded
+                variable.set(all_contracts[0])
+
+    @staticmethod
+    def _set_menu_values(option_menu: tk.OptionMenu, variable: tk.StringVar, values: typing.List[str]):
+        #replaces the choices of the menu, the current selection is kept
+        menu = option_menu['menu']
+        menu.delete(0, 'end')
+
+        for value in values:
+            menu.add_command(label=value, command=tk._setit(variable, value))
+
     def _add_strategy_row(self):
         b_index = self._body_index
 
@@ -113,9 +144,11 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
             code_name = base_param['code_name']
             if base_param['widget'] == tk.OptionMenu:
                 self.body_widgets[code_name + "_var"][b_index] = tk.StringVar()
-                self.body_widgets[code_name + "_var"][b_index].set(base_param['values'][0])
+                #no contracts before the clients have loaded them on a cold start, the menu is filled by update_contracts()
+                self.body_widgets[code_name + "_var"][b_index].set(base_param['values'][0] if len(base_param['values']) > 0 else "")
 
-                self.body_widgets[code_name][b_index] = tk.OptionMenu(self._body_frame.sub_frame, self.body_widgets[code_name + "_var"][b_index], *base_param['values']) #*allcontracts breaks down the list. ["a", "b", "c"] -> "a", "b", "c"
+                self.body_widgets[code_name][b_index] = tk.OptionMenu(self._body_frame.sub_frame, self.body_widgets[code_name + "_var"][b_index], "")
+                self._set_menu_values(self.body_widgets[code_name][b_index], self.body_widgets[code_name + "_var"][b_index], base_param['values'])
 
                 self.body_widgets[code_name][b_index].config(width=base_param['width'], highlightthickness=False, bd=-1, font=GLOBAL_FONT, indicatoron=0, bg=BG_COLOR)
 
@@ -197,6 +230,11 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
 
         validation_button.grid(row=row_nb, column=0, columnspan=2) #placed on first column but occupies two volumns
 
+        #backtest button: validates the parameters then runs the strategy on the historical candles
+        backtest_button = tkmac.Button(self._popup_window, text="Backtest", bg=BG_COLOR_2, fg=FG_COLOR, command=lambda: self._backtest_strategy(b_index), borderless=True)
+
+        backtest_button.grid(row=row_nb + 1, column=0, columnspan=2)
+
 
     def _validate_parameters(self, b_index: int):
 
@@ -212,6 +250,73 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
 
         self._popup_window.destroy()
 
+    def _backtest_strategy(self, b_index: int):
+
+        self._validate_parameters(b_index)
+
+        strat_selected = self.body_widgets['strategy_type_var'][b_index].get()
+
+        for param in self.extra_params[strat_selected]:
+            if self.additional_parameters[b_index][param['code_name']] is None:
+                self.root.logging_frame.add_log(f"Missing {param['code_name']} parameter")
+                return
+
+        if self.body_widgets['contract_var'][b_index].get() == "": #row added before the contracts were loaded
+            self.root.logging_frame.add_log("No contract selected, the contracts are still loading")
+            return
+
+        symbol = self.body_widgets['contract_var'][b_index].get().split("_")[0]
+        timeframe = self.body_widgets['timeframe_var'][b_index].get()
+        exchange = self.body_widgets['contract_var'][b_index].get().split("_")[1]
+
+        client = self._exchanges[exchange]
+
+        if not client.ready: #the client is still starting in the background
+            self.root.logging_frame.add_log(f"{exchange} is not connected yet")
+            return
+
+        if symbol not in client.contracts:
+            self.root.logging_frame.add_log(f"Unknown contract {symbol} on {exchange}")
+            return
+
+        contract = client.contracts[symbol]
+
+        take_profit = self.body_widgets['take_profit'][b_index].get()
+        stop_loss = self.body_widgets['stop_loss'][b_index].get()
+        balance_pct = self.body_widgets['balance_pct'][b_index].get()
+
+        params = dict(self.additional_parameters[b_index])
+
+        self.root.logging_frame.add_log(f"{strat_selected} backtest on {symbol} / {timeframe} started")
+
+        #the candles download and the backtest run in a worker thread, the result is logged from the Tk thread
+        t = threading.Thread(target=self._run_backtest, args=(client, contract, strat_selected, timeframe, take_profit,
+                                                               stop_loss, balance_pct, params), daemon=True)
+        t.start()
+
+    def _run_backtest(self, client: typing.Union[BinanceClient, BitmexClient], contract: Contract, strat_selected: str,
+                      timeframe: str, take_profit: str, stop_loss: str, balance_pct: str, params: typing.Dict):
+
+        try:
+            candles = client.get_historical_candles(contract, timeframe)
+
+            if len(candles) < 2:
+                msg = f"No historical data retrieved for {contract.symbol}"
+            else:
+                result = run_backtest(strat_selected, candles_to_array(candles), float(take_profit) if take_profit != "" else None,
+                                      float(stop_loss) if stop_loss != "" else None, params,
+                                      balance_pct=float(balance_pct) if balance_pct != "" else 100,
+                                      allow_short=client.platform != "binance_spot")
+
+                msg = (f"{strat_selected} backtest on {contract.symbol} / {timeframe} ({len(candles)} candles): "
+                       f"{result.summary()}")
+
+        except Exception as e:
+            logger.exception("Backtest of %s on %s failed", strat_selected, contract.symbol)
+            msg = f"{strat_selected} backtest on {contract.symbol} / {timeframe} failed: {e}"
+
+        self.root.after(0, lambda: self.root.logging_frame.add_log(msg))
+
     def _switch_strategy(self, b_index: int):
         
         for param in ["balance_pct", "take_profit", "stop_loss"]:
@@ -226,10 +331,18 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
                 self.root.logging_frame.add_log(f"Missing {param['code_name']} parameter")
                 return
         
+        if self.body_widgets['contract_var'][b_index].get() == "": #row added before the contracts were loaded
+            self.root.logging_frame.add_log("No contract selected, the contracts are still loading")
+            return
+
         symbol = self.body_widgets['contract_var'][b_index].get().split("_")[0]
         timeframe = self.body_widgets['timeframe_var'][b_index].get()
         exchange = self.body_widgets['contract_var'][b_index].get().split("_")[1]
 
+        if not self._exchanges[exchange].ready: #the client is still starting in the background
+            self.root.logging_frame.add_log(f"{exchange} is not connected yet")
+            return
+
         contract = self._exchanges[exchange].contracts[symbol]
 
         balance_pct = float(self.body_widgets['balance_pct'][b_index].get())
@@ -248,17 +361,14 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
             else:
                 return
             
-            new_strategy.candles = self._exchanges[exchange].get_historical_candles(contract, timeframe)
-
-            if len(new_strategy.candles) == 0:
+            #if successful, the strategy is added to the strategies of the client. historical candles only fetched for a new series
+            if not self._exchanges[exchange].add_strategy(b_index, new_strategy):
                 self.root.logging_frame.add_log(f"No historical data retrieved for {contract.symbol}")
                 return
             
             if exchange == "Binance":
                 self._exchanges[exchange].subscribe_channel([contract], "aggTrade")
                 self._exchanges[exchange].subscribe_channel([contract], "bookTicker")
-            
-            self._exchanges[exchange].strategies[b_index] = new_strategy #if successful, create key value pair
 
             for param in self._base_params:
                 code_name = param['code_name']
@@ -271,7 +381,7 @@ class StrategyEditor(tk.Frame): #activate/deactive strategies
 
 
         else:
-            del self._exchanges[exchange].strategies[b_index] #delete key from dictionary
+            self._exchanges[exchange].remove_strategy(b_index) #delete key from dictionary
 
             for param in self._base_params:
                 code_name = param['code_name']
@@ -73,6 +73,11 @@ class Watchlist(tk.Frame):
         for s in saved_symbols:
             self._add_symbol(s['symbol'], s['exchange'])
 
+    def update_symbols(self, binance_contracts: typing.Dict[str, Contract], bitmex_contracts: typing.Dict[str, Contract]):
+        #contracts refreshed by the clients, the lists are shared with the Autocomplete widgets
+        self.binance_symbols[:] = list(binance_contracts.keys())
+        self.bitmex_symbols[:] = list(bitmex_contracts.keys())
+
     def _remove_symbol(self, b_index: int):
 
         for h in self._headers:
@@ -0,0 +1,261 @@
+import collections
+import json
+import threading
+import time
+
+from typing import *
+
+#latencies of the path from a trade on the exchange to our order being acknowledged, in microseconds:
+#  network:       trade time on the exchange -> message received (includes the offset between the two clocks)
+#  decode:        message received -> json parsed
+#  candle:        json parsed -> candles of the symbol updated
+#  signal:        candles updated -> signal computed, the strategy decided to trade
+#  order_prepare: signal -> order request sent (trade size, logs)
+#  order_ack:     order request sent -> answer of the exchange
+#  order_fill:    order request sent -> fill received, from the answer or the private stream
+#  tick_to_order / tick_to_ack: trade time on the exchange -> order sent / acknowledged
+#the message stages are kept per exchange, the order stages per strategy and per exchange
+
+EXCHANGE_STAGES = ["network", "decode", "candle"]
+STRATEGY_STAGES = ["signal", "order_prepare", "order_ack", "order_fill", "tick_to_order", "tick_to_ack"]
+
+SUB_BUCKET_BITS = 6 #64 linear buckets per power of 2: the values are counted with less than 1/64 of error
+MAX_LATENCY = 3600 * 1000000 #1 hour, longer latencies are counted in the last bucket
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def _bucket_value(index: int) -> int:
+    #middle of the range of values counted in the bucket
+    if index < 2 << SUB_BUCKET_BITS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return ((index - (shift << SUB_BUCKET_BITS)) << shift) + (1 << (shift - 1))
+
+
+class LatencyHistogram:
+    #HDR style histogram: linear buckets for each power of 2 of the value, a range of latencies from microseconds to
+    #an hour in less than 2000 integers. recording a value is an index computation and an increment, without a lock:
+    #in the rare case two threads record the same value at the same time one count can be lost, this is monitoring
+
+    def __init__(self, max_value: int = MAX_LATENCY):
+        self._max_value = max_value
+        self.counts = [0] * (self._index(max_value) + 1)
+
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < 2 << SUB_BUCKET_BITS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1 #the 7 highest bits of the value select the bucket
+        return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+    def record(self, value: int):
+        #same computation as _index() with SUB_BUCKET_BITS = 6, inlined: called several times per trade message
+
+        if value < 128:
+            if value < 0: #clocks of the exchange and of this machine not in sync
+                value = 0
+            self.counts[value] += 1
+        else:
+            if value > self._max_value:
+                value = self._max_value
+            shift = value.bit_length() - 7
+            self.counts[(shift << 6) + (value >> shift)] += 1
+
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def min(self) -> int:
+        for index, count in enumerate(self.counts):
+            if count > 0:
+                return min(_bucket_value(index), self.max)
+        return 0
+
+    def percentile(self, pct: float) -> int:
+        counts = list(self.counts)
+        target = sum(counts) * pct / 100
+        seen = 0
+
+        for index, count in enumerate(counts):
+            seen += count
+            if count > 0 and seen >= target:
+                return min(_bucket_value(index), self.max)
+
+        return 0
+
+    def mean(self) -> float:
+        count = self.count
+        return self.total / count if count > 0 else 0
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.max = 0
+
+    def summary(self) -> Dict[str, float]:
+        summary = {"count": self.count, "mean": round(self.mean(), 1), "min": self.min, "max": self.max}
+        for pct in PERCENTILES:
+            summary[f"p{pct:g}"] = self.percentile(pct)
+        return summary
+
+    def to_dict(self) -> Dict:
+        #summary + the non empty buckets, so the histograms of several runs can be merged later
+        summary = self.summary()
+        summary['buckets'] = {_bucket_value(index): count for index, count in enumerate(list(self.counts)) if count > 0}
+        return summary
+
+
+#times of the trade being processed by a websocket thread, a list (cheaper to build than an object, one per trade):
+#[exchange, trade time on the exchange, received, decoded, candles updated or None], in nanoseconds (time.time_ns())
+TickTimes = List
+TICK_EXCHANGE = 0
+TICK_EVENT = 1
+TICK_RECEIVED = 2
+TICK_DECODED = 3
+TICK_CANDLE = 4
+
+
+class LatencyMonitor:
+    #the client records the times of each trade message, the strategies add the times of their signals and orders.
+    #a trade is processed from the message to the order by the same websocket thread, so the times of the trade being
+    #processed are kept per thread and found by the strategy without being passed through every call
+    #the websocket threads only take the timestamps and append the ticks to a deque, a background thread puts them in
+    #the histograms (the order stages, much less frequent, are recorded directly)
+
+    def __init__(self, flush_interval: float = 0.25):
+        self.enabled = True
+        self._flush_interval = flush_interval
+
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {} #(scope, stage), the scope is an exchange or a strategy
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._queue: Deque[TickTimes] = collections.deque()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None #started with the first tick
+
+    def histogram(self, scope: str, stage: str) -> LatencyHistogram:
+        histogram = self._histograms.get((scope, stage))
+
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((scope, stage), LatencyHistogram())
+
+        return histogram
+
+    def record(self, scope: str, stage: str, value: int):
+        self.histogram(scope, stage).record(value)
+
+    #market data, called by the clients
+
+    def on_trade(self, exchange: str, trade_time: int, received: int) -> Optional[TickTimes]:
+        #trade_time: ms, from the exchange. received: time.time_ns() before the message was parsed. the tick becomes
+        #the current tick of the thread until the next trade
+        if not self.enabled:
+            return None
+
+        tick = [exchange, trade_time * 1000000, received, time.time_ns(), None]
+        self._local.tick = tick
+
+        return tick
+
+    def on_trade_processed(self, tick: Optional[TickTimes]):
+        #the candles and the strategies are done with the trade
+        if tick is None:
+            return
+
+        self._queue.append(tick)
+
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def current_tick(self) -> Optional[TickTimes]:
+        #None outside of a websocket thread (UI, replay) or when disabled
+        return getattr(self._local, "tick", None) if self.enabled else None
+
+    def _flush(self):
+        with self._flush_lock: #background thread and queries
+            queue = self._queue
+            exchange_histograms = {}
+
+            for _ in range(len(queue)):
+                tick = queue.popleft()
+
+                exchange, event, received, decoded, candle = tick
+
+                histograms = exchange_histograms.get(exchange)
+                if histograms is None:
+                    histograms = tuple(self.histogram(exchange, stage) for stage in EXCHANGE_STAGES)
+                    exchange_histograms[exchange] = histograms
+
+                histograms[0].record((received - event) // 1000) #network
+                histograms[1].record((decoded - received) // 1000) #decode
+                if candle is not None:
+                    histograms[2].record((candle - decoded) // 1000)
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            self._flush()
+
+    #queries
+
+    def scopes(self) -> List[str]:
+        self._flush()
+        return sorted({scope for scope, _ in self._histograms})
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        #scope -> stage -> count, mean, min, max and percentiles in microseconds
+        self._flush() #the ticks not recorded yet
+        summary = {}
+        for (scope, stage), histogram in sorted(self._histograms.items()):
+            summary.setdefault(scope, {})[stage] = histogram.summary()
+        return summary
+
+    def report(self) -> List[str]:
+        #one line per scope and stage, for the logs and the UI
+        lines = []
+        for scope, stages in self.summary().items():
+            for stage, s in stages.items():
+                lines.append(f"{scope} {stage}: p50 {s['p50'] / 1000:.2f} ms | p99 {s['p99'] / 1000:.2f} ms | "
+                             f"max {s['max'] / 1000:.2f} ms ({s['count']})")
+        return lines
+
+    def dump(self, path: str):
+        self._flush()
+        data = {"time": int(time.time()), "unit": "us", "histograms": {}}
+
+        for (scope, stage), histogram in sorted(self._histograms.items()):
+            data['histograms'].setdefault(scope, {})[stage] = histogram.to_dict()
+
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+LATENCY_MONITOR = LatencyMonitor()
@@ -1,5 +1,6 @@
 import tkinter as tk
 import logging #logging library
+import threading
 
 from connectors.binance import BinanceClient
 from connectors.bitmex import BitmexClient
@@ -26,11 +27,17 @@ logger.addHandler(file_handler)
 #entry point to application
 if __name__ == '__main__':
 
+    #start=False: no request in the constructors, the UI is displayed at once with the cached contracts
     binance = BinanceClient("6b493fba6f464f92520a1df3c1a66b3271181ad16fe660cfa545838b60101360", #api keys from testnet.binancefuture
-                                    "b316d432d1e251fa02ca3ae3267b333d96abdd86dbd90e569981b984d7ce33f0", testnet=True, futures=True) #using testnet environment. str, str, bool
+                                    "b316d432d1e251fa02ca3ae3267b333d96abdd86dbd90e569981b984d7ce33f0", testnet=True, futures=True, start=False) #using testnet environment. str, str, bool
     
     #bitmex = BitmexClient("uXr1T711wD-3pvEpXjlkvNFx", "GEIkARqi2QZh70V77T28M2Y0zxSBh_rNGhRJIbwZAIqYCkYu", True)
-    bitmex = BitmexClient("necVI4HiTb733nqtBDKay0X_", "ftYXubQxLxdb_FBHbkj2CSTAJ1t6G_Fuf-61sV2Go8OHufBB", testnet=True)
+    bitmex = BitmexClient("necVI4HiTb733nqtBDKay0X_", "ftYXubQxLxdb_FBHbkj2CSTAJ1t6G_Fuf-61sV2Go8OHufBB", testnet=True, start=False)
+
+    #both exchanges connect in parallel, a slow one doesn't delay the other. the widgets fill in when their contracts arrive
+    for client in [binance, bitmex]:
+        t = threading.Thread(target=client.start, daemon=True)
+        t.start()
 
     # print(bitmex.place_order(bitmex.contracts['XBTUSD'], "Limit", 50, "Buy", price=20000, tif="GoodTillCancel")) #example test
     
@@ -1,9 +1,16 @@
 import dateutil.parser
-import datetime
+import calendar
+import time
 
 BITMEX_MULTIPLIER = 0.00000001
 BITMEX_TF_MINUTES = {"1m": 1, "5m": 5, "1h": 60, "1d": 1440}
 
+#fields of the Bitmex margin topic -> attributes of Balance
+BITMEX_BALANCE_FIELDS = {"initMargin": "initial_margin", "maintMargin": "maintenance_margin", "marginBalance": "margin_balance",
+                         "walletBalance": "wallet_balance", "unrealisedPnl": "unrealized_pnl"}
+
+TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400} #timeframe equivalent in seconds
+
 class Balance:
     def __init__(self, info, exchange): #info is dict, create instance variables for all keys of the dict
         if exchange == "binance_futures":
@@ -26,7 +33,7 @@ class Balance:
 
 class Candle: 
     def __init__(self, candle_info, timeframe, exchange): #creating candel models for get_historical_candles() method
-        if exchange == ["binance_futures", "binance_spot"]:
+        if exchange in ["binance_futures", "binance_spot"]:
             self.timestamp = candle_info[0]
             self.open = float(candle_info[1])
             self.high = float(candle_info[2])
@@ -35,10 +42,8 @@ class Candle:
             self.volume = float(candle_info[5])
 
         elif exchange == "bitmex": #keys are different for bitmex vs binanace
-            self.timestamp = dateutil.parser.isoparse(candle_info['timestamp']) #datetime object
-            self.timestamp = self.timestamp - datetime.timedelta(minutes=BITMEX_TF_MINUTES[timeframe])
-            # print(candle_info['timplestamp'], dateutil.parser.isoparse(candle_info['timestamp']), self.timestamp)
-            self.timestamp = int(self.timestamp.timestamp() * 1000) #unix timestamp
+            #bitmex timestamps the candles with their close time, converted to the open time like binance
+            self.timestamp = parse_bitmex_timestamp(candle_info['timestamp']) - BITMEX_TF_MINUTES[timeframe] * 60000
 
             self.open = candle_info['open']
             self.high = candle_info['high']
@@ -53,8 +58,51 @@ class Candle:
             self.low = candle_info['low']
             self.close = candle_info['close']
             self.volume = candle_info['volume']
+
+        elif exchange == "history": #row of the CandleHistory database
+            self.timestamp, self.open, self.high, self.low, self.close, self.volume = candle_info
             
 
+_BITMEX_SECONDS = dict() #"2023-06-01T12:34:56" -> unix timestamp in milliseconds, trades of a burst share the same seconds
+_BITMEX_MINUTES = dict() #"2023-06-01T12:34" -> unix timestamp in milliseconds
+_BITMEX_CACHE_SIZE = 4096
+
+
+def parse_bitmex_timestamp(timestamp: str) -> int:
+    #"2023-06-01T12:34:56.789Z" to a unix timestamp in milliseconds, without going through a datetime object
+
+    if len(timestamp) != 24 or timestamp[-1] != "Z": #not the usual format, let dateutil deal with it
+        return int(dateutil.parser.isoparse(timestamp).timestamp() * 1000)
+
+    second = timestamp[:19]
+    second_ms = _BITMEX_SECONDS.get(second)
+
+    if second_ms is None:
+        minute = timestamp[:16]
+        minute_ms = _BITMEX_MINUTES.get(minute)
+
+        if minute_ms is None:
+            minute_ms = calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                                         int(timestamp[11:13]), int(timestamp[14:16]), 0)) * 1000
+
+            if len(_BITMEX_MINUTES) >= _BITMEX_CACHE_SIZE:
+                _BITMEX_MINUTES.clear()
+            _BITMEX_MINUTES[minute] = minute_ms
+
+        second_ms = minute_ms + int(timestamp[17:19]) * 1000
+
+        if len(_BITMEX_SECONDS) >= _BITMEX_CACHE_SIZE:
+            _BITMEX_SECONDS.clear()
+        _BITMEX_SECONDS[second] = second_ms
+
+    return second_ms + int(timestamp[20:23])
+
+
+def format_bitmex_timestamp(timestamp: int) -> str:
+    #unix timestamp in milliseconds to "2023-06-01T12:34:56.789Z", for the startTime/endTime parameters
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp // 1000)) + ".{:03d}Z".format(timestamp % 1000)
+
+
 def tick_todecimals(tick_size: float) -> int:
     tick_size_str = "{0:.8f}".format(tick_size)
     while tick_size_str[-1] == "0":
@@ -108,6 +156,10 @@ class Contract: #creating contract models for get_contracts() method
             
             if self.inverse:
                 self.multiplier *= -1
+
+        elif exchange == "cache": #attributes saved by ContractCache, already parsed
+            self.__dict__.update(contract_info)
+            exchange = contract_info['exchange']
         
         self.exchange = exchange
     
@@ -133,6 +185,18 @@ class OrderStatus:
             self.avg_price = order_info['avgPx']
             self.executed_qty = order_info['cumQty']
 
+        elif exchange == "binance_futures_stream": #'o' object of an ORDER_TRADE_UPDATE user data stream event
+            self.order_id = order_info['i']
+            self.status = order_info['X'].lower()
+            self.avg_price = float(order_info['ap'])
+            self.executed_qty = float(order_info['z'])
+
+        elif exchange == "binance_spot_stream": #executionReport user data stream event
+            self.order_id = order_info['i']
+            self.status = order_info['X'].lower()
+            self.executed_qty = float(order_info['z'])
+            self.avg_price = float(order_info['Z']) / self.executed_qty if self.executed_qty > 0 else 0 #cumulative quote qty / qty
+
 class Trade:
     def __init__(self, trade_info):
         self.time: int = trade_info['time']
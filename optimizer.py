@@ -0,0 +1,117 @@
+import itertools
+import logging
+import os
+import random
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from typing import *
+
+from backtesting import run_backtest
+
+logger = logging.getLogger()
+
+BASE_PARAMS = ["take_profit", "stop_loss"] #every other key of a combination goes to other_params
+METRICS = ["pnl", "max_drawdown", "win_rate", "trades_number"]
+
+_worker_candles: Optional[np.ndarray] = None #candles of the current worker process, read from the shared memory block
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_settings: Dict = {}
+
+
+def _init_worker(shm_name: str, shape: Tuple[int, int], settings: Dict):
+    #runs once in every worker process: the candles are mapped from the shared memory block, not pickled with each task
+
+    global _worker_candles, _worker_shm, _worker_settings
+
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_candles = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+    _worker_settings = settings
+
+
+def _evaluate(combination: Dict) -> Dict:
+
+    other_params = {k: v for k, v in combination.items() if k not in BASE_PARAMS}
+
+    result = run_backtest(_worker_settings['strategy_type'], _worker_candles, combination.get('take_profit'),
+                          combination.get('stop_loss'), other_params, balance_pct=_worker_settings['balance_pct'],
+                          fee_pct=_worker_settings['fee_pct'], allow_short=_worker_settings['allow_short'])
+
+    row = dict(combination)
+    for metric in METRICS:
+        row[metric] = float(getattr(result, metric))
+
+    return row
+
+
+def _run(strategy_type: str, candles: np.ndarray, combinations: List[Dict], metric: str, workers: Optional[int],
+         balance_pct: float, fee_pct: float, allow_short: bool) -> List[Dict]:
+
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+
+    if len(combinations) == 0:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    settings = {"strategy_type": strategy_type, "balance_pct": balance_pct, "fee_pct": fee_pct, "allow_short": allow_short}
+
+    candles = np.ascontiguousarray(candles, dtype=np.float64)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(candles.nbytes, 1))
+    try:
+        np.ndarray(candles.shape, dtype=np.float64, buffer=shm.buf)[:] = candles #single copy for all the workers
+
+        start = time.time()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, candles.shape, settings)) as executor:
+            chunksize = max(1, len(combinations) // (workers * 8)) #few round trips, but still balanced between workers
+            results = list(executor.map(_evaluate, combinations, chunksize=chunksize))
+
+        logger.info("%s optimization: %s combinations on %s candles evaluated in %.1f seconds with %s workers",
+                    strategy_type, len(combinations), candles.shape[1], time.time() - start, workers)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    #lowest drawdown is the best, for the other metrics the highest
+    results.sort(key=lambda row: row[metric], reverse=metric != "max_drawdown")
+
+    return results
+
+
+def grid_search(strategy_type: str, candles: np.ndarray, param_grid: Dict[str, List], metric: str = "pnl",
+                workers: Optional[int] = None, balance_pct: float = 100, fee_pct: float = 0,
+                allow_short: bool = True) -> List[Dict]:
+    #param_grid: {"ema_fast": [8, 12], "ema_slow": [26, 30], ..., "take_profit": [1, 2], "stop_loss": [1]}
+    #returns one row per combination with its parameters and metrics, best first
+
+    keys = list(param_grid.keys())
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+
+    return _run(strategy_type, candles, combinations, metric, workers, balance_pct, fee_pct, allow_short)
+
+
+def random_search(strategy_type: str, candles: np.ndarray, param_space: Dict[str, Union[List, Tuple]],
+                  samples: int, metric: str = "pnl", workers: Optional[int] = None, seed: Optional[int] = None,
+                  balance_pct: float = 100, fee_pct: float = 0, allow_short: bool = True) -> List[Dict]:
+    #param_space values are either a list of choices or a (low, high) tuple. int bounds give int values
+
+    rng = random.Random(seed)
+
+    def draw(space):
+        if isinstance(space, tuple):
+            low, high = space
+            if isinstance(low, int) and isinstance(high, int):
+                return rng.randint(low, high)
+            return rng.uniform(low, high)
+        return rng.choice(space)
+
+    combinations = [{k: draw(space) for k, space in param_space.items()} for _ in range(samples)]
+
+    return _run(strategy_type, candles, combinations, metric, workers, balance_pct, fee_pct, allow_short)
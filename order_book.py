@@ -0,0 +1,297 @@
+import bisect
+import collections
+import itertools
+import threading
+
+from typing import *
+
+ORDER_BOOK_DEPTH = 1000 #levels of the binance snapshots
+BUCKET_SIZE = 512 #levels per bucket of a BookSide, between BUCKET_SIZE / 2 and 2 * BUCKET_SIZE
+MAX_BUFFERED_DIFFS = 3000 #binance diffs kept while the snapshot is requested, 5 minutes of the 100ms stream
+
+
+class BookSide:
+    #price levels of one side, kept sorted so the best levels are always first. the keys are split in sorted buckets
+    #of BUCKET_SIZE to 2 * BUCKET_SIZE levels (the layout of sortedcontainers.SortedList): a level update is a binary
+    #search over the buckets and one in the bucket, and only the bucket is shifted, whatever the depth of the book
+
+    def __init__(self, descending: bool):
+        self._sign = -1 if descending else 1 #bids are stored as negative keys, the best price is the lowest key for both sides
+
+        self._buckets: List[List[float]] = [] #sorted keys, each bucket before the next one
+        self._maxes: List[float] = [] #last key of each bucket
+        self._sizes: Dict[float, float] = {} #price -> size
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def clear(self):
+        self._buckets = []
+        self._maxes = []
+        self._sizes = {}
+
+    def _keys(self) -> Iterator[float]: #best level first
+        return itertools.chain.from_iterable(self._buckets)
+
+    def _insert(self, key: float):
+        if len(self._buckets) == 0:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+
+        i = bisect.bisect_left(self._maxes, key)
+
+        if i == len(self._buckets): #after the last level
+            i -= 1
+            self._buckets[i].append(key)
+            self._maxes[i] = key
+        else:
+            bisect.insort(self._buckets[i], key)
+
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * BUCKET_SIZE:
+            self._buckets[i:i + 1] = [bucket[:BUCKET_SIZE], bucket[BUCKET_SIZE:]]
+            self._maxes[i:i + 1] = [bucket[BUCKET_SIZE - 1], bucket[-1]]
+
+    def _remove(self, key: float):
+        i = bisect.bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        del bucket[bisect.bisect_left(bucket, key)]
+
+        if len(bucket) >= BUCKET_SIZE // 2 or len(self._buckets) == 1:
+            if len(bucket) > 0:
+                self._maxes[i] = bucket[-1]
+            else:
+                self.clear()
+            return
+
+        #small bucket merged with a neighbour, so the number of buckets stays proportional to the levels
+        if i > 0:
+            i -= 1
+        merged = self._buckets[i] + self._buckets[i + 1]
+
+        if len(merged) > 2 * BUCKET_SIZE:
+            half = len(merged) // 2
+            self._buckets[i:i + 2] = [merged[:half], merged[half:]]
+            self._maxes[i:i + 2] = [merged[half - 1], merged[-1]]
+        else:
+            self._buckets[i:i + 2] = [merged]
+            self._maxes[i:i + 2] = [merged[-1]]
+
+    def update(self, price: float, size: float): #a size of 0 removes the level
+        if size == 0:
+            if self._sizes.pop(price, None) is not None:
+                self._remove(price * self._sign)
+
+        else:
+            if price not in self._sizes:
+                self._insert(price * self._sign)
+            self._sizes[price] = size
+
+    def best(self) -> Optional[Tuple[float, float]]:
+        if len(self._buckets) == 0:
+            return None
+        price = self._buckets[0][0] * self._sign
+        return price, self._sizes[price]
+
+    def top(self, n: int) -> List[Tuple[float, float]]:
+        return [(key * self._sign, self._sizes[key * self._sign]) for key in itertools.islice(self._keys(), n)]
+
+    def size_at(self, price: float) -> float:
+        return self._sizes.get(price, 0)
+
+    def depth(self, price: float) -> float:
+        #total size of the levels at this price or better
+        limit = price * self._sign
+        total = 0
+
+        for key in self._keys():
+            if key > limit:
+                break
+            total += self._sizes[key * self._sign]
+
+        return total
+
+    def fill_price(self, quantity: float) -> Optional[float]:
+        #average price of a market order taking this side, None if the book is not deep enough
+        remaining = quantity
+        cost = 0
+
+        for key in self._keys():
+            price = key * self._sign
+            size = min(remaining, self._sizes[price])
+            cost += size * price
+            remaining -= size
+
+            if remaining <= 0:
+                return cost / quantity
+
+        return None
+
+
+class OrderBook: #full local order book of a symbol, updated from the depth messages of the exchange
+    def __init__(self, symbol: str, futures: bool = True):
+        self.symbol = symbol
+        self.futures = futures #the binance futures and spot diffs are chained differently
+
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+
+        self._lock = threading.Lock() #updated by the websocket thread, read by the strategies and the UI
+
+        self.synced = False #False until the snapshot is loaded, and again when a diff was missed
+        self.last_update_id = 0
+        self.timestamp = 0 #time of the last update, from the exchange
+
+        #binance diffs received while the snapshot is requested, the newest ones: a snapshot older than the first
+        #diff kept is refused by load_snapshot() and requested again
+        self._buffer: Deque[Tuple] = collections.deque(maxlen=MAX_BUFFERED_DIFFS)
+        self._first = True #next diff is the first one after the snapshot
+
+        self._ids: Dict[int, Tuple[str, float]] = {} #bitmex level id -> (side, price), the updates and deletes only send the id
+
+    def _side(self, side: str) -> BookSide:
+        return self.bids if side in ["Buy", "buy"] else self.asks
+
+    #binance: snapshot + depth diffs
+
+    def _apply_diff(self, first_id: int, last_id: int, previous_id: Optional[int], bids: List, asks: List, timestamp: int) -> bool:
+        if last_id < self.last_update_id or (not self.futures and last_id == self.last_update_id): #already in the snapshot
+            return True
+
+        if self._first:
+            if self.futures:
+                in_sequence = first_id <= self.last_update_id <= last_id
+            else:
+                in_sequence = first_id <= self.last_update_id + 1 <= last_id
+        elif self.futures:
+            in_sequence = previous_id == self.last_update_id
+        else:
+            in_sequence = first_id == self.last_update_id + 1
+
+        if not in_sequence:
+            return False
+
+        for price, size in bids:
+            self.bids.update(float(price), float(size))
+        for price, size in asks:
+            self.asks.update(float(price), float(size))
+
+        self.last_update_id = last_id
+        self.timestamp = timestamp
+        self._first = False
+
+        return True
+
+    def on_diff(self, first_id: int, last_id: int, previous_id: Optional[int], bids: List, asks: List, timestamp: int) -> bool:
+        #False if a diff was missed: the book must be reloaded from a new snapshot (load_snapshot())
+        diff = (first_id, last_id, previous_id, bids, asks, timestamp)
+
+        with self._lock:
+            if not self.synced:
+                self._buffer.append(diff)
+                return True
+
+            if self._apply_diff(*diff):
+                return True
+
+            self.synced = False
+            self._buffer.clear()
+            self._buffer.append(diff)
+
+            return False
+
+    def load_snapshot(self, bids: List, asks: List, last_update_id: int) -> bool:
+        #False if the snapshot is older than the diffs buffered meanwhile, a new one must be requested
+
+        with self._lock:
+            self.bids.clear()
+            self.asks.clear()
+
+            for price, size in bids:
+                self.bids.update(float(price), float(size))
+            for price, size in asks:
+                self.asks.update(float(price), float(size))
+
+            self.last_update_id = last_update_id
+            self._first = True
+
+            for diff in self._buffer:
+                if not self._apply_diff(*diff):
+                    return False
+
+            self._buffer.clear()
+            self.synced = True
+
+            return True
+
+    #bitmex: orderBookL2 table
+
+    def apply_l2(self, action: str, rows: List[Dict]):
+
+        with self._lock:
+            if action == "partial":
+                self.bids.clear()
+                self.asks.clear()
+                self._ids = {}
+
+            for row in rows:
+                if action in ["partial", "insert"]:
+                    self._ids[row['id']] = (row['side'], row['price'])
+                    self._side(row['side']).update(row['price'], row['size'])
+
+                elif action == "update":
+                    side, price = self._ids.get(row['id'], (row.get('side'), row.get('price')))
+                    if side is not None and price is not None:
+                        self._side(side).update(price, row['size'])
+
+                elif action == "delete":
+                    level = self._ids.pop(row['id'], None)
+                    if level is not None:
+                        self._side(level[0]).update(level[1], 0)
+
+            if action == "partial":
+                self.synced = True
+
+    def reset(self): #connection lost, the book is rebuilt by the next snapshot/partial
+        with self._lock:
+            self.synced = False
+            self._buffer.clear()
+
+    #queries
+
+    def best_bid(self) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            return self.bids.best()
+
+    def best_ask(self) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            return self.asks.best()
+
+    def top(self, n: int) -> Tuple[List[Tuple[float, float]], List[Tuple[float, float]]]:
+        #(bids, asks), the n best levels of each side as (price, size)
+        with self._lock:
+            return self.bids.top(n), self.asks.top(n)
+
+    def depth(self, side: str, price: float) -> float:
+        #size available at this price or better, on the bids ("sell") or the asks ("buy") side
+        with self._lock:
+            return (self.asks if side.lower() == "buy" else self.bids).depth(price)
+
+    def fill_price(self, side: str, quantity: float) -> Optional[float]:
+        #average price of a market order of this quantity, None if the book is not deep enough
+        with self._lock:
+            return (self.asks if side.lower() == "buy" else self.bids).fill_price(quantity)
+
+    def slippage(self, side: str, quantity: float) -> Optional[float]:
+        #in % of the best price
+        with self._lock:
+            book_side = self.asks if side.lower() == "buy" else self.bids
+
+            best = book_side.best()
+            price = book_side.fill_price(quantity)
+
+        if best is None or price is None:
+            return None
+
+        return abs(price - best[0]) / best[0] * 100
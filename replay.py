@@ -0,0 +1,192 @@
+import logging
+import time
+
+import numpy as np
+
+from typing import *
+
+from clock import SimulatedClock
+from tick_recorder import load_recording, SYMBOL, QUOTE, TRADE_BUY, TRADE_SELL
+
+if TYPE_CHECKING:
+    from strategies import Strategy
+    from aggregator import CandleSeries
+
+logger = logging.getLogger()
+
+REPLAY_CHUNK = 65536 #records converted to python values at once
+
+#listener(kind, exchange, symbol, timestamp, a, b) called for every tick before the strategies, e.g. to fill simulated orders
+TickListener = Callable[[int, str, str, int, float, float], None]
+
+
+class ReplayEngine:
+    #recorded ticks fed in timestamp order to the strategies, through the same calls as the live websocket handlers:
+    #trades -> CandleSeries.parse_trade() then Strategy.on_candle_update(), quotes -> Strategy.update_pnl()
+    #the clock of the strategies and their candles is set to the timestamp of each tick, so the results only depend
+    #on the recording. speed=None replays as fast as possible, otherwise `speed` times faster than real time
+
+    def __init__(self, paths: List[str], speed: Optional[float] = None, clock: Optional[SimulatedClock] = None):
+        self._paths = sorted(paths) #the names of the recording files start with the time they were created
+        self.speed = speed
+        self.clock = clock if clock is not None else SimulatedClock()
+
+        self._strategies: Dict[Tuple[str, str], List["Strategy"]] = {} #(exchange, symbol) -> strategies
+        self._listeners: List[TickListener] = []
+
+        self._running = False
+        self.ticks = 0 #ticks replayed
+
+    def add_strategy(self, strategy: "Strategy"):
+        #the candles of the strategy can be loaded beforehand (strategy.candles.extend()), otherwise the first candle
+        #starts with the first trade replayed
+        strategy.clock = self.clock
+        strategy.series.clock = self.clock
+
+        key = (strategy.client.platform, strategy.contract.symbol)
+        self._strategies[key] = self._strategies.get(key, []) + [strategy]
+
+    def add_listener(self, listener: TickListener):
+        self._listeners.append(listener)
+
+    def _targets(self, symbols: Dict[int, Tuple[str, str]]) -> Dict[int, Tuple[str, str, List[Tuple["CandleSeries", List["Strategy"]]], List["Strategy"]]]:
+        #symbol id -> (exchange, symbol, [(series, strategies using it)], strategies), for the symbols something listens to
+        targets = {}
+
+        for symbol_id, key in symbols.items():
+            strategies = self._strategies.get(key, [])
+
+            if len(strategies) == 0 and len(self._listeners) == 0:
+                continue
+
+            series = {} #strategies sharing a series, the candles are updated once like in the CandleAggregator
+            for strategy in strategies:
+                series.setdefault(id(strategy.series), (strategy.series, []))[1].append(strategy)
+
+            targets[symbol_id] = (key[0], key[1], list(series.values()), strategies)
+
+        return targets
+
+    def _on_trade(self, series_list: List[Tuple["CandleSeries", List["Strategy"]]], price: float, size: float, timestamp: int):
+        for series, strategies in series_list:
+            if len(series.candles) == 0:
+                open_time = timestamp - timestamp % series.tf_equiv
+                series.candles.append(open_time, price, price, price, price, size)
+                continue
+
+            tick_type = series.parse_trade(price, size, timestamp)
+
+            if len(series.candles) < 2: #no closed candle yet, the live strategies always start with the historical candles
+                continue
+
+            for strategy in strategies:
+                strategy.on_candle_update(tick_type)
+
+    @staticmethod
+    def _chunks(records: np.ndarray, symbol_ids: List[int]) -> Iterator[np.ndarray]:
+        #the ticks of the symbols replayed, in timestamp order (the trades of several exchanges arrive slightly out of
+        #order), REPLAY_CHUNK records at a time: a mask over the whole memory mapped file would copy it in memory
+        ids = np.array(symbol_ids)
+
+        def matching(chunk: np.ndarray) -> np.ndarray:
+            return np.isin(chunk['symbol'], ids) & (chunk['kind'] != SYMBOL)
+
+        ordered = True
+        last_ts = None
+        for start in range(0, len(records), REPLAY_CHUNK):
+            chunk = records[start:start + REPLAY_CHUNK]
+            timestamps = chunk['timestamp'][matching(chunk)]
+
+            if len(timestamps) == 0:
+                continue
+
+            if (last_ts is not None and timestamps[0] < last_ts) or np.any(np.diff(timestamps) < 0):
+                ordered = False
+                break
+
+            last_ts = timestamps[-1]
+
+        if ordered:
+            for start in range(0, len(records), REPLAY_CHUNK):
+                chunk = records[start:start + REPLAY_CHUNK]
+                chunk = chunk[matching(chunk)]
+                if len(chunk) > 0:
+                    yield chunk
+            return
+
+        #out of order: only the positions and timestamps of the matching ticks are kept, sorted (stable, the ties stay in
+        #the recorded order), then the ticks are read in slices of positions
+        positions = []
+        timestamps = []
+        for start in range(0, len(records), REPLAY_CHUNK):
+            chunk = records[start:start + REPLAY_CHUNK]
+            mask = matching(chunk)
+            positions.append(np.flatnonzero(mask) + start)
+            timestamps.append(chunk['timestamp'][mask])
+
+        positions = np.concatenate(positions)
+        positions = positions[np.argsort(np.concatenate(timestamps), kind="stable")]
+
+        for start in range(0, len(positions), REPLAY_CHUNK):
+            yield records[positions[start:start + REPLAY_CHUNK]]
+
+    def _replay_file(self, path: str):
+        records, symbols = load_recording(path)
+
+        targets = self._targets(symbols)
+        if len(targets) == 0:
+            return
+
+        started_at = time.time()
+        first_ts = None
+
+        for chunk in self._chunks(records, list(targets.keys())):
+            if first_ts is None:
+                first_ts = int(chunk['timestamp'][0])
+
+            for timestamp, symbol_id, kind, a, b in zip(chunk['timestamp'].tolist(), chunk['symbol'].tolist(),
+                                                          chunk['kind'].tolist(), chunk['a'].tolist(), chunk['b'].tolist()):
+                if not self._running:
+                    return
+
+                if self.speed is not None: #waits until the tick is due
+                    delay = (timestamp - first_ts) / 1000 / self.speed - (time.time() - started_at)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                self.clock.set(timestamp)
+
+                exchange, symbol, series_list, strategies = targets[symbol_id]
+
+                for listener in self._listeners:
+                    listener(kind, exchange, symbol, timestamp, a, b)
+
+                if kind == QUOTE:
+                    for strategy in strategies:
+                        if strategy.open_trades:
+                            strategy.update_pnl(a, b)
+
+                elif kind == TRADE_BUY or kind == TRADE_SELL:
+                    self._on_trade(series_list, a, b, timestamp)
+
+                self.ticks += 1
+
+    def run(self) -> int:
+        #replays every file, returns the number of ticks replayed
+        self._running = True
+        started_at = time.time()
+
+        for path in self._paths:
+            self._replay_file(path)
+            if not self._running:
+                break
+
+        self._running = False
+
+        elapsed = time.time() - started_at
+        logger.info("Replay: %s ticks in %.1f seconds (%.0f ticks/s)", self.ticks, elapsed, self.ticks / elapsed if elapsed > 0 else 0)
+
+        return self.ticks
+
+    def stop(self): #from another thread
+        self._running = False
@@ -1,12 +1,12 @@
 import logging
-import pandas as pd
-import time
-
-from threading import Timer #can call function with a delay
 
 from typing import *
 
 from models import *
+from indicators import MACD, RSI
+from aggregator import CandleSeries
+from trigger_book import TriggerBook
+from latency import LATENCY_MONITOR, TickTimes, TICK_EVENT, TICK_DECODED, TICK_CANDLE, now_us
 
 if TYPE_CHECKING:
     from connectors.bitmex import BitmexClient
@@ -14,116 +14,141 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger()
 
-TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400} #timeframe equivalent in seconds
-
 
 class Strategy:
     def __init__(self, client: Union["BitmexClient", "BinanceClient"], contract: Contract, exchange: str,
                 timeframe: str, balance_pct: float, take_profit: float, stop_loss: float, strat_name):
         
         self.client = client #can call all methods from two connectors
+        self.clock = client.clock #time of the trades, simulated during a replay
 
         self.contract = contract
         self.exchange = exchange
         self.tf = timeframe
-        self.tf_equiv = TF_EQUIV[timeframe] * 1000 #convert to milliseconds
         self.balance_pct = balance_pct
         self.take_profit = take_profit
         self.stop_loss = stop_loss
 
         self.strat_name = strat_name
+        self.latency_scope = f"{exchange} {strat_name} {contract.symbol} {timeframe}" #name of its latency histograms
 
         self.ongoing_position = False
 
-        self.candles: List[Candle] = []
+        #self.series / self.candles: the shared series set by CandleAggregator.subscribe(), see __getattr__()
         self.trades: List[Trade] = []
+        self.open_trades: List[Trade] = [] #replaced instead of modified, so it can be looped over while a trade gets closed
+        self._triggers = TriggerBook(take_profit, stop_loss)
         self.logs = []
     
+    def __getattr__(self, name: str):
+        #only called while the attribute is missing: a strategy not subscribed to a CandleAggregator (replay, benchmarks)
+        #builds its own series the first time it is used, a subscribed one never allocates a buffer it would not use
+        if name in ("series", "candles"):
+            self.series = CandleSeries(self.exchange, self.contract, self.tf, self.clock)
+            self.candles = self.series.candles
+            return getattr(self, name)
+
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
     
     def parse_trades(self, price: float, size: float, timestamp: int) -> str:
-        #3 cases: update same current candle, new candle, or new candle + missing candles
+        #builds the candles of a strategy that is not attached to a CandleAggregator
 
-        timestamp_diff = int(time.time() * 1000) - timestamp
-        if timestamp_diff >= 2000:
-            logger.warning("%s %s: %s milliseconds of difference between the current time and the trade time", 
-                    self.exchange, self.contract.symbol, timestamp_diff)
+        tick_type = self.series.parse_trade(price, size, timestamp)
 
-        last_candle = self.candles[-1]
+        if tick_type == "same_candle":
+            self._check_tp_sl()
 
-        if timestamp < last_candle.timestamp + self.tf_equiv: #same candle
-            last_candle.close = price #new price will be close/last price of the candle
-            last_candle.volume += size
+        return tick_type
 
-            if price > last_candle.high:
-                last_candle.high = price
-            elif price < last_candle.low:
-                last_candle.low = price
+    def on_candle_update(self, tick_type: str): #called by the CandleAggregator once the shared candles are updated
 
-            #check take profit / stop loss
-            for trade in self.trades:
-                if trade.status == "open" and trade.entry_price is not None:
-                    self._check_tp_sl(trade)
-            
-            return "same_candle"
+        if tick_type == "same_candle":
+            self._check_tp_sl()
 
-        elif timestamp >= last_candle.timestamp + 2 * self.tf_equiv: #missing candles
-            
-            missing_candles = int((timestamp - last_candle.timestamp) / self.tf_equiv) - 1 #how many we are missing
+        self.check_trade(tick_type)
 
-            logger.info("%s missing %s candles for %s %s (%s %s)", self.exchange, missing_candles, self.contract.symbol, self.tf, timestamp, last_candle.timestamp)
+    def update_pnl(self, bid: float, ask: float): #called by the client with the new prices of the contract
 
-            for missing in range(missing_candles):
-                new_ts = last_candle.timestamp + self.tf_equiv
-                candle_info = {'ts': new_ts, 'open': last_candle.close, 'high': last_candle.close, 'low': last_candle.close, 'close': last_candle.close, 'volume': 0}
-                
-                new_candle = Candle(candle_info, self.tf, "parse_trade")
+        for trade in self.open_trades:
+            if trade.entry_price is None:
+                continue
 
-                self.candles.append(new_candle)
+            if trade.contract.exchange == "bitmex":
+                price = bid if trade.side == "long" else ask
 
-                last_candle = new_candle
+                multiplier = trade.contract.multiplier
 
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+                if trade.contract.inverse:
+                    if trade.side == "long":
+                        trade.pnl = (1 / trade.entry_price - 1 / price) * multiplier * trade.quantity
+                    elif trade.side == "short":
+                        trade.pnl = (1 / price - 1 / trade.entry_price) * multiplier * trade.quantity
+                else:
+                    if trade.side == "long":
+                        trade.pnl = (price - trade.entry_price) * multiplier * trade.quantity
+                    elif trade.side == "short":
+                        trade.pnl = (trade.entry_price - price) * multiplier * trade.quantity
 
-            self.candles.append(new_candle)
+            else:
+                if trade.side == "long":
+                    trade.pnl = (bid - trade.entry_price) * trade.quantity
+                elif trade.side == "short":
+                    trade.pnl = (trade.entry_price - bid) * trade.quantity
 
-            return "new_candle"
+    def _on_entry_order_update(self, trade: Trade, order_status: OrderStatus, sent_at: Optional[int] = None):
+        #called by the client order cache when the entry order reaches a final status
 
+        logger.info("%s order status: %s", self.exchange, order_status.status)
 
-        elif timestamp >= last_candle.timestamp + self.tf_equiv: #new candle
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+        if order_status.status == "filled":
+            if sent_at is not None:
+                self._record_latency("order_fill", now_us() - sent_at)
+            trade.entry_price = order_status.avg_price
+            trade.quantity = order_status.executed_qty
+            self._triggers.add(trade) #take profit / stop loss prices are known once the entry price is
+        else: #canceled, expired or rejected: no position was opened
+            self._add_log(f"Entry order on {self.contract.symbol} {self.tf} {order_status.status}")
+            trade.status = order_status.status
+            self.open_trades = [t for t in self.open_trades if t is not trade]
+            self.ongoing_position = False
 
-            self.candles.append(new_candle)
 
-            logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
+    def _record_latency(self, stage: str, value: int):
+        LATENCY_MONITOR.record(self.latency_scope, stage, value)
+        LATENCY_MONITOR.record(self.client.platform, stage, value)
 
-            return "new_candle"
+    def _send_order(self, quantity: float, side: str, tick: Optional[TickTimes], signal_at: int) -> Tuple[Optional[OrderStatus], int]:
+        #market order timed from the trade that triggered it, returns (order status, time the request was sent)
 
-    def _check_order_status(self, order_id):
-        order_status = self.client.get_order_status(self.contract, order_id)
+        sent_at = now_us()
+        order_status = self.client.place_order(self.contract, "MARKET", quantity, side)
 
-        if order_status is not None:
-            logger.info("%s order status: %s", self.exchange, order_status.status)
+        if tick is not None:
+            acked_at = now_us()
 
-            if order_status.status == "filled":
-                for trade in self.trades:
-                    if trade.entry_id == order_id:
-                        trade.entry_price = order_status.avg_price
-                        trade.quantity = order_status.executed_qty
-                        break
-                return
+            event = tick[TICK_EVENT] // 1000
+            candle = (tick[TICK_CANDLE] if tick[TICK_CANDLE] is not None else tick[TICK_DECODED]) // 1000
 
-        t = Timer(2.0, lambda: self._check_order_status(order_id))
-        t.start()
+            self._record_latency("signal", signal_at - candle)
+            self._record_latency("order_prepare", sent_at - signal_at)
+            self._record_latency("tick_to_order", sent_at - event)
 
+            if order_status is not None:
+                self._record_latency("order_ack", acked_at - sent_at)
+                self._record_latency("tick_to_ack", acked_at - event)
+
+                if order_status.status == "filled":
+                    self._record_latency("order_fill", acked_at - sent_at)
+
+        return order_status, sent_at
 
     def _open_position(self, signal_result: int):
+        signal_at = now_us()
+        tick = LATENCY_MONITOR.current_tick() #trade being processed by this thread, None during a replay
 
         if self.client.platform == "binance_spot" and signal_result == -1:
             return
@@ -137,9 +162,9 @@ class Strategy:
 
         self._add_log(f"{position_side.capitalize()} signal on {self.contract.symbol} {self.tf}")
 
-        order_status = self.client.place_order(self.contract, "MARKET", trade_size, order_side)
+        order_status, sent_at = self._send_order(trade_size, order_side, tick, signal_at)
 
-        if order_side is not None: #order is placed
+        if order_status is not None: #order is placed
             self._add_log(f"{order_side.capitalize()} order placed on {self.exchange} | Status: {order_status.status}")
 
             self.ongoing_position = True #true once order is placed
@@ -148,58 +173,47 @@ class Strategy:
 
             if order_status.status == "filled":
                 avg_fill_price = order_status.avg_price
-            else:
-                t = Timer(2.0, lambda: self._check_order_status(order_status.order_id))
-                t.start()
             
-            new_trade = Trade({"time": int(time.time() * 1000), "entry_price": avg_fill_price, "contract": self.contract,
+            new_trade = Trade({"time": self.clock.now(), "entry_price": avg_fill_price, "contract": self.contract,
                                "strategy": self.strat_name, "side": position_side, "status": "open",
                                "pnl": 0, "quantity": order_status.executed_qty, "entry_id": order_status.order_id})
             self.trades.append(new_trade)
-    
-    def _check_tp_sl(self, trade: Trade): #take profit, stop loss
+            self.open_trades = self.open_trades + [new_trade]
 
-        tp_triggered = False
-        sl_triggered = False
+            if avg_fill_price is not None:
+                self._triggers.add(new_trade)
+            else: #the fill is received from the private websocket stream of the client
+                self.client.orders.watch(self.contract, order_status.order_id, lambda status: self._on_entry_order_update(new_trade, status, sent_at if tick is not None else None))
+    
+    def _check_tp_sl(self): #take profit, stop loss
 
         price = self.candles[-1].close
 
-        if trade.side == "long":
-            if self.stop_loss is not None:
-                if price <= trade.entry_price * (1 - self.stop_loss / 100): #stop loss exit price for long trade
-                    sl_triggered = True
-            
-            if self.take_profit is not None:
-                if price >= trade.entry_price * (1 + self.take_profit / 100): 
-                    tp_triggered = True
-        
-        elif trade.side == "short":
-            if self.stop_loss is not None:
-                if price >= trade.entry_price * (1 + self.stop_loss / 100): #stop loss exit price for long trade
-                    sl_triggered = True
-            
-            if self.take_profit is not None:
-                if price <= trade.entry_price * (1 - self.take_profit / 100): 
-                    tp_triggered = True
-        
-        if tp_triggered or sl_triggered:
+        #only the trades whose take profit or stop loss price is reached come out of the trigger book
+        for trade, sl_triggered in self._triggers.pop_triggered(price):
+            signal_at = now_us()
+            tick = LATENCY_MONITOR.current_tick()
+
             self._add_log(f"{'Stop loss' if sl_triggered else 'Take profit'} for {self.contract.symbol} {self.tf} "
                           f"| Current Price = {price} (Entry price was {trade.entry_price})")
 
             order_side = "SELL" if trade.side == "long" else "BUY"
             
             if not self.client.futures:
-                current_balances = self.client.get_balances()
+                current_balances = self.client.balances #cached, kept up to date by the account stream
                 if current_balances is not None:
                     if order_side == "SELL" and self.contract.base_asset in current_balances:
                         trade.quantity = min(current_balances[self.contract.base_asset].free, trade.quantity)
 
-            order_status = self.client.place_order(self.contract, "MARKET", trade.quantity, order_side)
+            order_status, _ = self._send_order(trade.quantity, order_side, tick, signal_at)
 
             if order_status is not None:
                 self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
                 trade.status = "closed"
+                self.open_trades = [t for t in self.open_trades if t is not trade]
                 self.ongoing_position = False
+            else:
+                self._triggers.add(trade) #checked again on the next trade
 
 
 
@@ -213,48 +227,29 @@ class TechnicalStrategy(Strategy):
 
         self._rsi_length = other_params['rsi_length']
 
-    def _rsi(self) -> float: #relative strength index
-
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
+        #indicator state is updated once per closed candle instead of recomputed over the whole history
+        self._rsi_state = RSI(self._rsi_length)
+        self._macd_state = MACD(self._ema_fast, self._ema_slow, self._ema_signal)
+        self._candles_fed = 0 #number of closed candles already fed to the indicators, counted with CandleStore.total
 
-        closes = pd.Series(close_list)
+    def _update_indicators(self):
+        #feed every candle that closed since the last update, the last candle is still open
 
-        delta = closes.diff().dropna()
+        closed_total = self.candles.total - 1
+        pending = min(closed_total - self._candles_fed, len(self.candles) - 1) #older candles have left the buffer
 
-        up, down = delta.copy(), delta.copy()
-        up[up < 0] = 0
-        down[down > 0] = 0
+        if pending > 0:
+            for close in self.candles.closes[-pending - 1:-1].tolist(): #view of the closes, only the new values are copied
+                self._rsi_state.update(close)
+                self._macd_state.update(close)
 
-        avg_gain = up.ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean() #com: Center of Mass
-        avg_loss = down.abs().ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
+        self._candles_fed = max(closed_total, self._candles_fed)
 
-        rs = avg_gain / avg_loss #relative strength
+    def _rsi(self) -> float: #relative strength index of the last closed candle
+        return self._rsi_state.value
 
-        rsi = 100 - 100 / (1 + rs)
-        rsi = rsi.round(2)
-
-        return rsi.iloc[-2]
-
-    
-    def _macd(self) -> Tuple[float, float]: #moving average convergence-divergence. EMA: Exponential Moving Average
-        #1. fast EMA calculation 2. slow EMA 3. fast EMA - slow EMA 4. EMA on result to 3
-
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
-
-        closes = pd.Series(close_list)
-
-        #ewm for exponential weighted functions
-        ema_fast = closes.ewm(span=self._ema_fast).mean() 
-        ema_slow = closes.ewm(span=self._ema_slow).mean()
-
-        macd_line = ema_fast - ema_slow
-        macd_signal = macd_line.ewm(span=self._ema_signal).mean() #moving avg of macd line - depends on signal being above/below signal line
-
-        return macd_line.iloc[-2], macd_signal.iloc[-2] #-1 represents new one, not one just finished
+    def _macd(self) -> Tuple[float, float]: #moving average convergence-divergence of the last closed candle
+        return self._macd_state.macd_line, self._macd_state.macd_signal
 
     def _check_signal(self):
 
@@ -273,6 +268,9 @@ class TechnicalStrategy(Strategy):
             return 0
 
     def check_trade(self, tick_type: str):
+        if tick_type == "new_candle":
+            self._update_indicators() #keep the indicators up to date even while a position is open
+
         #check only when new candle
         if tick_type == "new_candle" and not self.ongoing_position:
             signal_result = self._check_signal()
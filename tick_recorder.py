@@ -0,0 +1,209 @@
+import collections
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from typing import *
+
+logger = logging.getLogger()
+
+RECORDINGS_DIRECTORY = "recordings"
+MAX_FILE_SIZE = 256 * 1024 * 1024 #bytes, a new file is started after that (and at midnight UTC)
+
+EXCHANGE_IDS = {"binance_futures": 1, "binance_spot": 2, "bitmex": 3}
+EXCHANGE_NAMES = {exchange_id: name for name, exchange_id in EXCHANGE_IDS.items()}
+
+#record kinds
+SYMBOL = 0 #symbol id -> name, written before the first tick of the symbol and at the start of every file
+TRADE_BUY = 1 #a = price, b = size, the buyer was the taker
+TRADE_SELL = 2
+QUOTE = 3 #a = bid, b = ask
+
+#28 bytes per record: timestamp (ms), symbol id, exchange id, kind, a, b. the symbol records hold the name in place of a and b
+RECORD_FIELDS = "qHBBdd"
+RECORD = struct.Struct("<" + RECORD_FIELDS)
+SYMBOL_RECORD = struct.Struct("<qHBB16s")
+TICK_DTYPE = np.dtype([("timestamp", "<i8"), ("symbol", "<u2"), ("exchange", "u1"), ("kind", "u1"), ("a", "<f8"), ("b", "<f8")])
+SYMBOL_DTYPE = np.dtype([("timestamp", "<i8"), ("symbol", "<u2"), ("exchange", "u1"), ("kind", "u1"), ("name", "S16")])
+
+PACK_BATCH = 1024
+BATCH_FORMAT = "<" + RECORD_FIELDS * PACK_BATCH
+
+
+class TickChannel: #recorder of one exchange client, called from its websocket thread
+    __slots__ = ("_recorder", "_exchange_id", "_ids", "_append")
+
+    def __init__(self, recorder: "TickRecorder", exchange: str):
+        self._recorder = recorder
+        self._exchange_id = EXCHANGE_IDS[exchange]
+        self._ids: Dict[str, int] = {} #symbol -> id
+        self._append = recorder._queue.append #a deque append, never blocks
+
+    def _symbol_id(self, symbol: str) -> int:
+        symbol_id = self._ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self._recorder._register(self._exchange_id, symbol)
+            self._ids[symbol] = symbol_id
+        return symbol_id
+
+    def trade(self, symbol: str, timestamp: Optional[int], price: float, size: float, sell: bool):
+        #sell: the seller was the taker
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        self._append((timestamp, self._symbol_id(symbol), self._exchange_id, TRADE_SELL if sell else TRADE_BUY, price, size))
+
+    def quote(self, symbol: str, timestamp: Optional[int], bid: Optional[float], ask: Optional[float]):
+        #timestamp None when the exchange doesn't send one (binance spot bookTicker), the time of reception is used
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        self._append((timestamp, self._symbol_id(symbol), self._exchange_id, QUOTE,
+                      bid if bid is not None else np.nan, ask if ask is not None else np.nan))
+
+
+class TickRecorder:
+    #ticks received by the clients written as fixed width binary records in append-only files
+    #the websocket threads only append tuples to a deque, a background thread packs and writes them
+
+    def __init__(self, directory: str = RECORDINGS_DIRECTORY, max_file_size: int = MAX_FILE_SIZE, flush_interval: float = 0.25):
+        self.directory = directory
+        self._max_file_size = max_file_size
+        self._flush_interval = flush_interval
+
+        self._queue: Deque[Tuple] = collections.deque()
+
+        self._lock = threading.Lock() #symbol ids are registered by the threads of several clients
+        self._symbols: List[Tuple] = [] #symbol records, repeated at the start of each file
+        self._next_id = 0 #the ids are unique for all the exchanges
+
+        self._file = None
+        self._file_size = 0
+        self._file_day = ""
+        self.path: Optional[str] = None #file being written
+        self.records_written = 0
+
+        self._running = True
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def channel(self, exchange: str) -> TickChannel:
+        return TickChannel(self, exchange)
+
+    def _register(self, exchange_id: int, symbol: str) -> int:
+        name = symbol.encode()
+        if len(name) > 16:
+            logger.warning("Tick recorder: symbol %s truncated to 16 characters", symbol)
+
+        with self._lock:
+            symbol_id = self._next_id
+            self._next_id += 1
+
+            record = (int(time.time() * 1000), symbol_id, exchange_id, SYMBOL, name[:16])
+            self._symbols.append(record)
+            self._queue.append(record)
+
+        return symbol_id
+
+    def _pack(self, records: List[Tuple]) -> bytes:
+        #the ticks are packed by batches of PACK_BATCH records with one struct call, less time holding the GIL
+        #than a call per record (the websocket threads are waiting for it)
+        chunks = []
+        start = 0
+
+        for i in [i for i, record in enumerate(records) if record[3] == SYMBOL] + [len(records)]:
+            for j in range(start, i, PACK_BATCH):
+                batch = records[j:min(j + PACK_BATCH, i)]
+                chunks.append(struct.pack("<" + RECORD_FIELDS * len(batch) if len(batch) < PACK_BATCH else BATCH_FORMAT,
+                                          *itertools.chain.from_iterable(batch)))
+            if i < len(records):
+                chunks.append(SYMBOL_RECORD.pack(*records[i]))
+            start = i + 1
+
+        return b"".join(chunks)
+
+    def _open_file(self):
+        if self._file is not None:
+            self._file.close()
+
+        self._file_day = time.strftime("%Y%m%d", time.gmtime())
+
+        self.path = os.path.join(self.directory, "ticks_" + time.strftime("%Y%m%d_%H%M%S", time.gmtime()) + ".bin")
+        index = 1
+        while os.path.exists(self.path): #several files in the same second
+            self.path = os.path.join(self.directory, "ticks_" + time.strftime("%Y%m%d_%H%M%S", time.gmtime()) + f"_{index}.bin")
+            index += 1
+
+        self._file = open(self.path, "ab")
+
+        with self._lock:
+            symbols = list(self._symbols)
+
+        #every file can be read on its own, it starts with the names of the symbols already registered
+        data = b"".join(SYMBOL_RECORD.pack(*record) for record in symbols)
+        self._file.write(data)
+        self._file_size = len(data)
+
+        logger.info("Tick recorder: writing %s", self.path)
+
+    def _write(self):
+        queue = self._queue
+
+        n = len(queue)
+        if n == 0:
+            return
+
+        if self._file is None or self._file_size >= self._max_file_size or time.strftime("%Y%m%d", time.gmtime()) != self._file_day:
+            self._open_file()
+
+        popleft = queue.popleft
+        data = self._pack([popleft() for _ in range(n)])
+
+        self._file.write(data)
+        self._file.flush()
+
+        self._file_size += len(data)
+        self.records_written += n
+
+    def _run(self):
+        while self._running:
+            time.sleep(self._flush_interval)
+
+            try:
+                self._write()
+            except Exception as e:
+                logger.error("Tick recorder error: %s", e)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+
+        self._write() #ticks received since the last flush
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_recording(path: str) -> Tuple[np.ndarray, Dict[int, Tuple[str, str]]]:
+    #(records, {symbol id: (exchange, symbol)}), the records are memory mapped, not read in memory
+    #the symbol records are still in the array (kind == SYMBOL), a partly written last record is ignored
+
+    count = os.path.getsize(path) // TICK_DTYPE.itemsize
+
+    if count == 0:
+        return np.zeros(0, dtype=TICK_DTYPE), {}
+
+    records = np.memmap(path, dtype=TICK_DTYPE, mode="r", shape=(count,))
+
+    symbols = {}
+    for record in records[records['kind'] == SYMBOL].view(SYMBOL_DTYPE):
+        symbols[int(record['symbol'])] = (EXCHANGE_NAMES[int(record['exchange'])], record['name'].decode())
+
+    return records, symbols
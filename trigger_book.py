@@ -0,0 +1,123 @@
+import heapq
+import math
+import threading
+
+from typing import *
+
+from models import Trade
+
+
+class TriggerBook: #take profit / stop loss prices of the open trades of a strategy, sorted so a tick only checks the nearest ones
+    def __init__(self, take_profit: Optional[float], stop_loss: Optional[float]):
+        self._take_profit = take_profit
+        self._stop_loss = stop_loss
+
+        self._lock = threading.Lock() #trades are added from the order stream thread
+
+        #heaps of (key, sequence, trade), the key is negated for the max heaps
+        self._long_sl = [] #max heap, triggered when price <= level
+        self._long_tp = [] #min heap, triggered when price >= level
+        self._short_sl = [] #min heap, triggered when price >= level
+        self._short_tp = [] #max heap, triggered when price <= level
+
+        self._active: Set[int] = set() #id() of the trades in the book, the entries of the removed trades are skipped lazily
+        self._queued: Dict[int, Set[int]] = {} #id() of a trade -> id() of the heaps still holding one of its entries
+        self._seq = 0
+
+        #nearest levels, a tick strictly between them can't trigger anything
+        self.long_sl = -math.inf
+        self.long_tp = math.inf
+        self.short_sl = math.inf
+        self.short_tp = -math.inf
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def add(self, trade: Trade): #the entry price of the trade must be known
+        #also called again when the exit order of a triggered trade failed: the entries it still has in the heaps
+        #become active again, only the popped ones are pushed back
+        with self._lock:
+            self._active.add(id(trade))
+
+            #same expressions as the original per tick check, so the comparisons give exactly the same results
+            if trade.side == "long":
+                if self._stop_loss is not None:
+                    self._push(self._long_sl, -(trade.entry_price * (1 - self._stop_loss / 100)), trade)
+                if self._take_profit is not None:
+                    self._push(self._long_tp, trade.entry_price * (1 + self._take_profit / 100), trade)
+
+            elif trade.side == "short":
+                if self._stop_loss is not None:
+                    self._push(self._short_sl, trade.entry_price * (1 + self._stop_loss / 100), trade)
+                if self._take_profit is not None:
+                    self._push(self._short_tp, -(trade.entry_price * (1 - self._take_profit / 100)), trade)
+
+            self._refresh()
+
+    def _push(self, heap: List, key: float, trade: Trade):
+        queued = self._queued.setdefault(id(trade), set())
+
+        if id(heap) in queued: #entry still in the heap
+            return
+
+        queued.add(id(heap))
+        self._seq += 1
+        heapq.heappush(heap, (key, self._seq, trade))
+
+    def _pop(self, heap: List):
+        trade = heapq.heappop(heap)[2]
+
+        queued = self._queued[id(trade)]
+        queued.discard(id(heap))
+        if len(queued) == 0:
+            del self._queued[id(trade)]
+
+    def _top(self, heap: List, negated: bool, default: float) -> float:
+        while len(heap) > 0 and id(heap[0][2]) not in self._active: #closed trade
+            self._pop(heap)
+
+        if len(heap) == 0:
+            return default
+
+        return -heap[0][0] if negated else heap[0][0]
+
+    def _refresh(self):
+        self.long_sl = self._top(self._long_sl, True, -math.inf)
+        self.long_tp = self._top(self._long_tp, False, math.inf)
+        self.short_sl = self._top(self._short_sl, False, math.inf)
+        self.short_tp = self._top(self._short_tp, True, -math.inf)
+
+    def pop_triggered(self, price: float) -> List[Tuple[Trade, bool]]:
+        #(trade, stop loss triggered) for every trade whose take profit or stop loss is reached, they leave the book
+
+        if self.long_sl < price < self.long_tp and self.short_tp < price < self.short_sl:
+            return [] #constant time path for most ticks
+
+        triggered = {}
+
+        with self._lock:
+            for heap, negated, is_sl in [(self._long_sl, True, True), (self._short_sl, False, True),
+                                         (self._long_tp, False, False), (self._short_tp, True, False)]:
+                while len(heap) > 0:
+                    key, seq, trade = heap[0]
+
+                    if id(trade) not in self._active:
+                        self._pop(heap)
+                        continue
+
+                    level = -key if negated else key
+
+                    if (price > level) if negated else (price < level): #max heaps trigger below the level, min heaps above
+                        break
+
+                    self._pop(heap)
+
+                    if id(trade) not in triggered: #stop loss first, like the original message
+                        triggered[id(trade)] = (trade, is_sl)
+
+            for trade_id in triggered:
+                self._active.discard(trade_id)
+
+            self._refresh()
+
+        return list(triggered.values())